@@ -0,0 +1,308 @@
+# autosave_writer.py
+
+import glob
+import json
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+from queue import Queue
+
+import numpy as np
+from PyQt6.QtCore import QObject, QTimer
+
+from recorder import TestRecorder
+
+# --- FORMATO FILE .utmrec (append-only, little-endian) ---
+#
+#   header : MAGIC | u32 lunghezza | JSON (metadati iniziali, nomi colonne)
+#   chunk  : CHUNK_MAGIC | u32 righe | u32 colonne | u32 crc32 | float64[colonne, righe]
+#   ...
+#   footer : FOOTER_MAGIC | u32 lunghezza | JSON (indice chunk, metadati finali) | u32 crc32
+#   trailer: u64 offset del footer | END_MAGIC
+#
+# Ogni chunk è scritto e sincronizzato su disco (fsync) prima del successivo:
+# dopo un crash il file contiene header + chunk completi + al più un chunk
+# troncato, che la lettura riconosce dalla CRC e scarta. Footer e trailer
+# esistono solo se la registrazione è stata chiusa regolarmente.
+MAGIC = b"UTMREC01"
+CHUNK_MAGIC = b"CHNK"
+FOOTER_MAGIC = b"FOOT"
+END_MAGIC = b"UTMEND01"
+FILE_EXTENSION = ".utmrec"
+
+_CHUNK_HEADER = struct.Struct("<4sIII")
+_TRAILER = struct.Struct("<Q8s")
+
+# Registrazioni aperte in scrittura da questo processo: non sono "interrotte"
+_open_recordings = set()
+
+
+def _json_default(value):
+    """ Serializzazione tollerante dei metadati (tipi NumPy, oggetti non JSON). """
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _dump_json(obj):
+    return json.dumps(obj, default=_json_default).encode("utf-8")
+
+
+class RecordingWriter:
+    """
+    Scrive un file `.utmrec` da un thread in background. `append()` accoda
+    un blocco di campioni (array colonne x righe, vedi
+    `TestRecorder.chunk()`) e ritorna subito; il thread lo scrive e fa
+    `fsync`. `close()` scrive footer e indice e attende la fine del thread.
+    """
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self.error = None        # prima eccezione del thread di scrittura (se c'è)
+        self.rows_written = 0
+        self._index = []         # [offset, righe] per ogni chunk scritto
+        self._queue = Queue()
+        self._file = open(path, "wb")
+        _open_recordings.add(os.path.abspath(path))
+        header = _dump_json({"columns": list(TestRecorder.COLUMNS), "metadata": metadata or {}})
+        self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self._sync()
+        self._thread = threading.Thread(target=self._run, name="RecordingWriter", daemon=True)
+        self._thread.start()
+
+    def append(self, block):
+        """ Accoda un blocco (colonne x righe) da scrivere; i blocchi vuoti sono ignorati. """
+        if block.shape[1]:
+            self._queue.put(block)
+
+    def close(self, metadata=None):
+        """ Scrive i blocchi in coda, il footer (indice + `metadata`) e chiude il file. """
+        self._queue.put(("close", metadata or {}))
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, tuple):
+                self._finish(item[1])
+                return
+            if self.error is not None:
+                continue # file già in errore: scarta, ma continua a svuotare la coda
+            try:
+                self._write_chunk(item)
+            except Exception as e:
+                self.error = e
+                print(f"ERRORE AUTOSAVE (scrittura {self.path}): {e}")
+
+    def _write_chunk(self, block):
+        payload = np.ascontiguousarray(block, dtype="<f8").tobytes()
+        offset = self._file.tell()
+        self._file.write(_CHUNK_HEADER.pack(CHUNK_MAGIC, block.shape[1], block.shape[0],
+                                            zlib.crc32(payload)))
+        self._file.write(payload)
+        self._sync()
+        self._index.append([offset, block.shape[1]])
+        self.rows_written += block.shape[1]
+
+    def _finish(self, metadata):
+        try:
+            if self.error is None:
+                _write_footer(self._file, self._index, metadata)
+        except Exception as e:
+            self.error = e
+            print(f"ERRORE AUTOSAVE (chiusura {self.path}): {e}")
+        finally:
+            self._file.close()
+            _open_recordings.discard(os.path.abspath(self.path))
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def _write_footer(file, index, metadata):
+    footer_offset = file.tell()
+    footer = _dump_json({"index": index, "metadata": metadata})
+    file.write(FOOTER_MAGIC + struct.pack("<I", len(footer)) + footer
+               + struct.pack("<I", zlib.crc32(footer)))
+    file.write(_TRAILER.pack(footer_offset, END_MAGIC))
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _read_header(file):
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Non è un file di registrazione .utmrec")
+    (length,) = struct.unpack("<I", file.read(4))
+    header = json.loads(file.read(length))
+    return header, file.tell()
+
+
+def _read_footer(file):
+    """ Footer (dizionario) se la registrazione è stata chiusa regolarmente, altrimenti None. """
+    size = file.seek(0, os.SEEK_END)
+    if size < _TRAILER.size:
+        return None
+    file.seek(size - _TRAILER.size)
+    footer_offset, end_magic = _TRAILER.unpack(file.read(_TRAILER.size))
+    if end_magic != END_MAGIC or footer_offset >= size:
+        return None
+    file.seek(footer_offset)
+    if file.read(len(FOOTER_MAGIC)) != FOOTER_MAGIC:
+        return None
+    (length,) = struct.unpack("<I", file.read(4))
+    footer = file.read(length)
+    (crc,) = struct.unpack("<I", file.read(4))
+    if zlib.crc32(footer) != crc:
+        return None
+    return json.loads(footer)
+
+
+def _scan_chunks(file, start):
+    """ Ricostruisce l'indice leggendo i chunk in sequenza; si ferma al primo incompleto o corrotto. """
+    index = []
+    file.seek(start)
+    while True:
+        offset = file.tell()
+        raw = file.read(_CHUNK_HEADER.size)
+        if len(raw) < _CHUNK_HEADER.size:
+            break
+        magic, rows, cols, crc = _CHUNK_HEADER.unpack(raw)
+        if magic != CHUNK_MAGIC:
+            break
+        payload = file.read(rows * cols * 8)
+        if len(payload) < rows * cols * 8 or zlib.crc32(payload) != crc:
+            break
+        index.append([offset, rows])
+    return index
+
+
+def read_recording(path):
+    """
+    Legge un file `.utmrec`. Restituisce `(recorder, metadata, complete)`:
+    `metadata` unisce quelli di apertura e di chiusura; `complete` è False
+    per una registrazione interrotta (crash), di cui vengono recuperati
+    tutti i chunk integri.
+    """
+    with open(path, "rb") as file:
+        header, data_start = _read_header(file)
+        footer = _read_footer(file)
+        index = footer["index"] if footer is not None else _scan_chunks(file, data_start)
+        columns = header["columns"]
+        recorder = TestRecorder(initial_capacity=max(sum(rows for _, rows in index), 16))
+        for offset, rows in index:
+            file.seek(offset)
+            _, rows, cols, _ = _CHUNK_HEADER.unpack(file.read(_CHUNK_HEADER.size))
+            block = np.frombuffer(file.read(rows * cols * 8), dtype="<f8").reshape(cols, rows)
+            recorder.extend(**{name: block[i] for i, name in enumerate(columns)
+                               if name in TestRecorder.COLUMN_INDEX})
+    metadata = dict(header.get("metadata", {}))
+    if footer is not None:
+        metadata.update(footer.get("metadata", {}))
+    return recorder, metadata, footer is not None
+
+
+def is_recording_complete(path):
+    """ True se il file ha footer e trailer validi (registrazione chiusa regolarmente). """
+    try:
+        with open(path, "rb") as file:
+            _read_header(file)
+            return _read_footer(file) is not None
+    except (OSError, ValueError, json.JSONDecodeError, struct.error):
+        return False
+
+
+def seal_recording(path, metadata=None):
+    """
+    Chiude una registrazione interrotta: tronca l'eventuale chunk parziale e
+    aggiunge footer e indice, così il file non risulta più da recuperare.
+    """
+    with open(path, "r+b") as file:
+        _, data_start = _read_header(file)
+        if _read_footer(file) is not None:
+            return
+        index = _scan_chunks(file, data_start)
+        if index:
+            offset, rows = index[-1]
+            file.seek(offset)
+            _, rows, cols, _ = _CHUNK_HEADER.unpack(file.read(_CHUNK_HEADER.size))
+            end = offset + _CHUNK_HEADER.size + rows * cols * 8
+        else:
+            end = data_start
+        file.truncate(end)
+        file.seek(end)
+        _write_footer(file, index, {"recovered": True, **(metadata or {})})
+
+
+def find_interrupted_recordings(directory="."):
+    """
+    File `AUTOSAVE_*.utmrec` in `directory` senza footer (test interrotti da
+    un crash), escluse le registrazioni ancora aperte da questo processo.
+    """
+    pattern = os.path.join(directory, f"AUTOSAVE_*{FILE_EXTENSION}")
+    return sorted(path for path in glob.glob(pattern)
+                  if os.path.abspath(path) not in _open_recordings and not is_recording_complete(path))
+
+
+def export_recording_to_xlsx(path, xlsx_path, progress_callback=None, saver=None):
+    """
+    Conversione opzionale `.utmrec` -> `.xlsx` con `DataSaver` (stesso
+    formato dell'autosave di fine test, `saver` se passato). Ritorna
+    `(ok, messaggio)`; `progress_callback` è passato a
+    `DataSaver.save_batch_to_xlsx()`.
+    """
+    from data_saver import DataSaver
+
+    recorder, metadata, _ = read_recording(path)
+    specimen = dict(metadata.get("specimen", {}))
+    specimen["test_data"] = recorder
+    if "ingest_stats" in metadata:
+        specimen["ingest_stats"] = metadata["ingest_stats"]
+    name = metadata.get("specimen_name", os.path.splitext(os.path.basename(path))[0])
+    return (saver or DataSaver()).save_batch_to_xlsx({name: specimen}, xlsx_path,
+                                         metadata.get("calibration_info", "N/A"), progress_callback)
+
+
+class LiveAutosave(QObject):
+    """
+    Autosave durante il test: ogni `interval_s` secondi (timer nel thread
+    GUI) accoda al `RecordingWriter` i campioni del `TestRecorder` arrivati
+    dall'ultimo giro. Il costo nel thread GUI è la sola copia del blocco
+    nuovo; scrittura e fsync avvengono nel thread del writer.
+    """
+
+    def __init__(self, recorder, path, metadata=None, interval_s=5.0, parent=None):
+        super().__init__(parent)
+        self.recorder = recorder
+        self.path = path
+        self._written = 0
+        self._writer = RecordingWriter(path, {"started": datetime.now().isoformat(timespec="seconds"),
+                                              **(metadata or {})})
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(100, int(interval_s * 1000)))
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    @property
+    def error(self):
+        return self._writer.error
+
+    def flush(self):
+        """ Accoda al writer i campioni nuovi del registratore. """
+        end = len(self.recorder)
+        if end > self._written:
+            self._writer.append(self.recorder.chunk(self._written, end))
+            self._written = end
+
+    def finish(self, metadata=None):
+        """
+        Ultimo flush, footer con `metadata` e chiusura (attende il writer).
+        Ritorna True se la registrazione è integra su disco.
+        """
+        self._timer.stop()
+        self.flush()
+        self._writer.close({"ended": datetime.now().isoformat(timespec="seconds"),
+                            "rows": self._written, **(metadata or {})})
+        return self._writer.error is None
@@ -0,0 +1,7 @@
+# benchmarks/__init__.py
+"""
+Benchmark delle prestazioni su dati sintetici (parsing dei `D:`, costo live
+per pacchetto, `refresh_plot` con provini in overlay, export xlsx), con i
+risultati in JSON per confrontare commit diversi: vedi docs/benchmarks.md.
+Avvio: `python -m benchmarks`; confronto: `python -m benchmarks --compare A.json B.json`.
+"""
@@ -0,0 +1,185 @@
+# benchmarks/__main__.py
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+SCHEMA_VERSION = 1
+CASES = ("parse", "live", "refresh", "export")
+# Metriche in cui un valore più alto è un miglioramento (le altre sono tempi o memoria)
+HIGHER_IS_BETTER = ("samples_per_s", "mb_per_s", "rows_per_s")
+
+
+def parse_sizes(text):
+    """ "10k,100k,1M" -> [10000, 100000, 1000000]. """
+    factors = {"k": 1_000, "m": 1_000_000}
+    sizes = []
+    for item in text.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        factor = factors.get(item[-1], 1)
+        sizes.append(int(float(item[:-1] if item[-1] in factors else item) * factor))
+    return sizes
+
+
+def environment():
+    """ Versioni, macchina e commit: servono a capire se due file di risultati sono confrontabili. """
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    import numpy
+    import openpyxl
+    import pyqtgraph
+    from PyQt6.QtCore import PYQT_VERSION_STR, QT_VERSION_STR
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "pyqt": PYQT_VERSION_STR,
+        "qt": QT_VERSION_STR,
+        "pyqtgraph": pyqtgraph.__version__,
+        "openpyxl": openpyxl.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "qt_platform": os.environ.get("QT_QPA_PLATFORM", ""),
+    }
+
+
+def run(args):
+    from benchmarks import cases
+
+    sizes = parse_sizes(args.sizes)
+    export_sizes = parse_sizes(args.export_sizes)
+    overlays = [int(k) for k in args.overlays.split(",")]
+    kinds = args.kinds.split(",")
+    selected = args.cases.split(",")
+    unknown = set(selected) - set(CASES)
+    if unknown:
+        raise SystemExit(f"Casi sconosciuti: {', '.join(sorted(unknown))} (disponibili: {', '.join(CASES)})")
+
+    report = {"schema": SCHEMA_VERSION, "created": datetime.now().isoformat(timespec="seconds"),
+              "environment": environment(), "results": []}
+    workdir = tempfile.mkdtemp(prefix="utm_bench_")
+    gui = None
+    started = time.perf_counter()
+    # Le stampe di debug della GUI (test avviati, [ESP32 RAW]...) non devono coprire l'avanzamento
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            for case in CASES:
+                if case not in selected:
+                    continue
+                print(f"[{time.perf_counter() - started:7.1f} s] {case}...", file=sys.stderr)
+                if case == "parse":
+                    results = cases.bench_parse(sizes, kinds)
+                elif case == "export":
+                    results = cases.bench_export(export_sizes, kinds, workdir)
+                else:
+                    gui = gui or cases.GuiFixture(workdir)
+                    if case == "live":
+                        results = cases.bench_live_update(gui, sizes, kinds)
+                    else:
+                        results = cases.bench_refresh_plot(gui, sizes, kinds, overlays)
+                for entry in results:
+                    print(f"    {format_entry(entry)}", file=sys.stderr)
+                report["results"].extend(results)
+        finally:
+            if gui is not None:
+                gui.close()
+            os.chdir(REPO_DIR)
+
+    output = args.output
+    if output is None:
+        commit = (report["environment"]["commit"] or "nogit")[:10]
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}.json")
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Risultati in {output} ({time.perf_counter() - started:.1f} s)", file=sys.stderr)
+
+
+def format_entry(entry):
+    params = " ".join(f"{k}={v}" for k, v in entry["params"].items())
+    metrics = " ".join(f"{k}={v:.4g}" for k, v in entry["metrics"].items())
+    return f"{entry['name']} [{params}] {metrics}"
+
+
+def compare(old_path, new_path, threshold):
+    """ Tabella delle metriche comuni ai due file, con le variazioni oltre `threshold` segnalate. """
+    def load(path):
+        with open(path, encoding="utf-8") as file:
+            report = json.load(file)
+        return report, {(r["name"], json.dumps(r["params"], sort_keys=True)): r["metrics"] for r in report["results"]}
+
+    old_report, old = load(old_path)
+    new_report, new = load(new_path)
+    for label, report in (("prima", old_report), ("dopo", new_report)):
+        env = report["environment"]
+        print(f"{label}: {env.get('commit') or '?'}{' (modificato)' if env.get('dirty') else ''} "
+              f"del {report['created']}, {env.get('platform')}, Python {env.get('python')}")
+    regressions = 0
+    for key in (k for k in old if k in new):
+        name, params = key
+        print(f"\n{name} {params}")
+        for metric, before in old[key].items():
+            after = new[key].get(metric)
+            if after is None or not before:
+                continue
+            ratio = after / before
+            worse = ratio < 1 - threshold if metric in HIGHER_IS_BETTER else ratio > 1 + threshold
+            better = ratio > 1 + threshold if metric in HIGHER_IS_BETTER else ratio < 1 - threshold
+            flag = "  PEGGIORATO" if worse else ("  migliorato" if better else "")
+            regressions += worse
+            print(f"  {metric:24s} {before:12.4g} -> {after:12.4g}  x{ratio:.2f}{flag}")
+    print(f"\n{regressions} metriche peggiorate oltre il {threshold:.0%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark di parsing, aggiornamento live, ridisegno ed export su dati sintetici.")
+    parser.add_argument("--cases", default=",".join(CASES), help="casi da eseguire (default: tutti)")
+    parser.add_argument("--sizes", default="10k,100k,1M",
+                        help="campioni per parsing, storico live e ridisegno, es. 10k,1M,10M (default %(default)s)")
+    parser.add_argument("--export-sizes", default="10k,100k", help="campioni per l'export xlsx (default %(default)s)")
+    parser.add_argument("--overlays", default="1,5,20", help="provini in overlay per refresh_plot (default %(default)s)")
+    parser.add_argument("--kinds", default="monotonic,cyclic", help="tipi di test sintetici (default %(default)s)")
+    parser.add_argument("--output", help="file JSON dei risultati (default benchmarks/results/<data>_<commit>.json)")
+    parser.add_argument("--show", action="store_true",
+                        help="usa la piattaforma grafica reale invece di quella offscreen")
+    parser.add_argument("--compare", nargs=2, metavar=("PRIMA", "DOPO"),
+                        help="confronta due file di risultati invece di eseguire i benchmark")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="variazione relativa segnalata da --compare (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, args.threshold) else 0
+    if not args.show:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR) # i casi GUI cambiano cartella di lavoro
+    run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
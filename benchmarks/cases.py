@@ -0,0 +1,306 @@
+# benchmarks/cases.py
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks import generators
+
+READ_SIZE = 4096          # letture della porta nel benchmark di parsing (arretrato tipico)
+PARSER_BATCH = 5          # campioni per lotto di PacketParser a 320 Hz (FLUSH_INTERVAL_MS = 15)
+FRAME_RATE_HZ = 30        # ridisegni al secondo durante la finestra live (plot_refresh_fps di default)
+LIVE_WINDOW_S = 10.0      # secondi di stream misurati dopo lo storico
+AUTOSAVE_INTERVAL_S = 5.0 # come settings["autosave_interval_s"] di default
+SMALL_SIZE = 100_000      # fino a qui i casi brevi sono ripetuti e si tiene il migliore
+REPEATS = 3
+
+CYCLIC_SEQUENCE = [{
+    "type": "cyclic", "control": "Displacement", "control_text": "Displacement (mm)",
+    "upper": generators.CYCLE_AMPLITUDE_MM, "lower": 0.0, "speed": 1.0, "speed_unit": "mm/s",
+    "cycles": 100000, "hold_upper": 0.0, "hold_lower": 0.0,
+    "speed_mms": 1.0, "upper_conv": generators.CYCLE_AMPLITUDE_MM, "lower_conv": 0.0, "base_unit": "mm",
+}]
+
+
+def result(name, params, **metrics):
+    """ Voce del file dei risultati: nome del caso, parametri e metriche (unità nel suffisso). """
+    return {"name": name, "params": params, "metrics": metrics}
+
+
+def _best_of(fn, n):
+    """ Tempo (s) di `fn()`: il migliore di REPEATS esecuzioni per i casi piccoli, una sola per gli altri. """
+    best = None
+    for _ in range(REPEATS if n <= SMALL_SIZE else 1):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+# --- PARSING ---
+
+def bench_parse(sizes, kinds):
+    """
+    Throughput di framing (`LineFramer.feed`) e parsing
+    (`PacketParser.handle_lines` + `flush`) su uno stream sintetico letto a
+    blocchi da READ_SIZE byte, in ASCII (`D:` a 7 campi) e binario.
+    """
+    from communication import LineFramer
+    from packet_parser import PacketParser
+
+    results = []
+    for kind in kinds:
+        for n in sizes:
+            records = generators.firmware_records(n, kind)
+            streams = {"text": b"".join(generators.text_lines(records)),
+                       "binary": generators.binary_stream(records)}
+            del records
+            for encoding, data in streams.items():
+                reads = generators.chunks(data, READ_SIZE)
+                items = []
+
+                def frame():
+                    items.clear()
+                    framer = LineFramer()
+                    for chunk in reads:
+                        items.extend(framer.feed(chunk))
+
+                framing_s = _best_of(frame, n)
+                parser = PacketParser(generators.PULSES_TO_MM, generators.SCREW_PITCH_MM,
+                                      generators.ENCODER_COUNTS_PER_REV)
+                parsed = []
+                parser.samples_ready.connect(lambda batch: parsed.append(len(batch)))
+
+                def parse():
+                    parsed.clear()
+                    parser.handle_lines(items)
+                    parser.flush()
+
+                parse_s = _best_of(parse, n)
+                if sum(parsed) != n:
+                    raise RuntimeError(f"parse {kind}/{encoding}: {sum(parsed)} campioni su {n}")
+                total_s = framing_s + parse_s
+                results.append(result(
+                    "parse", {"kind": kind, "encoding": encoding, "samples": n},
+                    framing_s=framing_s, parse_s=parse_s,
+                    samples_per_s=n / total_s, mb_per_s=len(data) / total_s / 1e6))
+            del streams
+    return results
+
+
+# --- GUI (MainWindow condivisa) ---
+
+class GuiFixture:
+    """
+    `MainWindow` completa e nascosta alla porta seriale, in una cartella
+    temporanea (settings.json, autosave): i casi live e di ridisegno passano
+    per gli stessi metodi usati con la macchina collegata.
+    """
+
+    def __init__(self, workdir):
+        from PyQt6.QtWidgets import QApplication, QMessageBox
+
+        self.app = QApplication.instance() or QApplication(sys.argv[:1])
+        # Nessun dialogo modale durante le misure
+        QMessageBox.question = staticmethod(lambda *args, **kwargs: QMessageBox.StandardButton.Yes)
+        QMessageBox.warning = staticmethod(lambda *args, **kwargs: QMessageBox.StandardButton.Ok)
+        os.chdir(workdir)
+        import main
+        self.window = main.MainWindow()
+        self.window.resize(1400, 900)
+        self.window.show()
+        self.window.manual_control.is_homed = True
+        self.app.processEvents()
+
+    def widget(self, kind):
+        window = self.window
+        if kind == "cyclic":
+            window.show_cyclic_test()
+            widget = window.cyclic_test
+            widget.is_homed = True
+            widget.test_sequence = [dict(block) for block in CYCLIC_SEQUENCE]
+        else:
+            window.show_monotonic_test()
+            widget = window.monotonic_test_widget
+        self.app.processEvents()
+        return widget
+
+    def close(self):
+        self.window.close()
+        self.app.processEvents()
+
+
+def _specimen(name, kind, test_data=None):
+    specimen = {"name": name, "gauge_length": 50.0, "area": 2.0, "test_data": test_data, "visible": True}
+    if kind == "monotonic":
+        specimen.update({"speed": generators.MONOTONIC_SPEED_MMS, "speed_unit": "mm/s",
+                         "stop_criterion_value": 190.0, "stop_criterion_unit": "mm", "return_to_start": False})
+    return specimen
+
+
+def bench_live_update(gui, sizes, kinds):
+    """
+    Costo live a test lungo: con `n` campioni già nello storico del test in
+    corso, LIVE_WINDOW_S secondi di stream a 320 Hz passano per
+    `MainWindow.handle_sample_batch()` a lotti da PARSER_BATCH campioni;
+    FRAME_RATE_HZ volte al secondo si eseguono i ridisegni in attesa
+    (`RenderScheduler.flush()`) e si dipinge il grafico, e ogni
+    AUTOSAVE_INTERVAL_S si accoda l'autosave, come farebbero i timer.
+    """
+    window = gui.window
+    scheduler = window.render_scheduler
+    results = []
+    for kind in kinds:
+        for n in sizes:
+            widget = gui.widget(kind)
+            window_samples = int(LIVE_WINDOW_S * generators.STREAM_RATE_HZ)
+            samples = generators.stream_samples(generators.firmware_records(n + window_samples, kind))
+            widget.specimens = {"LIVE": _specimen("LIVE", kind)}
+            widget.current_specimen_name = "LIVE"
+            widget.on_start_test()
+            history = samples[:n]
+            widget.current_test_data.extend(
+                time_s=history["time_s"], rel_disp_mm=history["disp_mm"] - widget.displacement_offset_mm,
+                rel_load_N=history["load_N"] - widget.load_offset_N, abs_disp_mm=history["disp_mm"],
+                abs_load_N=history["load_N"], cycle=history["cycle"],
+                block=np.ones(n) if kind == "cyclic" else np.zeros(n),
+                resistance_ohm=history["resistance_ohm"], encoder_disp_mm=history["encoder_disp_mm"])
+            del history
+            widget.live_autosave.flush() # lo storico su disco non fa parte della finestra misurata
+
+            start = time.perf_counter()
+            scheduler.request(widget._render_live_frame)
+            scheduler.flush()
+            first_frame_s = time.perf_counter() - start
+
+            stream = samples[n:]
+            per_frame = generators.STREAM_RATE_HZ / FRAME_RATE_HZ
+            per_autosave = generators.STREAM_RATE_HZ * AUTOSAVE_INTERVAL_S
+            dispatch_s = 0.0
+            frame_times, paint_times, autosave_times = [], [], []
+            next_frame, next_autosave = per_frame, per_autosave
+            for offset in range(0, window_samples, PARSER_BATCH):
+                batch = stream[offset:offset + PARSER_BATCH]
+                start = time.perf_counter()
+                window.handle_sample_batch(batch)
+                dispatch_s += time.perf_counter() - start
+                done = offset + len(batch)
+                if done >= next_frame:
+                    next_frame += per_frame
+                    start = time.perf_counter()
+                    scheduler.flush()
+                    frame_times.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    widget.plot_widget.grab()
+                    paint_times.append(time.perf_counter() - start)
+                if done >= next_autosave:
+                    next_autosave += per_autosave
+                    start = time.perf_counter()
+                    widget.live_autosave.flush()
+                    autosave_times.append(time.perf_counter() - start)
+
+            busy_s = dispatch_s + sum(frame_times) + sum(paint_times) + sum(autosave_times)
+            results.append(result(
+                "live_update", {"kind": kind, "history_samples": n, "window_s": LIVE_WINDOW_S},
+                dispatch_us_per_sample=dispatch_s / window_samples * 1e6,
+                first_frame_ms=first_frame_s * 1e3,
+                frame_ms_mean=float(np.mean(frame_times)) * 1e3, frame_ms_p95=_percentile(frame_times, 95) * 1e3,
+                frame_ms_max=max(frame_times) * 1e3,
+                paint_ms_mean=float(np.mean(paint_times)) * 1e3, paint_ms_max=max(paint_times) * 1e3,
+                autosave_ms_max=max(autosave_times, default=0.0) * 1e3,
+                us_per_sample=busy_s / window_samples * 1e6,
+                gui_load=busy_s / LIVE_WINDOW_S))
+
+            widget.is_test_running = False
+            widget.live_autosave.finish()
+            widget.live_autosave = None
+            widget.current_test_data = None
+            widget.specimens = {}
+            widget.current_specimen_name = None
+            del samples, stream
+    return results
+
+
+def bench_refresh_plot(gui, sizes, kinds, overlays):
+    """
+    `refresh_plot()` con `k` provini conclusi da `n` campioni in overlay, e
+    il primo disegno del grafico che ne segue. I provini condividono lo
+    stesso registratore: la memoria resta quella di uno solo, il lavoro di
+    conversione e di LOD è comunque per provino.
+    """
+    results = []
+    for kind in kinds:
+        for n in sizes:
+            recorder = generators.finished_recorder(n, kind)
+            for k in overlays:
+                widget = gui.widget(kind)
+                widget.specimens = {f"S{i + 1}": _specimen(f"S{i + 1}", kind, recorder) for i in range(k)}
+                widget.current_specimen_name = "S1"
+                widget.overlay_checkbox.blockSignals(True)
+                widget.overlay_checkbox.setChecked(True)
+                widget.overlay_checkbox.blockSignals(False)
+
+                def refresh():
+                    widget.refresh_plot()
+                    gui.window.render_scheduler.flush()
+
+                refresh_s = _best_of(refresh, n * k)
+                start = time.perf_counter()
+                widget.plot_widget.grab()
+                paint_s = time.perf_counter() - start
+                results.append(result(
+                    "refresh_plot", {"kind": kind, "samples": n, "overlays": k},
+                    refresh_ms=refresh_s * 1e3, paint_ms=paint_s * 1e3))
+                widget.specimens = {}
+                widget.current_specimen_name = None
+                widget.refresh_plot()
+            del recorder
+    return results
+
+
+# --- EXPORT ---
+
+def bench_export(sizes, kinds, workdir):
+    """
+    `DataSaver.save_batch_to_xlsx()` di un provino da `n` campioni: tempo
+    (esecuzione senza tracing) e picco delle allocazioni durante l'export
+    (`peak_alloc_mb`: seconda esecuzione con tracemalloc, che intercetta
+    anche i buffer NumPy).
+    """
+    from data_saver import DataSaver
+
+    results = []
+    for kind in kinds:
+        for n in sizes:
+            specimen = _specimen("S1", kind, generators.finished_recorder(n, kind))
+            if kind == "cyclic":
+                specimen["test_sequence_setup"] = CYCLIC_SEQUENCE
+            path = os.path.join(workdir, f"export_{kind}_{n}.xlsx")
+            saver = DataSaver()
+
+            start = time.perf_counter()
+            success, message = saver.save_batch_to_xlsx({"S1": specimen}, path)
+            export_s = time.perf_counter() - start
+            if not success:
+                raise RuntimeError(message)
+            size_mb = os.path.getsize(path) / 1e6
+
+            tracemalloc.start()
+            saver.save_batch_to_xlsx({"S1": specimen}, path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            os.remove(path)
+            results.append(result(
+                "export_xlsx", {"kind": kind, "samples": n},
+                export_s=export_s, rows_per_s=n / export_s, file_mb=size_mb,
+                peak_alloc_mb=peak / 1e6))
+            del specimen
+    return results
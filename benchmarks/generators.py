@@ -0,0 +1,102 @@
+# benchmarks/generators.py
+
+import binascii
+
+import numpy as np
+
+from binary_protocol import CRC_INIT, CRC_SPAN, RECORD_DTYPE, RECORD_SIZE, SYNC_WORD
+from esp32_simulator.model import ENCODER_COUNTS_PER_REV, PULSES_TO_MM, SCREW_PITCH_MM
+from packet_parser import samples_from_records
+from recorder import TestRecorder
+
+STREAM_RATE_HZ = 320.0
+
+# Forme dei test sintetici (unità fisiche)
+MONOTONIC_SPEED_MMS = 0.05      # 8 h di stream restano entro la corsa della traversa
+STIFFNESS_N_PER_MM = 20.0
+YIELD_FORCE_N = 6.0
+HARDENING_N_PER_MM = 0.4
+CYCLE_PERIOD_S = 4.0
+CYCLE_AMPLITUDE_MM = 2.0
+NOISE_N = 0.002
+START_POSITION_MM = 50.0
+
+
+def firmware_records(n, kind="monotonic", rate_hz=STREAM_RATE_HZ, seed=0):
+    """
+    `n` campioni di un test sintetico come li invia il firmware (array
+    `RECORD_DTYPE`, CRC non calcolata): grammi, impulsi, `millis()`, ciclo,
+    resistenza, conteggi encoder e numero di sequenza.
+
+    `kind="monotonic"`: trazione a velocità costante su un provino
+    elasto-plastico; `kind="cyclic"`: triangolare di ±`CYCLE_AMPLITUDE_MM`
+    con periodo `CYCLE_PERIOD_S` su un provino elastico, ciclo 1-based.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n, dtype=np.float64) / rate_hz
+    if kind == "monotonic":
+        elongation = MONOTONIC_SPEED_MMS * t
+        plastic_from = YIELD_FORCE_N / STIFFNESS_N_PER_MM
+        force = np.where(elongation <= plastic_from, STIFFNESS_N_PER_MM * elongation,
+                         YIELD_FORCE_N + HARDENING_N_PER_MM * (elongation - plastic_from))
+        cycle = np.zeros(n, dtype=np.uint32)
+    elif kind == "cyclic":
+        phase = (t / CYCLE_PERIOD_S) % 1.0
+        elongation = CYCLE_AMPLITUDE_MM * (1.0 - np.abs(2.0 * phase - 1.0))
+        force = STIFFNESS_N_PER_MM * elongation
+        cycle = (t // CYCLE_PERIOD_S).astype(np.uint32) + 1
+    else:
+        raise ValueError(f"Tipo di test sintetico sconosciuto: {kind}")
+    force = force + rng.normal(0.0, NOISE_N, n)
+    position = START_POSITION_MM + elongation
+
+    records = np.zeros(n, dtype=RECORD_DTYPE)
+    records["sync"] = SYNC_WORD
+    records["seq"] = np.arange(n, dtype=np.uint32)
+    records["time_ms"] = np.round(t * 1000.0).astype(np.uint32)
+    records["load_g"] = np.round(force / 9.81 * 1000.0, 2)
+    records["pulses"] = np.round(position / PULSES_TO_MM).astype(np.int32)
+    records["cycle"] = cycle
+    records["resistance_ohm"] = np.round(120.0 * (1.0 + 2.0 * elongation / 50.0), 3)
+    records["encoder"] = np.round(position / SCREW_PITCH_MM * ENCODER_COUNTS_PER_REV).astype(np.int32)
+    return records
+
+
+def text_lines(records):
+    """ Righe `D:` a 7 campi (bytes con `\\n`), come lo streaming ASCII del firmware. """
+    return [b"D:%.2f;%d;%d;%d;%.3f;%d;%d\n" % row for row in zip(
+        records["load_g"].tolist(), records["pulses"].tolist(), records["time_ms"].tolist(),
+        records["cycle"].tolist(), records["resistance_ohm"].tolist(), records["encoder"].tolist(),
+        records["seq"].tolist())]
+
+
+def binary_stream(records):
+    """ Record binari con CRC, concatenati come nello streaming `SET_MODE:STREAMING_BIN`. """
+    records = records.copy()
+    data = records.view(np.uint8).reshape(-1, RECORD_SIZE)
+    crc_hqx = binascii.crc_hqx
+    records["crc"] = [crc_hqx(row[CRC_SPAN].tobytes(), CRC_INIT) for row in data]
+    return records.tobytes()
+
+
+def stream_samples(records):
+    """ Campioni convertiti (`SAMPLE_DTYPE`) come li consegna `PacketParser`, con le costanti della macchina. """
+    return samples_from_records(records, PULSES_TO_MM, SCREW_PITCH_MM, ENCODER_COUNTS_PER_REV)
+
+
+def finished_recorder(n, kind="monotonic", seed=0):
+    """ `TestRecorder` di un test concluso di `n` campioni (offset relativi al primo campione). """
+    samples = stream_samples(firmware_records(n, kind, seed=seed))
+    disp = samples["disp_mm"]
+    load = samples["load_N"]
+    recorder = TestRecorder(initial_capacity=max(n, 16))
+    recorder.extend(time_s=samples["time_s"], rel_disp_mm=disp - disp[0], rel_load_N=load - load[0],
+                    abs_disp_mm=disp, abs_load_N=load, cycle=samples["cycle"],
+                    block=np.ones(n) if kind == "cyclic" else np.zeros(n),
+                    resistance_ohm=samples["resistance_ohm"], encoder_disp_mm=samples["encoder_disp_mm"])
+    return recorder
+
+
+def chunks(data, size):
+    """ `data` (bytes) spezzato in letture da `size` byte, come le arriverebbero da `readinto()`. """
+    return [data[i:i + size] for i in range(0, len(data), size)]
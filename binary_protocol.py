@@ -0,0 +1,72 @@
+# binary_protocol.py
+
+import binascii
+import struct
+
+import numpy as np
+
+# Record binario dello streaming `SET_MODE:STREAMING_BIN` (little-endian,
+# 32 byte). Il primo byte della sync (0xA5) non compare mai nel testo ASCII
+# delle righe `STATUS:`, quindi record e righe possono convivere sullo
+# stesso stream e vengono separati dal framer (vedi LineFramer).
+SYNC_WORD = 0x5AA5
+SYNC_BYTES = struct.pack("<H", SYNC_WORD)  # b"\xa5\x5a"
+RECORD_STRUCT = struct.Struct("<HIIfiIfiH")
+RECORD_SIZE = RECORD_STRUCT.size  # 32
+CRC_INIT = 0xFFFF
+CRC_SPAN = slice(2, RECORD_SIZE - 2)  # CRC-16/CCITT su tutto tranne sync e CRC
+ENCODER_ABSENT = -2**31  # encoder non presente/non letto
+
+RECORD_DTYPE = np.dtype([
+    ("sync", "<u2"),
+    ("seq", "<u4"),        # numero di sequenza, incrementato a ogni record
+    ("time_ms", "<u4"),    # millis() del firmware
+    ("load_g", "<f4"),     # carico filtrato in grammi (come il 1° campo ASCII)
+    ("pulses", "<i4"),     # pulse_count del motore
+    ("cycle", "<u4"),
+    ("resistance_ohm", "<f4"),
+    ("encoder", "<i4"),    # conteggio encoder, ENCODER_ABSENT se assente
+    ("crc", "<u2"),
+])
+assert RECORD_DTYPE.itemsize == RECORD_SIZE
+
+
+def record_crc(record):
+    """ CRC-16/CCITT (init 0xFFFF) di un record da 32 byte. """
+    return binascii.crc_hqx(record[CRC_SPAN], CRC_INIT)
+
+
+def encode_record(seq, time_ms, load_g, pulses, cycle=0, resistance_ohm=-999.0, encoder=None):
+    """ Costruisce un record binario (stesso layout del firmware; utile per test e simulazione). """
+    body = RECORD_STRUCT.pack(SYNC_WORD, seq & 0xFFFFFFFF, time_ms & 0xFFFFFFFF, load_g, pulses,
+                              cycle, resistance_ohm,
+                              ENCODER_ABSENT if encoder is None else encoder, 0)
+    return body[:-2] + struct.pack("<H", record_crc(body))
+
+
+def count_valid_records(buffer, offset, count):
+    """
+    Quanti record consecutivi, a partire da `offset`, hanno sync e CRC
+    corretti (si ferma al primo non valido). `buffer` è un oggetto bytes-like
+    con almeno `count` record completi da `offset`.
+    """
+    records = np.frombuffer(buffer, dtype=RECORD_DTYPE, count=count, offset=offset)
+    bad_sync = np.flatnonzero(records["sync"] != SYNC_WORD)
+    limit = int(bad_sync[0]) if bad_sync.size else count
+    crc_hqx = binascii.crc_hqx
+    crcs = records["crc"]
+    with memoryview(buffer) as view:
+        for i in range(limit):
+            start = offset + i * RECORD_SIZE
+            if crc_hqx(view[start + 2:start + RECORD_SIZE - 2], CRC_INIT) != crcs[i]:
+                return i
+    return limit
+
+
+def decode_records(chunk):
+    """
+    Vista `RECORD_DTYPE` (senza copia) su un blocco di record già validati,
+    di lunghezza multipla di RECORD_SIZE. La conversione in unità fisiche è
+    in `packet_parser.samples_from_records()`.
+    """
+    return np.frombuffer(chunk, dtype=RECORD_DTYPE)
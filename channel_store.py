@@ -0,0 +1,514 @@
+# channel_store.py
+
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from recorder import TestRecorder
+
+# --- FORMATO DI UN CHUNK (blocco di campioni consecutivi) ---
+#
+#   u32 lunghezza | JSON (campioni e, per colonna: codifica, parametri,
+#   dtype e lunghezza del payload) | payload compressi (zlib), uno per colonna
+#
+# Ogni colonna di ogni chunk usa la prima codifica che la riproduce BIT PER
+# BIT (verificata in scrittura), in quest'ordine:
+#   const  : valore unico (es. encoder assente, cycle/block nei monotonici)
+#   ref    : colonna assoluta meno un offset costante (rel_disp, rel_load)
+#   quant  : interi k da cui la conversione del parser (`packet_parser.py`)
+#            ricostruisce il valore: millisecondi/1000, impulsi * mm per
+#            impulso, grammi -> N, conteggi encoder, campi float32 dei
+#            record binari. Gli interi sono codificati a differenze
+#            (delta), zigzag e nel dtype senza segno più stretto
+#   raw    : float64 con i byte riordinati per piano (shuffle)
+# NaN (encoder assente) in una colonna quantizzata: maschera di bit a parte.
+#
+# --- FORMATO FILE .utmch ---
+#
+#   MAGIC | u32 lunghezza | JSON (colonne) | chunk ... |
+#   JSON indice ([offset, byte, campioni] per chunk) | u64 offset indice | END_MAGIC
+#
+# L'indice in coda permette di leggere un chunk qualsiasi senza
+# decomprimere gli altri.
+MAGIC = b"UTMCH001"
+END_MAGIC = b"UTMCHEND"
+FILE_EXTENSION = ".utmch"
+
+_U32 = struct.Struct("<I")
+_TRAILER = struct.Struct("<Q8s")
+
+_MAX_EXACT_INT = 2**53
+_UNSIGNED_DTYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+
+# Colonne relative ricavate dall'assoluta: rel = abs - offset (widget di test)
+REFERENCE_COLUMNS = {"rel_disp_mm": "abs_disp_mm", "rel_load_N": "abs_load_N"}
+
+
+# --- CONVERSIONI INTERO -> VALORE (stesso ordine di operazioni del parser) ---
+def _inverse(form, params, k):
+    if form == "int":
+        return k.astype(np.float64)
+    if form == "div":      # time_ms / 1000, decimali di un numero testuale
+        return k.astype(np.float64) / params[0]
+    if form == "mul":      # pulses * pulses_to_mm
+        return k.astype(np.float64) * params[0]
+    if form == "load":     # (grammi / 1000) * 9.81, grammi con `params[0]` divisore decimale
+        return ((k.astype(np.float64) / params[0]) / 1000.0) * 9.81
+    if form == "encoder":  # (conteggi / counts_per_rev) * screw_pitch_mm
+        return (k.astype(np.float64) / params[0]) * params[1]
+    if form == "f32":      # campo float32 dei record binari (bit dell'intero)
+        return k.astype(np.int32).view(np.float32).astype(np.float64)
+    if form == "f32load":  # load_g float32 dei record binari -> N
+        return (k.astype(np.int32).view(np.float32).astype(np.float64) / 1000.0) * 9.81
+    raise ValueError(f"Codifica sconosciuta: {form}")
+
+
+def _forward(form, params, x):
+    """ Stima degli interi k da cui `_inverse()` dovrebbe riottenere `x` (valori finiti). """
+    if form in ("f32", "f32load"):
+        value = x if form == "f32" else (x / 9.81) * 1000.0
+        with np.errstate(over="ignore", invalid="ignore"):
+            return value.astype(np.float32).view(np.int32).astype(np.int64)
+    if form == "int":
+        value = x
+    elif form == "div":
+        value = x * params[0]
+    elif form == "mul":
+        value = x / params[0]
+    elif form == "load":
+        value = (x / 9.81) * 1000.0 * params[0]
+    elif form == "encoder":
+        value = (x / params[1]) * params[0]
+    else:
+        raise ValueError(f"Codifica sconosciuta: {form}")
+    if not np.all(np.abs(value) < _MAX_EXACT_INT):
+        return None
+    return np.rint(value).astype(np.int64)
+
+
+def _same_bits(a, b):
+    return np.array_equal(a.view(np.uint64), b.view(np.uint64))
+
+
+def _reproduces(form, params, x):
+    k = _forward(form, params, x)
+    if k is None:
+        return False
+    with np.errstate(all="ignore"):
+        return _same_bits(_inverse(form, params, k), x)
+
+
+def _pack_ints(k):
+    """ Delta + zigzag nel dtype senza segno più stretto: `(dtype, bytes)`. """
+    delta = np.diff(k, prepend=np.int64(0))
+    zigzag = ((delta << 1) ^ (delta >> 63)).view(np.uint64)
+    peak = int(zigzag.max()) if len(zigzag) else 0
+    dtype = next(t for t in _UNSIGNED_DTYPES if peak <= np.iinfo(t).max)
+    return np.dtype(dtype).str, zigzag.astype(dtype).tobytes()
+
+
+def _unpack_ints(dtype, payload):
+    zigzag = np.frombuffer(payload, dtype=dtype).astype(np.uint64)
+    delta = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    return np.cumsum(delta)
+
+
+def _estimate_quanta(x):
+    """
+    Candidati per `mul`: il passo minimo tra valori diversi approssima il
+    quanto (es. mm per impulso); i rapporti valore/intero di alcuni
+    campioni danno i float esatti da verificare.
+    """
+    values = np.unique(x)
+    if len(values) < 2:
+        return []
+    step = float(np.min(np.diff(values)))
+    if step <= 0:
+        return []
+    k = np.rint(values / step)
+    nonzero = np.flatnonzero(k)
+    return sorted({float(values[i] / k[i]) for i in nonzero[:4]} | {step})
+
+
+def _decode_column(entry, payload, rows):
+    """ Valori di una colonna `const`/`quant`/`raw` di un chunk. """
+    encoding = entry["enc"]
+    if encoding == "const":
+        value = np.array(entry["value"], dtype=np.uint64).view(np.float64)[0] if rows else 0.0
+        return np.full(rows, value)
+    if encoding == "quant":
+        raw = zlib.decompress(payload)
+        mask_len = entry.get("mask", 0)
+        k = _unpack_ints(entry["dtype"], raw[mask_len:])
+        with np.errstate(all="ignore"):
+            values = _inverse(entry["form"], entry["params"], k)
+        if mask_len:
+            nan = np.unpackbits(np.frombuffer(raw[:mask_len], dtype=np.uint8), count=rows).astype(bool)
+            values[nan] = np.nan
+        return values
+    return np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(8, rows).T.copy().view(np.float64)[:, 0]
+
+
+class ChannelStore:
+    """
+    Archivio compresso senza perdita delle colonne di un `TestRecorder`,
+    a chunk di `CHUNK_SIZE` campioni codificati e compressi in modo
+    indipendente: ogni chunk si legge da solo (`read_chunk()`), in memoria
+    o dal file `.utmch` (`open()` legge solo l'indice). I valori riletti
+    sono identici bit per bit a quelli scritti.
+
+    `pulses_to_mm`, `screw_pitch_mm` ed `encoder_counts_per_rev` (costanti
+    di `MainWindow`), se passati, permettono di riconoscere subito
+    spostamento ed encoder come interi del firmware; senza, lo spostamento
+    viene comunque cercato dal passo minimo dei dati.
+    """
+
+    CHUNK_SIZE = 65536
+    PROBE_SIZE = 256
+    ZLIB_LEVEL = 3
+
+    def __init__(self, columns=TestRecorder.COLUMNS, pulses_to_mm=None, screw_pitch_mm=None,
+                 encoder_counts_per_rev=None):
+        self.columns = tuple(columns)
+        self._hints = {}
+        if pulses_to_mm:
+            self._hints["abs_disp_mm"] = [("mul", [float(pulses_to_mm)])]
+        if screw_pitch_mm and encoder_counts_per_rev:
+            self._hints["encoder_disp_mm"] = [("encoder", [int(encoder_counts_per_rev), float(screw_pitch_mm)])]
+        self._chunks = []    # bytes dei chunk in memoria (None per un archivio su file)
+        self._index = []     # [offset nel file, byte, campioni] per chunk
+        self._path = None
+        self._size = 0
+
+    # --- SCRITTURA ---
+    @classmethod
+    def from_recorder(cls, recorder, **hints):
+        store = cls(**hints)
+        store.append_block(recorder.chunk(0))
+        return store
+
+    def append_block(self, block):
+        """ Accoda un blocco (colonne x campioni, ordine di `columns`), in chunk da `CHUNK_SIZE`. """
+        if self._path is not None:
+            raise ValueError("Archivio aperto da file in sola lettura")
+        for start in range(0, block.shape[1], self.CHUNK_SIZE):
+            part = block[:, start:start + self.CHUNK_SIZE]
+            data = self._encode_chunk(part)
+            self._chunks.append(data)
+            self._index.append([None, len(data), part.shape[1]])
+            self._size += part.shape[1]
+
+    def _encode_chunk(self, block):
+        block = np.ascontiguousarray(block, dtype=np.float64)
+        column_index = {name: i for i, name in enumerate(self.columns)}
+        header = {"rows": block.shape[1], "columns": []}
+        payloads = []
+        for i, name in enumerate(self.columns):
+            reference = REFERENCE_COLUMNS.get(name)
+            ref_values = block[column_index[reference]] if reference in column_index else None
+            entry, payload = self._encode_column(name, block[i], ref_values)
+            if entry["enc"] == "ref":
+                entry["ref"] = reference
+            entry["len"] = len(payload)
+            header["columns"].append(entry)
+            payloads.append(payload)
+        head = json.dumps(header).encode("utf-8")
+        return _U32.pack(len(head)) + head + b"".join(payloads)
+
+    def _encode_column(self, name, x, ref_values):
+        if len(x) == 0 or _same_bits(x, np.full(len(x), x[0])):
+            return {"enc": "const", "value": x[:1].view(np.uint64).tolist()}, b""
+
+        if ref_values is not None:
+            finite = np.flatnonzero(np.isfinite(x) & np.isfinite(ref_values))
+            if len(finite):
+                offset = float(ref_values[finite[0]] - x[finite[0]])
+                if _same_bits(ref_values - offset, x):
+                    return {"enc": "ref", "offset": offset}, b""
+
+        nan = np.isnan(x)
+        finite_values = x[~nan]
+        if len(finite_values) and np.all(np.isfinite(finite_values)):
+            probe = finite_values[:self.PROBE_SIZE]
+            for form, params in self._candidates(name, finite_values):
+                if not _reproduces(form, params, probe):
+                    continue # scarto veloce sui primi campioni
+                k = _forward(form, params, finite_values)
+                if k is None:
+                    continue
+                with np.errstate(all="ignore"):
+                    if not _same_bits(_inverse(form, params, k), finite_values):
+                        continue
+                full = np.zeros(len(x), dtype=np.int64)
+                full[~nan] = k
+                if len(full) > 1: # le posizioni NaN ripetono il valore precedente: delta nulle
+                    positions = np.where(nan, 0, np.arange(len(x)))
+                    full = full[np.maximum.accumulate(positions)]
+                dtype, packed = _pack_ints(full)
+                entry = {"enc": "quant", "form": form, "params": params, "dtype": dtype}
+                mask = b""
+                if nan.any():
+                    mask = np.packbits(nan).tobytes()
+                    entry["mask"] = len(mask)
+                return entry, zlib.compress(mask + packed, self.ZLIB_LEVEL)
+
+        # Byte shuffle: esponenti e bit alti della mantissa variano poco e si comprimono bene
+        shuffled = x.view(np.uint8).reshape(-1, 8).T.tobytes()
+        return {"enc": "raw"}, zlib.compress(shuffled, self.ZLIB_LEVEL)
+
+    def _candidates(self, name, x):
+        yield from self._hints.get(name, [])
+        yield "int", []
+        if name == "time_s":
+            yield "div", [1000]
+        if name == "abs_load_N":
+            for divisor in (1, 10, 100, 1000):
+                yield "load", [divisor]
+            yield "f32load", []
+        if name == "abs_disp_mm":
+            for quantum in _estimate_quanta(x):
+                yield "mul", [quantum]
+        for exponent in range(1, 7):
+            yield "div", [10 ** exponent]
+        yield "f32", []
+
+    # --- LETTURA ---
+    def __len__(self):
+        return self._size
+
+    @property
+    def num_chunks(self):
+        return len(self._index)
+
+    @property
+    def nbytes(self):
+        """ Byte compressi dei chunk. """
+        return sum(size for _, size, _ in self._index)
+
+    def chunk_bounds(self, i):
+        """ `(primo campione, campione dopo l'ultimo)` del chunk `i`. """
+        start = sum(rows for _, _, rows in self._index[:i])
+        return start, start + self._index[i][2]
+
+    def read_chunk(self, i, names=None):
+        """
+        Chunk `i` decodificato: array float64 colonne x campioni. Con `names`
+        solo quelle colonne, nell'ordine dato: gli altri payload del chunk
+        non vengono decompressi.
+        """
+        data = self._chunks[i] if self._path is None else self._read_raw(i)
+        return self._decode_chunk(data, names)
+
+    def read_column(self, name):
+        """ Colonna `name` dell'intero archivio, decodificando solo i suoi payload. """
+        values = np.empty(self._size, dtype=np.float64)
+        position = 0
+        for i in range(self.num_chunks):
+            block = self.read_chunk(i, (name,))
+            values[position:position + block.shape[1]] = block[0]
+            position += block.shape[1]
+        return values
+
+    def read(self, start=0, stop=None):
+        """ Campioni `[start:stop]` (colonne x campioni), decodificando solo i chunk che li contengono. """
+        stop = self._size if stop is None else min(stop, self._size)
+        out = np.empty((len(self.columns), max(stop - start, 0)), dtype=np.float64)
+        chunk_start = 0
+        for i, (_, _, rows) in enumerate(self._index):
+            chunk_stop = chunk_start + rows
+            if chunk_stop > start and chunk_start < stop:
+                block = self.read_chunk(i)
+                a, b = max(start, chunk_start), min(stop, chunk_stop)
+                out[:, a - start:b - start] = block[:, a - chunk_start:b - chunk_start]
+            chunk_start = chunk_stop
+        return out
+
+    def _decode_chunk(self, data, names=None):
+        (head_len,) = _U32.unpack_from(data)
+        header = json.loads(data[4:4 + head_len])
+        rows = header["rows"]
+        entries = header["columns"]
+        # I payload sono in fila nell'ordine delle colonne: la posizione di ognuno viene dalle lunghezze
+        starts = np.cumsum([4 + head_len] + [entry["len"] for entry in entries]).tolist()
+        wanted = range(len(self.columns)) if names is None else [self.columns.index(name) for name in names]
+        decoded = {}
+
+        def column(i):
+            if i not in decoded:
+                entry = entries[i]
+                if entry["enc"] == "ref": # colonna assoluta meno l'offset
+                    decoded[i] = column(self.columns.index(entry["ref"])) - entry["offset"]
+                else:
+                    decoded[i] = _decode_column(entry, data[starts[i]:starts[i + 1]], rows)
+            return decoded[i]
+
+        out = np.empty((len(wanted), rows), dtype=np.float64)
+        for row, i in enumerate(wanted):
+            out[row] = column(i)
+        return out
+
+    # --- FILE .utmch ---
+    def to_bytes(self):
+        """ Contenuto del file `.utmch` (chunk in memoria). """
+        buffer = bytearray()
+        head = json.dumps({"columns": list(self.columns)}).encode("utf-8")
+        buffer += MAGIC + _U32.pack(len(head)) + head
+        index = []
+        for i in range(self.num_chunks):
+            data = self._chunks[i] if self._path is None else self._read_raw(i)
+            index.append([len(buffer), len(data), self._index[i][2]])
+            buffer += data
+        index_offset = len(buffer)
+        index_json = json.dumps(index).encode("utf-8")
+        buffer += _U32.pack(len(index_json)) + index_json + _TRAILER.pack(index_offset, END_MAGIC)
+        return bytes(buffer)
+
+    def save(self, path):
+        """ Scrive l'archivio in `path` (file temporaneo, poi sostituito). """
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as file:
+            file.write(self.to_bytes())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Archivio da un contenuto `.utmch` in memoria (es. voce di una sessione). """
+        columns, index = _parse_archive(data)
+        store = cls(columns)
+        store._chunks = [data[offset:offset + size] for offset, size, _ in index]
+        store._index = [[None, size, rows] for _, size, rows in index]
+        store._size = sum(rows for _, _, rows in index)
+        return store
+
+    @classmethod
+    def open(cls, path):
+        """ Archivio `.utmch` su file: legge solo intestazione e indice, i chunk su richiesta. """
+        with open(path, "rb") as file:
+            data = file.read(len(MAGIC) + 4)
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{os.path.basename(path)} non è un archivio {FILE_EXTENSION}")
+            (head_len,) = _U32.unpack_from(data, len(MAGIC))
+            columns = json.loads(file.read(head_len))["columns"]
+            size = file.seek(0, os.SEEK_END)
+            file.seek(size - _TRAILER.size)
+            index_offset, end_magic = _TRAILER.unpack(file.read(_TRAILER.size))
+            if end_magic != END_MAGIC:
+                raise ValueError(f"{os.path.basename(path)}: archivio incompleto")
+            file.seek(index_offset)
+            (index_len,) = _U32.unpack(file.read(4))
+            index = json.loads(file.read(index_len))
+        store = cls(columns)
+        store._path = path
+        store._chunks = [None] * len(index)
+        store._index = index
+        store._size = sum(rows for _, _, rows in index)
+        return store
+
+    def _read_raw(self, i):
+        offset, size, _ = self._index[i]
+        with open(self._path, "rb") as file:
+            file.seek(offset)
+            return file.read(size)
+
+
+def _parse_archive(data):
+    if data[:len(MAGIC)] != MAGIC or data[-len(END_MAGIC):] != END_MAGIC:
+        raise ValueError(f"Contenuto non valido per un archivio {FILE_EXTENSION}")
+    (head_len,) = _U32.unpack_from(data, len(MAGIC))
+    columns = json.loads(data[len(MAGIC) + 4:len(MAGIC) + 4 + head_len])["columns"]
+    index_offset, _ = _TRAILER.unpack_from(data, len(data) - _TRAILER.size)
+    (index_len,) = _U32.unpack_from(data, index_offset)
+    index = json.loads(data[index_offset + 4:index_offset + 4 + index_len])
+    return columns, index
+
+
+class CompressedTestRecorder(TestRecorder):
+    """
+    `TestRecorder` di un test concluso tenuto compresso in un
+    `ChannelStore` (storico "freddo" in memoria): le colonne lette (grafico)
+    sono decodificate una alla volta e tenute finché `release()` non le
+    libera; `chunk()` e `copy()` non decomprimono l'intero test. Un
+    accodamento (`append`/`extend`) lo riporta a registratore normale.
+    """
+
+    def __init__(self, store):
+        # Niente super().__init__(): `_data`/`_size` nascono solo se serve (_thaw)
+        self._store = store
+        self._column_cache = {}
+
+    def __getattr__(self, name):
+        # Chiamato solo per attributi non ancora presenti: `_data`/`_size`
+        # servono ai metodi che modificano il registratore
+        if name in ("_data", "_size"):
+            self._thaw()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    @property
+    def is_compressed(self):
+        return "_data" not in self.__dict__
+
+    @property
+    def store(self):
+        return self._store
+
+    def _thaw(self):
+        block = self._store.read()
+        data = np.empty((len(self.COLUMNS), max(block.shape[1], 16)), dtype=np.float64)
+        data[:, :block.shape[1]] = block
+        self._data = data
+        self._size = block.shape[1]
+        self._column_cache = {}
+
+    def column(self, name):
+        if not self.is_compressed:
+            return super().column(name)
+        if name not in self._column_cache:
+            self._column_cache[name] = self._store.read_column(name)
+        return self._column_cache[name]
+
+    def chunk(self, start, stop=None):
+        if not self.is_compressed:
+            return super().chunk(start, stop)
+        return self._store.read(start, stop)
+
+    def row(self, index):
+        if not self.is_compressed:
+            return super().row(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return tuple(self._store.read(index, index + 1)[:, 0].tolist())
+
+    def copy(self):
+        # L'archivio non cambia più: la copia lo condivide
+        if self.is_compressed:
+            return CompressedTestRecorder(self._store)
+        return super().copy()
+
+    def release(self):
+        """ Libera le colonne decodificate (restano solo i dati compressi). """
+        self._column_cache = {}
+
+    def __len__(self):
+        return len(self._store) if self.is_compressed else self._size
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        if not self.is_compressed:
+            return super().__repr__()
+        return (f"CompressedTestRecorder(samples={len(self._store)}, "
+                f"compressed_bytes={self._store.nbytes}, cached_columns={sorted(self._column_cache)})")
+
+
+def compress_recorder(recorder, **hints):
+    """ `CompressedTestRecorder` con i dati di `recorder` (vedi `ChannelStore` per gli `hints`). """
+    if isinstance(recorder, CompressedTestRecorder) and recorder.is_compressed:
+        return recorder
+    return CompressedTestRecorder(ChannelStore.from_recorder(recorder, **hints))
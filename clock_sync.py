@@ -0,0 +1,213 @@
+# clock_sync.py
+
+from collections import deque
+
+import numpy as np
+
+MILLIS_WRAP = 2**32 # millis() dell'ESP32 è un uint32: torna a zero dopo ~49,7 giorni
+
+
+class ClockSync:
+    """
+    Modello dell'orologio dell'ESP32 (`time_ms` dei pacchetti `D:`) rispetto
+    all'orologio monotonico dell'host (`time.monotonic()` all'istante della
+    lettura dalla porta).
+
+    Il ritardo di arrivo `host - device` di ogni campione è la somma di una
+    parte lenta (offset tra i due orologi più deriva dei quarzi) e della
+    latenza del collegamento, che ha un minimo e una coda di jitter (USB,
+    scheduler, thread). Il modello è l'inviluppo inferiore del ritardo: una
+    retta con pendenza `drift` (stimata con i minimi su finestre di
+    `WINDOW_S` secondi di tempo device) che non supera mai il ritardo
+    misurato. Sottraendo la latenza minima di sola andata, stimata come metà
+    del minimo tempo di andata e ritorno (`add_round_trip()`), si ottiene
+    l'istante di acquisizione sull'orologio dell'host, senza il jitter di
+    arrivo.
+
+    `time_ms` che torna indietro (wrap a 2^32, `START_TEST`/`RESET_TIMER`,
+    riavvio dell'ESP32) apre una nuova epoca: la deriva stimata resta, l'
+    offset riparte. Se il ritardo esce dal modello di oltre
+    `RESYNC_TOLERANCE_S` (salto in avanti del contatore, cambio della base
+    dei tempi dell'host come in un replay) il modello si risincronizza.
+
+    Usata nel thread del parser (`PacketParser.flush()`); `state` è un
+    dizionario sostituito a ogni aggiornamento, leggibile da altri thread.
+    """
+
+    WINDOW_S = 1.0             # finestra (tempo device) su cui si prende il ritardo minimo
+    MAX_WINDOWS = 300          # storia del fit: 5 minuti
+    MIN_DRIFT_SPAN_S = 30.0    # storia minima per stimare la deriva
+    MAX_DRIFT = 500e-6         # oltre 500 ppm è un errore di fit, non un quarzo
+    RESYNC_TOLERANCE_S = 0.5
+    MAX_ROUND_TRIPS = 64
+
+    def __init__(self):
+        self.drift = 0.0 # secondi host in più per secondo device
+        self.one_way_latency_s = None
+        self.wraps = 0
+        self.epochs = 0
+        self.resyncs = 0
+        self.samples = 0
+        self._round_trips = deque(maxlen=self.MAX_ROUND_TRIPS)
+        self._last_raw = None # ultimo time_ms ricevuto (uint32)
+        self._last_ms = 0     # lo stesso, srotolato nell'epoca corrente
+        self._reset_envelope()
+        self.state = self._snapshot()
+
+    def _reset_envelope(self):
+        self._ref = 0.0    # tempo device (s) di riferimento della retta
+        self._a = None     # ritardo minimo (s) a `_ref`; None = nessun modello
+        self._windows = [] # (tempo device, ritardo minimo) delle finestre chiuse
+        self._window = None # [indice, tempo device, ritardo minimo] della finestra corrente
+        self._jitter = [0.0, 0.0, 0] # somma, massimo, conteggio dell'eccesso sull'inviluppo
+
+    def offset_at(self, device_s):
+        """ `host - device` all'istante di acquisizione `device_s` (epoca corrente), o None. """
+        if self._a is None:
+            return None
+        return self._a + self.drift * (device_s - self._ref) - (self.one_way_latency_s or 0.0)
+
+    def add_round_trip(self, sent_s, received_s):
+        """ Richiesta scritta a `sent_s` e risposta letta a `received_s` (orologio dell'host). """
+        rtt = received_s - sent_s
+        if not 0.0 < rtt < 1.0:
+            return
+        self._round_trips.append(rtt)
+        self.one_way_latency_s = min(self._round_trips) / 2.0
+        self.state = self._snapshot(last_rtt=rtt)
+
+    def align(self, time_s, arrival_s):
+        """
+        Istanti di acquisizione sull'orologio dell'host per campioni con tempo
+        device `time_s` (secondi, da `time_ms`) letti agli istanti `arrival_s`
+        (array della stessa lunghezza, in ordine di arrivo). Aggiorna il
+        modello con gli stessi campioni.
+        """
+        raw = np.rint(np.asarray(time_s) * 1000.0).astype(np.int64)
+        arrival = np.asarray(arrival_s, dtype=np.float64)
+        aligned = np.empty(len(raw))
+        if not len(raw):
+            return aligned
+        new_epoch = self._last_raw is None
+        previous = np.concatenate(([raw[0] if new_epoch else self._last_raw], raw[:-1]))
+        steps = (raw - previous) % MILLIS_WRAP
+        backward = steps >= MILLIS_WRAP // 2
+        self.wraps += int(np.count_nonzero(~backward & (raw < previous)))
+        starts = np.flatnonzero(backward).tolist()
+        if new_epoch or (starts and starts[0] == 0):
+            starts = starts if starts and starts[0] == 0 else [0] + starts
+            boundaries = starts + [len(raw)]
+            first_continues = False
+        else:
+            boundaries = [0] + starts + [len(raw)]
+            first_continues = True
+        for k, (begin, end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+            if k == 0 and first_continues:
+                device_ms = self._last_ms + np.cumsum(steps[begin:end])
+            else:
+                # time_ms tornato indietro: nuova epoca a partire dal valore ricevuto
+                self.epochs += 1
+                self._reset_envelope()
+                device_ms = raw[begin] + np.concatenate(([0], np.cumsum(steps[begin + 1:end])))
+            self._last_ms = int(device_ms[-1])
+            device = device_ms / 1000.0
+            aligned[begin:end] = device + self._update(device, arrival[begin:end])
+        self._last_raw = int(raw[-1])
+        self.samples += len(raw)
+        return aligned
+
+    def _update(self, device, arrival):
+        """ Aggiorna l'inviluppo con un tratto della stessa epoca; restituisce l'offset per campione. """
+        delay = arrival - device
+        if self._a is None:
+            self._ref, self._a = float(device[0]), float(delay[0])
+        envelope = self._a + self.drift * (device - self._ref)
+        excess = delay - envelope
+        below = float(excess.min())
+        if below < -self.RESYNC_TOLERANCE_S and self._window is not None:
+            # arrivati prima del possibile: contatore avanzato di colpo o base dei tempi cambiata
+            self.resyncs += 1
+            self._reset_envelope()
+            self._ref, self._a = float(device[0]), float(delay[0])
+            envelope = self._a + self.drift * (device - self._ref)
+            excess = delay - envelope
+            below = float(excess.min())
+        if below < 0.0:
+            # l'inviluppo resta sotto ogni ritardo misurato
+            self._a += below
+            envelope += below
+            excess -= below
+        self._jitter[0] += float(excess.sum())
+        self._jitter[1] = max(self._jitter[1], float(excess.max()))
+        self._jitter[2] += len(excess)
+
+        # minimi per finestra di WINDOW_S secondi di tempo device
+        index = np.floor(device / self.WINDOW_S).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+        minima = np.minimum.reduceat(delay, starts)
+        hits = np.flatnonzero(delay == np.repeat(minima, np.diff(np.append(starts, len(index)))))
+        first = hits[np.searchsorted(hits, starts)] # primo campione con il minimo di ogni finestra
+        windows = list(zip(index[starts].tolist(), device[first].tolist(), minima.tolist()))
+        window = self._window
+        if window is not None and window[0] == windows[0][0]:
+            # il tratto prosegue la finestra aperta
+            _, device_min, delay_min = windows.pop(0)
+            if delay_min < window[2]:
+                window[1], window[2] = device_min, delay_min
+        closed_before = len(self._windows)
+        if windows:
+            if window is not None:
+                self._windows.append((window[1], window[2]))
+            self._windows.extend((device_min, delay_min) for _, device_min, delay_min in windows[:-1])
+            self._window = list(windows[-1])
+        if len(self._windows) > closed_before:
+            self._fit()
+            envelope = self._a + self.drift * (device - self._ref)
+        return envelope - (self.one_way_latency_s or 0.0)
+
+    def _fit(self):
+        """ Deriva (minimi quadrati sui minimi di finestra) e offset dell'inviluppo inferiore. """
+        del self._windows[:-self.MAX_WINDOWS]
+        points = np.array(self._windows + [tuple(self._window[1:])])
+        device, delay = points[:, 0], points[:, 1]
+        if device[-1] - device[0] >= self.MIN_DRIFT_SPAN_S:
+            slope = np.polyfit(device - device[-1], delay, 1)[0]
+            self.drift = float(np.clip(slope, -self.MAX_DRIFT, self.MAX_DRIFT))
+        ref = float(device[-1])
+        a = float((delay - self.drift * (device - ref)).min())
+        # la finestra chiusa con ritardo minimo ben oltre il modello: il collegamento è cambiato
+        last_excess = self._windows[-1][1] - (self._a + self.drift * (self._windows[-1][0] - self._ref))
+        if last_excess > self.RESYNC_TOLERANCE_S:
+            self.resyncs += 1
+            window = self._window
+            self._reset_envelope()
+            self._window = window
+            a = window[2]
+            ref = window[1]
+        self._ref, self._a = ref, a
+        jitter_sum, jitter_max, jitter_count = self._jitter
+        self._jitter = [0.0, 0.0, 0]
+        self.state = self._snapshot(jitter_mean=jitter_sum / jitter_count if jitter_count else None,
+                                    jitter_max=jitter_max if jitter_count else None)
+
+    def _snapshot(self, last_rtt=None, jitter_mean=None, jitter_max=None):
+        previous = getattr(self, "state", {})
+        device_s = self._last_ms / 1000.0
+        offset = self.offset_at(device_s)
+        return {
+            "synced": self._a is not None,
+            "device_time_s": device_s,
+            "offset_s": offset,
+            "drift_ppm": self.drift * 1e6,
+            "one_way_latency_s": self.one_way_latency_s,
+            "min_rtt_s": min(self._round_trips) if self._round_trips else None,
+            "last_rtt_s": last_rtt if last_rtt is not None else previous.get("last_rtt_s"),
+            "round_trips": len(self._round_trips),
+            "jitter_mean_s": jitter_mean if jitter_mean is not None else previous.get("jitter_mean_s"),
+            "jitter_max_s": jitter_max if jitter_max is not None else previous.get("jitter_max_s"),
+            "windows": len(self._windows),
+            "samples": self.samples,
+            "wraps": self.wraps,
+            "epochs": self.epochs,
+            "resyncs": self.resyncs,
+        }
@@ -1,21 +1,144 @@
+import selectors
+import socket
+import time
 import serial
 import serial.tools.list_ports
-import time
 from PyQt6.QtCore import QObject, pyqtSignal
 from queue import Queue
 
+from binary_protocol import RECORD_SIZE, SYNC_BYTES, count_valid_records
+
+class LineFramer:
+    """
+    Smonta lo stream seriale in righe terminate da `\n`.
+
+    I byte nuovi vengono accodati a un unico `bytearray`; `feed()` lo
+    scandisce una sola volta con un offset mobile (`find` da `start`),
+    decodifica ogni riga completa da una `memoryview` senza copie
+    intermedie e compatta il buffer (scarta le righe consumate) **una volta**
+    per lettura. Il costo è lineare nei byte ricevuti anche quando arriva
+    un grosso arretrato tutto insieme (es. dopo uno stallo della GUI).
+
+    Nello streaming binario (`SET_MODE:STREAMING_BIN`) i record a lunghezza
+    fissa di `binary_protocol.py` arrivano mescolati alle righe `STATUS:`:
+    una sync all'inizio di un frame apre un record, che viene accettato solo
+    se la CRC è corretta (altrimenti si scarta un byte e si risincronizza).
+    Record validi consecutivi sono consegnati come un unico blocco `bytes`.
+    """
+
+    def __init__(self, read_size=4096):
+        self._buffer = bytearray()
+        self._read_buffer = bytearray(read_size)  # destinazione riutilizzata di readinto()
+
+    def read_view(self, n):
+        """ Vista scrivibile di `n` byte sul buffer di lettura preallocato (cresce per raddoppio). """
+        if n > len(self._read_buffer):
+            size = len(self._read_buffer)
+            while size < n:
+                size *= 2
+            self._read_buffer = bytearray(size)
+        return memoryview(self._read_buffer)[:n]
+
+    def feed(self, data):
+        """
+        Accoda `data` e restituisce, in ordine di arrivo, le righe complete
+        non vuote (`str`, già `strip()`), i blocchi di record binari validi
+        (`bytes`, lunghezza multipla di RECORD_SIZE) e, prima del frame che
+        segue una risincronizzazione, il numero di byte scartati (`int`).
+        """
+        buffer = self._buffer
+        buffer.extend(data)
+        items = []
+        start = 0
+        skipped = 0 # byte scartati dall'ultima risincronizzazione
+        size = len(buffer)
+        with memoryview(buffer) as view:
+            while start < size:
+                if buffer.startswith(SYNC_BYTES, start):
+                    count = (size - start) // RECORD_SIZE
+                    if count == 0:
+                        break # record incompleto: attende altri byte
+                    valid = count_valid_records(buffer, start, count)
+                    if valid:
+                        if skipped:
+                            items.append(skipped)
+                            skipped = 0
+                        stop = start + valid * RECORD_SIZE
+                        items.append(bytes(view[start:stop]))
+                        start = stop
+                    else:
+                        start += 1 # sync spuria o record corrotto: risincronizza
+                        skipped += 1
+                    continue
+                end = buffer.find(b"\n", start)
+                sync = buffer.find(SYNC_BYTES, start, size if end < 0 else end)
+                if sync >= 0:
+                    skipped += sync - start
+                    start = sync # byte senza '\n' prima di un record: resti di un record corrotto
+                    continue
+                if end < 0:
+                    break
+                line_str = str(view[start:end], "utf-8", "ignore").strip()
+                if line_str:
+                    if skipped:
+                        items.append(skipped)
+                        skipped = 0
+                    items.append(line_str)
+                start = end + 1
+        if skipped:
+            items.append(skipped)
+        if start:
+            del buffer[:start] # compattazione unica: resta solo il frame incompleto
+        return items
+
+
 class SerialCommunicator(QObject):
-    data_received = pyqtSignal(str)
+    """
+    Comunicazione seriale con l'ESP32, eseguita in un `QThread` dedicato.
+
+    `run()` è un piccolo reactor: attende con un `selectors` (epoll/kqueue
+    sui sistemi POSIX) sul descrittore della porta e su una coppia di socket
+    di risveglio, quindi si sveglia solo quando ci sono byte da leggere o
+    quando `send_command()`, `connect_to_port()`, `disconnect_port()` o
+    `stop()` lo segnalano. A riposo non consuma CPU e i comandi partono
+    subito, senza attendere il giro di polling.
+
+    Ogni lettura è emessa con l'istante dell'host (`time.monotonic()`) in
+    cui è avvenuta, e ogni comando scritto è segnalato con `command_sent`:
+    servono alla sincronizzazione degli orologi (`clock_sync.py`).
+
+    Con `start_capture()` tutto il traffico (letture grezze e comandi) viene
+    registrato anche su un `serial_capture.CaptureWriter`, per riprodurlo
+    in seguito. Con un `latency_tracer.LatencyTracer` attivo ogni lettura
+    consegnata porta con sé l'istante di lettura e di framing.
+    """
+
+    lines_received = pyqtSignal(object, float) # righe (str) e blocchi di record binari (bytes) di una lettura, istante
+    command_sent = pyqtSignal(str, float) # comando scritto sulla porta, istante (time.monotonic())
     port_error = pyqtSignal(str)
     connected = pyqtSignal()
     disconnected = pyqtSignal()
 
-    def __init__(self):
+    POLL_INTERVAL_S = 0.002 # ripiego se la porta non espone fileno() (Windows, URL pyserial)
+    IDLE_TIMEOUT_S = 0.5    # risveglio di sicurezza, nessun lavoro se non serve
+
+    def __init__(self, latency_tracer=None):
         super().__init__()
         self.serial_port = None
         self.is_running = True
         self.command_queue = Queue()
 
+        # socketpair invece di os.pipe: selezionabile anche su Windows
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._watched_port = None # porta attualmente registrata nel selettore
+        self._watched_fd = None
+        self._capture = None # CaptureWriter attivo (serial_capture.py), se la cattura è abilitata
+        self.latency_tracer = latency_tracer
+
     def connect_to_port(self, port_name):
         try:
             # timeout=0 → lettura non bloccante
@@ -24,6 +147,7 @@ class SerialCommunicator(QObject):
             self.connected.emit()
         except serial.SerialException as e:
             self.port_error.emit(f"Errore connessione: {e}")
+        self._wake()
 
     def disconnect_port(self):
         if self.serial_port and self.serial_port.is_open:
@@ -31,52 +155,119 @@ class SerialCommunicator(QObject):
                 self.serial_port.close()
             except:
                 pass
+        self._wake()
         self.disconnected.emit()
 
     def stop(self):
         self.is_running = False
         self.disconnect_port()
 
+    def start_capture(self, writer):
+        """ Registra da ora in poi il traffico sulla porta in `writer` (`CaptureWriter`). """
+        self.stop_capture()
+        self._capture = writer
+
+    def stop_capture(self):
+        """ Chiude la cattura in corso, se presente, e ne restituisce il writer. """
+        writer, self._capture = self._capture, None
+        if writer is not None:
+            writer.close()
+        return writer
+
     def send_command(self, command: str):
-        """Accoda un comando da inviare all'ESP32"""
+        """Accoda un comando da inviare all'ESP32 e sveglia il loop di run()"""
         self.command_queue.put(command)
+        self._wake()
 
     def run(self):
-        buffer = bytearray()
+        framer = LineFramer()
         while self.is_running:
-            # --- Invio comandi in coda ---
-            if not self.command_queue.empty():
+            port, port_fd = self._watch_port()
+            timeout = self.POLL_INTERVAL_S if port is not None and port_fd is None else self.IDLE_TIMEOUT_S
+
+            # --- Attesa: porta leggibile, comando/stop/(dis)connessione, o timeout ---
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wake_r:
+                    self._drain_wakeups()
+
+            # --- Invio comandi in coda (tutti quelli presenti, subito) ---
+            while not self.command_queue.empty():
                 command = self.command_queue.get()
                 if self.serial_port and self.serial_port.is_open:
                     try:
                         #print(f"DEBUG COMM: scrivo {command}")
-                        self.serial_port.write(f"{command}\n".encode("utf-8"))
+                        data = f"{command}\n".encode("utf-8")
+                        self.serial_port.write(data)
                         self.serial_port.flush()
+                        self.command_sent.emit(command, time.monotonic())
+                        capture = self._capture
+                        if capture is not None:
+                            capture.write_outbound(data)
                     except serial.SerialException as e:
                         self.port_error.emit(f"Errore invio: {e}")
 
             # --- Lettura dati ---
-            if self.serial_port and self.serial_port.is_open:
+            if port is not None and port.is_open:
                 try:
-                    n = self.serial_port.in_waiting
+                    n = port.in_waiting
                     if n:
-                        data = self.serial_port.read(n)
-                        buffer.extend(data)
-
-                        # smonta in righe complete
-                        while b"\n" in buffer:
-                            line_bytes, buffer = buffer.split(b"\n", 1)
-                            line_str = line_bytes.decode("utf-8", errors="ignore").strip()
-                            if line_str:
-                                self.data_received.emit(line_str)
-                    else:
-                        # piccolo sleep per non saturare la CPU
-                        time.sleep(0.002)
+                        with framer.read_view(n) as view:
+                            count = port.readinto(view)
+                            read_s = time.monotonic()
+                            tracer = self.latency_tracer
+                            t_read = tracer.now() if tracer is not None and tracer.enabled else 0
+                            capture = self._capture
+                            if capture is not None:
+                                capture.write_inbound(view[:count])
+                            # smonta in righe complete, consegnate con un solo segnale per lettura
+                            lines = framer.feed(view[:count])
+                        if lines:
+                            if t_read:
+                                tracer.begin(lines, t_read, count)
+                            self.lines_received.emit(lines, read_s)
                 except (serial.SerialException, OSError):
                     self.port_error.emit("Dispositivo disconnesso.")
                     self.disconnect_port()
-            else:
-                time.sleep(0.01)
+
+        self._watch_port() # porta già chiusa da stop(): la toglie dal selettore
+        self._selector.close()
+
+    def _watch_port(self):
+        """
+        Allinea il selettore alla porta corrente (aperta, chiusa o cambiata).
+        Restituisce `(porta, fd)`: `porta` è None se chiusa, `fd` è None se la
+        porta non è selezionabile e va letta in polling.
+        """
+        port = self.serial_port if self.serial_port and self.serial_port.is_open else None
+        if port is self._watched_port:
+            return port, self._watched_fd
+        if self._watched_fd is not None:
+            try:
+                self._selector.unregister(self._watched_fd)
+            except (KeyError, ValueError, OSError):
+                pass # fd già chiuso insieme alla porta
+        self._watched_port, self._watched_fd = port, None
+        if port is not None:
+            try:
+                fd = port.fileno()
+                self._selector.register(fd, selectors.EVENT_READ)
+                self._watched_fd = fd
+            except (AttributeError, OSError, ValueError, serial.SerialException):
+                pass # nessun descrittore selezionabile: lettura in polling
+        return port, self._watched_fd
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass # buffer pieno (un risveglio è già in attesa) o socket già chiuso
+
+    def _drain_wakeups(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except OSError:
+            pass # BlockingIOError: svuotato
 
     @staticmethod
     def list_available_ports():
@@ -88,5 +279,8 @@ class SerialCommunicator(QObject):
                 try:
                     self.serial_port.write(b"!\n")
                     self.serial_port.flush()
+                    capture = self._capture
+                    if capture is not None:
+                        capture.write_outbound(b"!\n")
                 except serial.SerialException as e:
                     self.port_error.emit(f"Errore invio emergency stop: {e}")
@@ -12,7 +12,15 @@ import numpy as np
 from collections import deque
 from datetime import datetime
 import time
-from data_saver import DataSaver
+import os
+import zipfile
+from recorder import TestRecorder
+from channel_store import CompressedTestRecorder
+from autosave_writer import FILE_EXTENSION, LiveAutosave
+from export_service import snapshot_specimens
+from session_file import SESSION_EXTENSION, load_session, save_session_job
+from export_backends import file_dialog_filter, path_for_filter
+from live_plot import IncrementalSeries, LodCurve, column_slice, resistance_slice
 
 from custom_widgets import DisplayWidget # Assicurati che DisplayWidget sia importato
 
@@ -341,7 +349,8 @@ class CyclicTestWidget(QWidget):
         self.test_sequence = []
         self.specimens = {} # Aggiunto per gestione batch
         self.current_specimen_name = None # Aggiunto per gestione batch
-        self.current_test_data = []
+        self.live_autosave = None # registrazione su disco del test in corso (autosave_writer.py)
+        self.current_test_data = TestRecorder()
         self.current_resistance_ohm = -999.0 # Per memorizzare l'ultimo valore LCR
         self.absolute_encoder_displacement_mm = None # Canale encoder esterno (sola lettura, Livello 1)
         self.encoder_displacement_offset_mm = 0.0 # Zero relativo del canale encoder
@@ -429,12 +438,19 @@ class CyclicTestWidget(QWidget):
         graph_layout = QVBoxLayout()
         self.plot_widget = pg.PlotWidget()
         self.plot_widget.setBackground('w'); self.plot_widget.showGrid(x=True, y=True)
+        # Zoom/pan/resize: ricalcola il livello di dettaglio delle curve (una volta per frame)
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(self._on_plot_view_changed)
+        self.plot_widget.getViewBox().sigResized.connect(self._on_plot_view_changed)
         self.plot_widget.setLabel('left', 'Relative Load (N)'); self.plot_widget.setLabel('bottom', 'Relative Displacement (mm)')
         self.live_curves = {}  # dict: source ("motor"/"encoder") -> curva live corrente
 
         self.resistance_axis_viewbox = None # La ViewBox per la resistenza
         self.resistance_axis_item = None    # L'AxisItem a destra
         self.resistance_curve = None
+        # Buffer di visualizzazione incrementali del test in corso (nome serie -> IncrementalSeries)
+        self.live_series = {}
+        # Livelli di dettaglio min/max delle curve disegnate (curva pyqtgraph -> LodCurve)
+        self.lod_curves = {}
 
 
         graph_controls_layout = QHBoxLayout()
@@ -546,17 +562,24 @@ class CyclicTestWidget(QWidget):
         self.limits_button = QPushButton("LIMITS")
         self.limits_button.setStyleSheet("background-color: #F39C12; color: white;")
         self.finish_save_button = QPushButton("FINISH & SAVE")
+        self.save_session_button = QPushButton("SAVE SESSION")
+        self.open_session_button = QPushButton("OPEN SESSION")
+        self.import_button = QPushButton("IMPORT")
 
-        # Applica font e altezza standard (button_font) a questi 4 pulsanti
-        for btn in [self.zero_rel_load_button, self.zero_rel_disp_button, self.limits_button, self.finish_save_button]:
+        # Applica font e altezza standard (button_font) a questi pulsanti
+        for btn in [self.zero_rel_load_button, self.zero_rel_disp_button, self.limits_button, self.finish_save_button,
+                    self.save_session_button, self.open_session_button, self.import_button]:
              btn.setFont(button_font) # Usa il font più piccolo definito prima
              btn.setMinimumHeight(35) # Altezza standard (come in Monotonic)
 
-        # Posiziona i pulsanti nella griglia (2x2)
+        # Posiziona i pulsanti nella griglia (2x3)
         general_controls_layout.addWidget(self.zero_rel_load_button, 0, 0)
         general_controls_layout.addWidget(self.limits_button, 0, 1)
         general_controls_layout.addWidget(self.zero_rel_disp_button, 1, 0)
         general_controls_layout.addWidget(self.finish_save_button, 1, 1)
+        general_controls_layout.addWidget(self.open_session_button, 0, 2)
+        general_controls_layout.addWidget(self.save_session_button, 1, 2)
+        general_controls_layout.addWidget(self.import_button, 0, 3)
 
         bottom_layout.addLayout(general_controls_layout) # Aggiunge la griglia al layout principale
 
@@ -600,6 +623,9 @@ class CyclicTestWidget(QWidget):
         self.overlay_list.itemChanged.connect(self.on_overlay_item_changed)
         self.overlay_checkbox.stateChanged.connect(self.refresh_plot) # Collega la checkbox
         self.finish_save_button.clicked.connect(self.on_finish_and_save)
+        self.save_session_button.clicked.connect(self.on_save_session)
+        self.open_session_button.clicked.connect(self.on_open_session)
+        self.import_button.clicked.connect(self.on_import_results)
         
 
         self.up_button.pressed.connect(self.start_moving_up)
@@ -714,13 +740,15 @@ class CyclicTestWidget(QWidget):
             # Resetta il timer e i cicli nel firmware SOLO all'inizio della sequenza
             self.communicator.send_command("RESET_TIMER")
 
-            self.current_test_data = [] # Svuota i dati del test *imminente*
+            self.current_test_data = TestRecorder() # Svuota i dati del test *imminente*
+            self.main_window.ingest_stats.reset() # contatori di integrità dello stream, per questo test
+            self._start_live_autosave()
             self.refresh_plot() # Pulisce grafico e prepara curva live
 
             self.current_block_index = 0 # Siamo al primo blocco
 
             self.communicator.send_command(command) # Invia il comando del primo blocco (Ciclo o Rampa)
-            self.communicator.send_command("SET_MODE:STREAMING")
+            self.communicator.send_command(self.main_window.streaming_mode_command())
 
             self.is_test_running = True
             self.update_ui_for_test_state()
@@ -766,28 +794,50 @@ class CyclicTestWidget(QWidget):
         # --- INIZIO CORREZIONE: SALVATAGGIO DATI ---
         if self.current_specimen_name:
             # Salva i dati del test appena concluso
-            self.specimens[self.current_specimen_name]['test_data'] = self.current_test_data
+            # Il test concluso passa allo storico compresso senza perdita
+            # (channel_store.py), nel thread dell'ExportService per non fermare
+            # la GUI: fino ad allora resta il registratore del test
+            mw = self.main_window
+            recorder = self.current_test_data
+            self.specimens[self.current_specimen_name]['test_data'] = recorder
+            mw.export_service.compress_recorder(
+                recorder, lambda compressed: self._on_test_compressed(recorder, compressed),
+                pulses_to_mm=mw.PULSES_TO_MM, screw_pitch_mm=mw.SCREW_PITCH_MM,
+                encoder_counts_per_rev=mw.ENCODER_COUNTS_PER_REV)
+            self.specimens[self.current_specimen_name]['ingest_stats'] = self.main_window.ingest_stats.snapshot()
             print(f"DEBUG Cyclic: Dati salvati per {self.current_specimen_name}")
 
-            # --- NUOVO: LOGICA DI AUTOSAVE ---
-            try:
-                # Prepara i dati del provino, INCLUDENDO la sequenza di test
-                specimen_data_to_save = {
-                    **self.specimens[self.current_specimen_name],
-                    "test_sequence_setup": self.test_sequence 
-                }
-                specimen_to_save = {self.current_specimen_name: specimen_data_to_save}
-
-                # Crea un nome di file automatico
-                filename = f"AUTOSAVE_CYCLIC_{self.current_specimen_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+            # Chiude la registrazione su disco scritta durante il test
+            recording_path = None
+            if self.live_autosave is not None:
+                if self.live_autosave.finish({"ingest_stats": self.specimens[self.current_specimen_name]['ingest_stats']}):
+                    recording_path = self.live_autosave.path
+                self.live_autosave = None
 
-                saver = DataSaver()
-                # Salva il singolo provino usando la stessa logica del batch
-                # Passiamo None come info calibrazione per ora (o aggiungila se serve)
-                saver.save_batch_to_xlsx(specimen_to_save, filename, "N/A") 
-                print(f"DEBUG: Autosave ciclico completato per {self.current_specimen_name} in {filename}")
-            except Exception as e:
-                print(f"ERRORE AUTOSAVE CICLICO: {e}")
+            # --- NUOVO: LOGICA DI AUTOSAVE ---
+            # Conversione opzionale in xlsx (settings["autosave_xlsx"]): dalla
+            # registrazione su disco se integra, altrimenti dai dati in memoria.
+            # Accodata all'ExportService: la scrittura avviene in background
+            if self.main_window.settings.get("autosave_xlsx", True):
+                export_service = self.main_window.export_service
+                if recording_path:
+                    filename = os.path.splitext(recording_path)[0] + ".xlsx"
+                    export_service.export_recording(recording_path, filename)
+                else:
+                    # Prepara i dati del provino, INCLUDENDO la sequenza di test
+                    specimen_data_to_save = {
+                        **self.specimens[self.current_specimen_name],
+                        "test_sequence_setup": self.test_sequence
+                    }
+                    specimen_to_save = {self.current_specimen_name: specimen_data_to_save}
+
+                    # Crea un nome di file automatico
+                    filename = f"AUTOSAVE_CYCLIC_{self.current_specimen_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+                    # Salva il singolo provino usando la stessa logica del batch
+                    # Passiamo None come info calibrazione per ora (o aggiungila se serve)
+                    export_service.export_specimens(specimen_to_save, filename, "N/A")
+                print(f"DEBUG: Autosave ciclico accodato per {self.current_specimen_name} in {filename}")
             # --- FINE AUTOSAVE ---
         
         self.update_displays() # Aggiorna i display
@@ -796,7 +846,26 @@ class CyclicTestWidget(QWidget):
         self.refresh_plot()
         # --- FINE CORREZIONE ---
     
-    def handle_stream_data(self, load_N, disp_mm, time_s, cycle_count, resistance_ohm, encoder_disp_mm=None):
+    def _start_live_autosave(self):
+        """ Apre la registrazione su disco del test (chunk periodici, recuperabile dopo un crash). """
+        setup = {k: v for k, v in self.specimens[self.current_specimen_name].items()
+                 if k not in ("test_data", "ingest_stats")}
+        setup["test_sequence_setup"] = self.test_sequence
+        filename = f"AUTOSAVE_CYCLIC_{self.current_specimen_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FILE_EXTENSION}"
+        try:
+            self.live_autosave = LiveAutosave(
+                self.current_test_data, filename,
+                {"specimen_name": self.current_specimen_name, "test_type": "cyclic",
+                 "specimen": setup, "calibration_info": "N/A"},
+                self.main_window.settings.get("autosave_interval_s", 5.0), self)
+        except OSError as e:
+            self.live_autosave = None
+            print(f"ERRORE AUTOSAVE CICLICO: impossibile creare {filename}: {e}")
+
+    def handle_stream_data(self, load_N, disp_mm, time_s, cycle_count, resistance_ohm, encoder_disp_mm=None,
+                           host_time_s=None):
+        # Il tempo del test è `time_s` del firmware (azzerato a START_TEST): `host_time_s`
+        # (istante sull'orologio dell'host, clock_sync.py) non entra nella registrazione
         if not self.is_test_running:
             return
 
@@ -812,9 +881,18 @@ class CyclicTestWidget(QWidget):
 
         # 2. Aggiunge dati (canale encoder in coda, accanto allo spostamento a passi)
         current_block_num = self.current_block_index + 1
-        self.current_test_data.append((time_s, relative_disp, relative_load, disp_mm, load_N, cycle_count, current_block_num, resistance_ohm, encoder_disp_mm))
+        self.current_test_data.append(time_s, relative_disp, relative_load, disp_mm, load_N,
+                                      resistance_ohm, encoder_disp_mm,
+                                      cycle=cycle_count, block=current_block_num)
 
-        # 3. Aggiorna il grafico
+        # 3. Il grafico viene ridisegnato una volta per frame dal RenderScheduler
+        # condiviso, non a ogni pacchetto (i display li richiede MainWindow)
+        self.main_window.render_scheduler.request(self._render_live_frame)
+
+    def _render_live_frame(self):
+        """ Porta le curve live allo stato corrente (una volta per frame). """
+        if not self.is_test_running:
+            return
         specimen = self.specimens.get(self.current_specimen_name,
                                      {"gauge_length": 1.0, "area": 1.0})
         area = specimen.get("area", 1.0)
@@ -823,37 +901,35 @@ class CyclicTestWidget(QWidget):
         y_mode = self.y_axis_combo.currentText()
         active_sources = self._active_x_sources()
 
-        # Estrai dati (invariato)
-        times = [p[0] for p in self.current_test_data]
-        x_raw_motor = [p[1] for p in self.current_test_data]  # spostamento relativo a passi motore
-        y_raw_data = [p[2] for p in self.current_test_data]
+        # Parametri di conversione: se cambiano, le serie live vengono
+        # ricalcolate per intero; altrimenti si trasformano solo i nuovi campioni
+        key = (x_mode, y_mode, gauge, area, self.encoder_displacement_offset_mm)
+        strain_scale = (100.0 / gauge) if gauge > 0 else None
 
-        def compute_x(source):
+        def x_transform(source):
+            if "Strain" in x_mode and gauge > 0: scale = strain_scale
+            elif "Time" in x_mode: return column_slice("time_s")
+            else: scale = None
             if source == "encoder":
-                raw = [
-                    (p[8] - self.encoder_displacement_offset_mm) if len(p) > 8 and p[8] is not None else np.nan
-                    for p in self.current_test_data
-                ]
-            else:
-                raw = x_raw_motor
-            if "Strain" in x_mode and gauge > 0: return [(d / gauge) * 100 for d in raw]
-            elif "Time" in x_mode: return times
-            else: return raw
+                return column_slice("encoder_disp_mm", scale, self.encoder_displacement_offset_mm)
+            return column_slice("rel_disp_mm", scale)  # spostamento relativo a passi motore
 
         # Converte Y (invariato: sempre basato sul canale motore, indipendente dalla sorgente X)
-        if "Stress" in y_mode and area > 0: y_data_final = [(f / area) for f in y_raw_data]
-        elif "Strain" in y_mode and gauge > 0: y_data_final = [(d / gauge) * 100 for d in x_raw_motor]
-        elif "Displacement" in y_mode: y_data_final = x_raw_motor
-        else: y_data_final = y_raw_data
+        if "Stress" in y_mode and area > 0: y_transform = column_slice("rel_load_N", 1.0 / area)
+        elif "Strain" in y_mode and gauge > 0: y_transform = column_slice("rel_disp_mm", strain_scale)
+        elif "Displacement" in y_mode: y_transform = column_slice("rel_disp_mm")
+        else: y_transform = column_slice("rel_load_N")
 
         # Disegna una curva per ciascuna sorgente X attiva (Motor e/o Encoder)
-        x_data_final = None
+        x_monotonic = "Time" in x_mode
         for source in active_sources:
-            x_data_final = compute_x(source)
+            series = self._live_series(source, x_transform(source), y_transform)
+            x_data_final, y_data_final = series.update(self.current_test_data, key + (source,))
             curve = self.live_curves.get(source)
             if curve is None:
                 curve = self._create_live_curve(source, active_sources)
-            curve.setData(x_data_final, y_data_final)
+            self._set_curve_data(curve, x_data_final, y_data_final,
+                                 revision=(id(series), series.revision), x_monotonic=x_monotonic)
 
         # Aggiorna le etichette degli assi (invariato)
         self.plot_widget.setLabel("bottom", x_mode)
@@ -863,16 +939,36 @@ class CyclicTestWidget(QWidget):
         if self.resistance_curve: # Controlla se l'asse è attivo
             try:
                 resistance_source = "motor" if "motor" in active_sources else active_sources[0]
-                x_for_resistance = compute_x(resistance_source)
-                r_raw_data = [p[7] for p in self.current_test_data]
-                r_data_final = [r if r >= 0 else np.nan for r in r_raw_data]
-                self.resistance_curve.setData(x_for_resistance, r_data_final)
+                series = self._live_series("resistance", x_transform(resistance_source), resistance_slice)
+                x_for_resistance, r_data_final = series.update(self.current_test_data, key + (resistance_source,))
+                self._set_curve_data(self.resistance_curve, x_for_resistance, r_data_final, self.resistance_axis_viewbox,
+                                     revision=(id(series), series.revision), x_monotonic=x_monotonic)
             except Exception as e:
                 print(f"Errore aggiornamento curva resistenza live (Cyclic): {e}")
         # --- FINE AGGIUNTA ---
 
-        # 4. Aggiorna i display (invariato)
-        self.update_displays()
+    def _live_series(self, name, x_transform, y_transform):
+        """ Serie live `name` con le trasformazioni correnti (creata al primo uso). """
+        series = self.live_series.get(name)
+        if series is None:
+            series = self.live_series[name] = IncrementalSeries(x_transform, y_transform)
+        else:
+            series.set_transforms(x_transform, y_transform)
+        return series
+
+    def _set_curve_data(self, curve, x, y, viewbox=None, revision=None, x_monotonic=False):
+        """ Imposta i dati di una curva passando dalla sua piramide min/max (LodCurve). """
+        lod = self.lod_curves.get(curve)
+        if lod is None:
+            lod = self.lod_curves[curve] = LodCurve(curve, viewbox or self.plot_widget.getViewBox())
+        lod.set_data(x, y, revision=revision, x_monotonic=x_monotonic)
+
+    def _on_plot_view_changed(self, *args):
+        self.main_window.render_scheduler.request(self._render_lod_curves)
+
+    def _render_lod_curves(self):
+        for lod in list(self.lod_curves.values()):
+            lod.render()
 
     def update_displays(self):
         #print(f"DEBUG Cyclic UpdateDisplays: AbsLoad={self.absolute_load_N:.3f}, Offset={self.load_offset_N:.3f}")
@@ -933,7 +1029,8 @@ class CyclicTestWidget(QWidget):
             self.jog_speed_spinbox, self.goto_button, self.sequence_list, self.add_block_button, self.add_pause_button,
             self.edit_block_button, self.remove_block_button,
             self.zero_rel_load_button, self.zero_rel_disp_button,
-            self.limits_button, self.finish_save_button
+            self.limits_button, self.finish_save_button,
+            self.save_session_button, self.open_session_button, self.import_button
         ]
         for widget in widgets_to_toggle:
             widget.setEnabled(not is_running)
@@ -1586,6 +1683,7 @@ class CyclicTestWidget(QWidget):
             final_data = {
                 **modified_data, # Prende name, gauge, area dalla dialog
                 "test_data": original_data.get("test_data"),
+                "ingest_stats": original_data.get("ingest_stats"),
                 "visible": original_data.get("visible", True)
             }
             
@@ -1649,6 +1747,7 @@ class CyclicTestWidget(QWidget):
         self.plot_widget.clear() 
         self.plot_widget.addLegend()
         self.plot_curves = {}
+        self.lod_curves = {}
 
         # --- 2. Imposta Assi Principali ---
         x_mode = self.x_axis_combo.currentText()
@@ -1661,34 +1760,28 @@ class CyclicTestWidget(QWidget):
             area = specimen.get("area", 1.0)
             gauge = specimen.get("gauge_length", 1.0)
             if not raw_data: return [], [], []
-            try:
-                times = [p[0] for p in raw_data]
-                x_raw_motor = [p[1] for p in raw_data]
-                if source == "encoder":
-                    x_raw = [
-                        (p[8] - self.encoder_displacement_offset_mm) if len(p) > 8 and p[8] is not None else np.nan
-                        for p in raw_data
-                    ]
-                else:
-                    x_raw = x_raw_motor
-                y_raw = [p[2] for p in raw_data]
-                r_raw = [p[7] for p in raw_data]
-            except (IndexError, TypeError) as e:
-                print(f"Errore estrazione dati in convert_data (ciclico): {e}")
-                return [], [], []
-            if "Strain" in x_mode and gauge > 0: x = [(d / gauge) * 100 for d in x_raw]
+            times = raw_data.time_s
+            x_raw_motor = raw_data.rel_disp_mm
+            if source == "encoder":
+                x_raw = raw_data.encoder_disp_mm - self.encoder_displacement_offset_mm
+            else:
+                x_raw = x_raw_motor
+            y_raw = raw_data.rel_load_N
+            r_raw = raw_data.resistance_ohm
+            if "Strain" in x_mode and gauge > 0: x = (x_raw / gauge) * 100
             elif "Time" in x_mode: x = times
             else: x = x_raw
             # Y resta sempre basata sul canale motore, indipendente dalla sorgente X selezionata
-            if "Stress" in y_mode and area > 0: y = [(f / area) for f in y_raw]
-            elif "Strain" in y_mode and gauge > 0: y = [(d / gauge) * 100 for d in x_raw_motor]
+            if "Stress" in y_mode and area > 0: y = y_raw / area
+            elif "Strain" in y_mode and gauge > 0: y = (x_raw_motor / gauge) * 100
             elif "Displacement" in y_mode: y = x_raw_motor
             else: y = y_raw
-            r_data = [r if r >= 0 else np.nan for r in r_raw]
+            r_data = np.where(r_raw >= 0, r_raw, np.nan)
             return x, y, r_data
 
         # --- 4. Logica Overlay (una curva per sorgente X attiva) ---
         active_sources = self._active_x_sources()
+        x_monotonic = "Time" in x_mode  # il tempo cresce sempre: vista per ricerca binaria nei LodCurve
         show_overlay = self.overlay_checkbox.isChecked()
         if show_overlay:
             for name, specimen in self.specimens.items():
@@ -1696,7 +1789,8 @@ class CyclicTestWidget(QWidget):
                     for source in active_sources:
                         try:
                             x, y, _ = convert_data(specimen, specimen["test_data"], source)
-                            curve = self.plot_widget.plot(x, y, pen=self._pen_for_source(name, source), name=self._curve_label(name, source, active_sources))
+                            curve = self.plot_widget.plot([], [], pen=self._pen_for_source(name, source), name=self._curve_label(name, source, active_sources))
+                            self._set_curve_data(curve, x, y, x_monotonic=x_monotonic)
                             self.plot_curves[(name, source)] = curve
                         except Exception as e: print(f"Errore disegno overlay {name}/{source} (Cyclic): {e}")
         else:
@@ -1706,7 +1800,8 @@ class CyclicTestWidget(QWidget):
                     for source in active_sources:
                         try:
                             x, y, _ = convert_data(specimen, specimen["test_data"], source)
-                            curve = self.plot_widget.plot(x, y, pen=self._pen_for_source(self.current_specimen_name, source), name=self._curve_label(self.current_specimen_name, source, active_sources))
+                            curve = self.plot_widget.plot([], [], pen=self._pen_for_source(self.current_specimen_name, source), name=self._curve_label(self.current_specimen_name, source, active_sources))
+                            self._set_curve_data(curve, x, y, x_monotonic=x_monotonic)
                             self.plot_curves[(self.current_specimen_name, source)] = curve
                         except Exception as e: print(f"Errore disegno non-overlay {self.current_specimen_name}/{source} (Cyclic): {e}")
 
@@ -1743,7 +1838,7 @@ class CyclicTestWidget(QWidget):
                                 x, _, r_data = convert_data(specimen, specimen["test_data"])
                                 overlay_res_curve = pg.PlotDataItem(pen=pg.mkPen('orange', width=1, style=Qt.PenStyle.DotLine))
                                 self.resistance_axis_viewbox.addItem(overlay_res_curve)
-                                overlay_res_curve.setData(x, r_data)
+                                self._set_curve_data(overlay_res_curve, x, r_data, self.resistance_axis_viewbox, x_monotonic=x_monotonic)
                             except Exception as e: print(f"Errore disegno overlay resistenza {name} (Cyclic): {e}")
                 else: # Non overlay
                     if self.current_specimen_name:
@@ -1751,7 +1846,7 @@ class CyclicTestWidget(QWidget):
                         if specimen and specimen.get("test_data"):
                             try:
                                 x, _, r_data = convert_data(specimen, specimen["test_data"])
-                                self.resistance_curve.setData(x, r_data)
+                                self._set_curve_data(self.resistance_curve, x, r_data, self.resistance_axis_viewbox, x_monotonic=x_monotonic)
                             except Exception as e: print(f"Errore disegno non-overlay resistenza {self.current_specimen_name} (Cyclic): {e}")
             
             except Exception as e:
@@ -1769,9 +1864,20 @@ class CyclicTestWidget(QWidget):
         # handle_stream_data si occuperà dei dati live)
 
 
+    def _on_test_compressed(self, recorder, compressed):
+        """ Sostituisce il registratore del test concluso con la versione compressa (ExportService). """
+        for specimen in self.specimens.values():
+            if specimen.get("test_data") is recorder: # non rimpiazzato da un nuovo test o da un import
+                specimen["test_data"] = compressed
+        if self.current_test_data is recorder:
+            self.current_test_data = compressed
+
     def on_overlay_item_changed(self, item):
         name = item.text()
         self.specimens[name]["visible"] = (item.checkState() == Qt.CheckState.Checked)
+        test_data = self.specimens[name].get("test_data")
+        if not self.specimens[name]["visible"] and isinstance(test_data, CompressedTestRecorder):
+            test_data.release() # nascosto: restano solo i dati compressi
         self.refresh_plot()
 
     def get_pen_for_specimen(self, name):
@@ -1908,6 +2014,116 @@ class CyclicTestWidget(QWidget):
             self._calculate_estimated_duration()
 
 
+    # --- SESSIONE (salvataggio/riapertura del batch, vedi session_file.py) ---
+    def _session_state(self):
+        """ Stato del widget salvato nella sessione insieme ai provini. """
+        return {
+            "test_type": "cyclic",
+            "test_sequence": self.test_sequence,
+            "load_offset_N": self.load_offset_N,
+            "displacement_offset_mm": self.displacement_offset_mm,
+            "encoder_displacement_offset_mm": self.encoder_displacement_offset_mm,
+        }
+
+    def on_save_session(self):
+        if not self.specimens:
+            QMessageBox.information(self, "Info", "Nessun provino da salvare.")
+            return
+        default_filename = f"Session_Cyclic_{datetime.now().strftime('%Y-%m-%d_%H%M')}{SESSION_EXTENSION}"
+        filepath, _ = QFileDialog.getSaveFileName(self, "Salva Sessione Test Ciclici", default_filename,
+                                                  f"UTM Session (*{SESSION_EXTENSION})")
+        if filepath:
+            # Scrittura in background su una copia dei provini, come gli export
+            try:
+                specimens, state = snapshot_specimens(self.specimens), self._session_state()
+            except ValueError as e: # file di sessione spostato o sovrascritto (LazyTestRecorder)
+                self._on_batch_saved(False, str(e))
+                return
+            self.main_window.export_service.submit(
+                filepath, lambda progress: save_session_job(filepath, specimens, state),
+                on_finished=self._on_batch_saved)
+
+    def on_open_session(self):
+        if self.specimens:
+            reply = QMessageBox.question(
+                self, "Apri Sessione",
+                "Il batch corrente verrà sostituito dalla sessione aperta. Continuare?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            if reply != QMessageBox.StandardButton.Yes:
+                return
+        filepath, _ = QFileDialog.getOpenFileName(self, "Apri Sessione Test Ciclici", "",
+                                                  f"UTM Session (*{SESSION_EXTENSION})")
+        if not filepath:
+            return
+        try:
+            specimens, state = load_session(filepath)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            QMessageBox.critical(self, "Errore", f"Impossibile aprire la sessione: {e}")
+            return
+        if state.get("test_type") != "cyclic":
+            QMessageBox.warning(self, "Errore", "La sessione non contiene test di questo tipo.")
+            return
+
+        # I dati dei provini restano nel file finché non servono (grafico/export)
+        self.specimens = specimens
+        self.load_offset_N = state.get("load_offset_N", 0.0)
+        self.displacement_offset_mm = state.get("displacement_offset_mm", 0.0)
+        self.encoder_displacement_offset_mm = state.get("encoder_displacement_offset_mm", 0.0)
+        self.test_sequence = state.get("test_sequence", [])
+        self._update_sequence_list()
+        self._calculate_estimated_duration()
+        self.current_specimen_name = None
+        self.specimen_list.clear()
+        self.overlay_list.blockSignals(True) # itemChanged aggiornerebbe "visible" e il grafico a ogni riga
+        self.overlay_list.clear()
+        for name, data in specimens.items():
+            self.specimen_list.addItem(name)
+            item = QListWidgetItem(name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if data.get("visible", True) else Qt.CheckState.Unchecked)
+            self.overlay_list.addItem(item)
+        self.overlay_list.blockSignals(False)
+        self.refresh_plot()
+
+    # --- IMPORT (autosave/batch precedenti per il confronto, vedi data_importer.py) ---
+    def on_import_results(self):
+        filepaths, _ = QFileDialog.getOpenFileNames(self, "Importa Risultati", "",
+                                                    "Risultati Test (*.xlsx *.csv)")
+        if not filepaths:
+            return
+        # Lettura nel thread dell'export: la GUI resta libera durante l'import
+        self.main_window.export_service.import_files(filepaths, self._on_results_imported)
+
+    def _on_results_imported(self, results, errors):
+        """ Aggiunge al batch i provini importati da `on_import_results()` (thread GUI). """
+        imported = []
+        for specimens in results:
+            for name, data in specimens.items():
+                if "test_sequence_setup" in data:
+                    imported.append((name, data))
+
+        self.overlay_list.blockSignals(True) # itemChanged aggiornerebbe "visible" e il grafico a ogni riga
+        for name, data in imported:
+            # Nome già presente nel batch: il provino importato non lo sovrascrive
+            unique_name, i = name, 1
+            while unique_name in self.specimens:
+                unique_name = f"{name} (imported)" if i == 1 else f"{name} (imported {i})"
+                i += 1
+            data["name"] = unique_name
+            self.specimens[unique_name] = data
+            self.specimen_list.addItem(unique_name)
+            item = QListWidgetItem(unique_name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked)
+            self.overlay_list.addItem(item)
+        self.overlay_list.blockSignals(False)
+        self.refresh_plot()
+
+        if errors:
+            QMessageBox.warning(self, "Importazione", "Impossibile importare:\n" + "\n".join(errors))
+        elif not imported:
+            QMessageBox.warning(self, "Importazione", "I file selezionati non contengono test di questo tipo.")
+
     def on_finish_and_save(self):
         if not self.specimens:
             QMessageBox.information(self, "Info", "Nessun provino da salvare.")
@@ -1917,9 +2133,12 @@ class CyclicTestWidget(QWidget):
         default_filename = f"Batch_Cyclic_{datetime.now().strftime('%Y-%m-%d_%H%M')}.xlsx"
 
         # Apre la finestra di dialogo per il salvataggio
-        filepath, _ = QFileDialog.getSaveFileName(self, "Salva Batch Test Ciclici", default_filename, "Excel Files (*.xlsx)")
+        filepath, selected_filter = QFileDialog.getSaveFileName(self, "Salva Batch Test Ciclici", default_filename,
+                                                              file_dialog_filter())
 
         if filepath:
+            # Formato dall'estensione (xlsx, csv, npz, parquet; vedi export_backends.py)
+            filepath = path_for_filter(filepath, selected_filter)
             # --- PREPARA I DATI PER IL SALVATAGGIO ---
             # Dobbiamo aggiungere la sequenza di test a *ogni* provino
             # perché il DataSaver la leggerà da lì
@@ -1930,14 +2149,27 @@ class CyclicTestWidget(QWidget):
                     "test_sequence_setup": self.test_sequence # Aggiunge la lista dei blocchi
                 }
 
-            saver = DataSaver()
+            # Export in background: l'esito arriva a _on_batch_saved
             # Passiamo None come info calibrazione (o self.active_calibration_info se ce l'hai)
-            success, message = saver.save_batch_to_xlsx(specimens_to_save, filepath, "N/A") 
-
-            if success:
-                QMessageBox.information(self, "Successo", message)
-            else:
-                QMessageBox.critical(self, "Errore", message)
+            export_service = self.main_window.export_service
+            # Il riepilogo per provino è un workbook: solo per l'export xlsx
+            try: # la copia legge i provini di sessione non ancora caricati
+                if (self.main_window.settings.get("batch_export_mode") == "per_specimen"
+                        and filepath.lower().endswith(".xlsx")):
+                    # Un file per provino in parallelo + riepilogo in `filepath`
+                    export_service.export_batch_per_specimen(
+                        specimens_to_save, filepath, "N/A", on_finished=self._on_batch_saved)
+                else:
+                    export_service.export_specimens(
+                        specimens_to_save, filepath, "N/A", on_finished=self._on_batch_saved)
+            except ValueError as e: # file di sessione spostato o sovrascritto (LazyTestRecorder)
+                self._on_batch_saved(False, str(e))
+
+    def _on_batch_saved(self, success, message):
+        if success:
+            QMessageBox.information(self, "Successo", message)
+        else:
+            QMessageBox.critical(self, "Errore", message)
 
     def _on_lcr_checkbox_changed(self, state):
         """ Invia il comando appropriato all'ESP32 quando il checkbox cambia stato. """
@@ -0,0 +1,273 @@
+# data_importer.py
+
+import csv
+import hashlib
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from openpyxl import load_workbook
+
+from recorder import TestRecorder
+from session_file import SESSION_EXTENSION, load_session, save_session
+
+# Colonne dei fogli di DataSaver -> colonne del TestRecorder. Strain e
+# Stress non sono importati: si ricalcolano da gauge/area come per i test
+# registrati in questa sessione.
+HEADER_COLUMNS = {
+    "Time (s)": "time_s",
+    "Relative Displacement (mm)": "rel_disp_mm",
+    "Relative Load (N)": "rel_load_N",
+    "Absolute Displacement (mm)": "abs_disp_mm",
+    "Absolute Load (N)": "abs_load_N",
+    "Resistance (Ohm)": "resistance_ohm",
+    "Encoder Displacement (mm)": "encoder_disp_mm",
+    "Cycle": "cycle",
+    "Block": "block",
+}
+FIRST_HEADER = "Time (s)"
+INDEX_SHEET = "Index"
+
+# Cache dei file importati: una sessione `.utmsession` per file sorgente,
+# valida finché dimensione e data di modifica del sorgente non cambiano
+IMPORT_CACHE_DIR = ".import_cache"
+
+
+def _to_float(value):
+    """ Numero da una cella (numero o testo); None se vuota o non numerica. """
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _split_value_unit(text):
+    """ "1.5 mm/s" -> (1.5, "mm/s"), come scritto da DataSaver per velocità e criterio di stop. """
+    value, _, unit = str(text or "").partition(" ")
+    return _to_float(value), unit or None
+
+
+def _parse_table(rows):
+    """
+    Legge le righe di un foglio (o di un CSV) con il layout di DataSaver:
+    parametri chiave/valore, eventuale "Test Sequence" con le descrizioni
+    dei blocchi in colonna B, riga di intestazione che inizia con
+    "Time (s)", righe dati (le righe vuote sono saltate). Ritorna
+    `(params, sequence, headers, data)`, con `data` array float64
+    righe x colonne (celle vuote -> NaN), oppure `None` se il foglio non
+    contiene una tabella dati.
+    """
+    params, sequence = {}, []
+    rows = iter(rows)
+    headers = None
+    for row in rows:
+        if not row:
+            continue
+        first = row[0]
+        if first == FIRST_HEADER:
+            headers = [h for h in row if h not in (None, "")]
+            break
+        if first in (None, "") and len(row) > 1 and row[1] not in (None, ""):
+            sequence.append(str(row[1]))
+        elif first not in (None, "") and len(row) > 1:
+            params[str(first)] = row[1]
+    if headers is None:
+        return None
+
+    width = len(headers)
+    values = []
+    for row in rows:
+        if not row or all(v in (None, "") for v in row):
+            continue
+        row = tuple(row[:width])
+        if len(row) < width:
+            row += (None,) * (width - len(row))
+        values.append(row)
+    data = np.array(values, dtype=np.float64).reshape(len(values), width) if values else np.empty((0, width))
+    return params, sequence, headers, data
+
+
+def _read_xlsx_sheet(job):
+    """ Job del pool: `(path, titolo foglio)` -> `(titolo, tabella di _parse_table())`. """
+    path, title = job
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return title, _parse_table(workbook[title].iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _read_csv_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        rows = list(csv.reader(file))
+    # Nei CSV le celle sono testo: numeri convertiti, vuote -> None
+    return [[_csv_cell(v) for v in row] for row in rows]
+
+
+def _csv_cell(text):
+    number = _to_float(text)
+    return number if number is not None else (text or None)
+
+
+def _build_specimen(name, params, sequence, headers, data, source):
+    """ Dizionario del provino (come nei widget di test) da una tabella letta. """
+    recorder = TestRecorder(initial_capacity=max(len(data), 16))
+    recorder.extend(**{HEADER_COLUMNS[h]: data[:, i] for i, h in enumerate(headers) if h in HEADER_COLUMNS})
+    specimen = {
+        "name": name,
+        "gauge_length": _to_float(params.get("Gauge Length (mm)")),
+        "area": _to_float(params.get("Area (mm²)")),
+        "test_data": recorder,
+        "visible": True,
+        "imported_from": os.path.abspath(source),
+        "imported_params": {key: value if isinstance(value, (int, float, str)) or value is None else str(value)
+                            for key, value in params.items()},
+    }
+    if "Cycle" in headers:
+        # La sequenza originale non è ricostruibile dal testo dei blocchi:
+        # resta nelle descrizioni, la chiave marca il provino come ciclico
+        specimen["test_sequence_setup"] = []
+        specimen["imported_sequence"] = sequence
+    else:
+        specimen["speed"], specimen["speed_unit"] = _split_value_unit(params.get("Test Speed"))
+        specimen["stop_criterion_value"], specimen["stop_criterion_unit"] = _split_value_unit(params.get("Stop Criterion"))
+        specimen["return_to_start"] = False
+    return specimen
+
+
+def import_csv(path):
+    """ Importa un CSV con il layout di DataSaver (un provino per file). """
+    table = _parse_table(_read_csv_rows(path))
+    if table is None:
+        raise ValueError(f"{os.path.basename(path)}: intestazione '{FIRST_HEADER}' non trovata")
+    params, sequence, headers, data = table
+    name = str(params.get("Specimen Name") or os.path.splitext(os.path.basename(path))[0])
+    return {name: _build_specimen(name, params, sequence, headers, data, path)}
+
+
+def import_xlsx(path, max_workers=None):
+    """
+    Importa un file xlsx scritto da DataSaver (autosave, batch, singolo
+    provino dell'export per provino). I fogli dati sono letti in modalità
+    read-only e, se più di uno, in parallelo da un pool di processi; i
+    fogli di continuazione sono riuniti al provino secondo il foglio
+    "Index", i fogli nascosti (dati dei grafici) ignorati. Ritorna un
+    dizionario nome -> provino, nell'ordine del file.
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        titles = [title for title in workbook.sheetnames
+                  if title != INDEX_SHEET and workbook[title].sheet_state == "visible"]
+        sheet_owner = {}  # foglio -> nome del provino, dal foglio indice
+        if INDEX_SHEET in workbook.sheetnames:
+            in_table = False
+            for row in workbook[INDEX_SHEET].iter_rows(values_only=True):
+                if row and row[0] == "Specimen":
+                    in_table = True
+                elif in_table and row and len(row) > 1 and row[1] is not None:
+                    sheet_owner[str(row[1])] = str(row[0])
+    finally:
+        workbook.close()
+
+    jobs = [(path, title) for title in titles]
+    if len(jobs) > 1 and max_workers != 1:
+        # spawn: un fork del processo Qt con i thread di seriale/parser/export attivi può bloccarsi
+        with ProcessPoolExecutor(max_workers=min(len(jobs), max_workers or os.cpu_count() or 1),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            tables = list(pool.map(_read_xlsx_sheet, jobs))
+    else:
+        tables = [_read_xlsx_sheet(job) for job in jobs]
+
+    # Riunisce i segmenti per provino (il primo foglio porta i parametri)
+    parts = {}
+    for title, table in tables:
+        if table is None:
+            continue
+        params, sequence, headers, data = table
+        name = sheet_owner.get(title) or str(params.get("Specimen Name") or title)
+        if name in parts:
+            if parts[name][2] == headers:
+                parts[name][3].append(data)
+            continue
+        parts[name] = (params, sequence, headers, [data])
+    if not parts:
+        raise ValueError(f"{os.path.basename(path)}: nessun foglio dati di DataSaver trovato")
+    return {name: _build_specimen(name, params, sequence, headers, np.concatenate(blocks), path)
+            for name, (params, sequence, headers, blocks) in parts.items()}
+
+
+# Provini restituiti dalla cache e non ancora caricati: il loro file non va rimosso
+_cache_readers = weakref.WeakSet()
+
+
+def _cache_key(path):
+    return hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+
+
+def _cache_path(path, cache_dir, stat):
+    # Dimensione e mtime nel nome: una sorgente cambiata produce un file nuovo,
+    # quello vecchio resta valido per i provini importati prima
+    return os.path.join(cache_dir, f"{_cache_key(path)}_{stat.st_size}_{stat.st_mtime_ns}{SESSION_EXTENSION}")
+
+
+def _prune_cache(path, cache_dir, keep):
+    """ Rimuove le versioni superate della cache di `path`, tranne quelle ancora in uso. """
+    key = _cache_key(path)
+    in_use = {os.path.abspath(recorder._path) for recorder in list(_cache_readers) if not recorder.is_loaded}
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    for name in names:
+        if name != f"{key}{SESSION_EXTENSION}" and not (name.startswith(f"{key}_") and name.endswith(SESSION_EXTENSION)):
+            continue
+        stale = os.path.join(cache_dir, name)
+        if os.path.abspath(stale) in in_use or os.path.abspath(stale) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+
+def import_file(path, cache_dir=IMPORT_CACHE_DIR, max_workers=None):
+    """
+    Importa un file `.xlsx` o `.csv` di DataSaver, passando per la cache:
+    se il file non è cambiato (stessa dimensione e data di modifica) dalla
+    volta precedente, i provini sono riletti dalla sessione in cache, con i
+    dati caricati solo al primo accesso. Ogni versione della sorgente ha il
+    suo file di cache, mai riscritto: i provini importati prima di una
+    modifica restano leggibili. `cache_dir=None` disattiva la cache.
+    Solleva `ValueError` se il file non contiene dati importabili.
+    """
+    stat = os.stat(path)
+    signature = {"source": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    cache_path = _cache_path(path, cache_dir, stat) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            specimens, state = load_session(cache_path)
+            if state == signature:
+                _cache_readers.update(data["test_data"] for data in specimens.values()
+                                      if data["test_data"] is not None)
+                _prune_cache(path, cache_dir, cache_path)
+                return specimens
+        except Exception as e:
+            print(f"Cache di import non valida ({cache_path}): {e}")
+
+    if os.path.splitext(path)[1].lower() == ".csv":
+        specimens = import_csv(path)
+    else:
+        specimens = import_xlsx(path, max_workers)
+
+    if cache_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            save_session(cache_path, specimens, signature)
+            _prune_cache(path, cache_dir, cache_path)
+        except OSError as e:
+            print(f"Impossibile scrivere la cache di import ({cache_path}): {e}")
+    return specimens
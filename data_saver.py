@@ -1,160 +1,498 @@
 # data_saver.py
 
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.chart import ScatterChart, Reference, Series
 from openpyxl.drawing.line import LineProperties
 from openpyxl.chart.shapes import GraphicalProperties
 from openpyxl.chart.axis import ChartLines
 from openpyxl.chart import Series
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+import hashlib
+import json
+import multiprocessing
+import os
 import numpy as np
+from recorder import TestRecorder
+from export_backends import backend_for_path, get_backend
+
+# Modello colonne comune a tutti i formati di export: chiave (nomi del
+# TestRecorder, usati da NPZ e Parquet) e intestazione (xlsx e CSV). Il
+# canale encoder (incrementale esterno, sola lettura) è affiancato, non
+# sostituisce, lo spostamento stimato a passi. Cycle e Block solo per i
+# test ciclici.
+EXPORT_COLUMNS = [
+    ("time_s", "Time (s)"),
+    ("rel_disp_mm", "Relative Displacement (mm)"),
+    ("rel_load_N", "Relative Load (N)"),
+    ("strain_pct", "Strain (%)"),
+    ("stress_MPa", "Stress (MPa)"),
+    ("abs_disp_mm", "Absolute Displacement (mm)"),
+    ("abs_load_N", "Absolute Load (N)"),
+    ("resistance_ohm", "Resistance (Ohm)"),
+    ("encoder_disp_mm", "Encoder Displacement (mm)"),
+    ("cycle", "Cycle"),
+    ("block", "Block"),
+]
+CYCLIC_COLUMNS = ("cycle", "block")
+
+# Manifest degli export con un file per provino (nella cartella dei file, uno
+# per formato): impronta e file di ogni provino, per riscrivere solo quelli cambiati
+EXPORT_MANIFEST = ".utm_export.{export_format}.json"
+EXPORT_MANIFEST_VERSION = 2
+
+
+def minmax_decimation_indices(y_columns, max_points):
+    """
+    Indici ordinati dei campioni da tenere per disegnare le colonne
+    `y_columns` con circa `max_points` punti: per ogni bucket di campioni
+    consecutivi il minimo e il massimo di ogni colonna, più il primo e
+    l'ultimo campione. Picchi e inversioni restano nel grafico, a
+    differenza di un passo costante. Sotto il budget tiene tutto.
+    """
+    n = len(y_columns[0])
+    if n <= max_points:
+        return np.arange(n)
+    buckets = max(1, (max_points - 2) // (2 * len(y_columns)))
+    size = -(-n // buckets) # campioni per bucket (arrotondato per eccesso)
+    offsets = np.arange(buckets) * size
+    keep = [np.array([0, n - 1])]
+    for y in y_columns:
+        values = np.full(buckets * size, np.nan)
+        values[:n] = y
+        values = values.reshape(buckets, size)
+        nan = np.isnan(values) # NaN e riempimento finale non vincono mai
+        keep.append(offsets + np.where(nan, np.inf, values).argmin(axis=1))
+        keep.append(offsets + np.where(nan, -np.inf, values).argmax(axis=1))
+    indices = np.unique(np.concatenate(keep))
+    return indices[indices < n]
+
+
+def _save_specimen_file(job):
+    """
+    Job del process pool di `save_batch_per_specimen()`: un provino in un
+    file xlsx. Funzione di modulo perché deve essere serializzabile.
+    """
+    specimen_name, specimen_data, filepath, calibration_info, chart_max_points = job
+    success, message = DataSaver(chart_max_points).save_batch_to_xlsx(
+        {specimen_name: specimen_data}, filepath, calibration_info)
+    return specimen_name, success, message
+
+
+class _Progress:
+    """ Righe dati scritte sul totale del batch, notificate a `callback(done, total)`. """
+
+    def __init__(self, total, callback=None):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+
+    def advance(self, rows):
+        self.done += rows
+        if self.callback is not None:
+            self.callback(self.done, self.total)
+
 
 class DataSaver:
     """
     Classe dedicata al salvataggio dei dati dei test in un file Excel (.xlsx).
+    Usa la modalità write-only (streaming) di openpyxl: le righe vengono
+    scritte su disco man mano, quindi la memoria non cresce con il numero
+    di campioni.
     """
 
-    def save_batch_to_xlsx(self, specimens_dict, filepath, calibration_info="N/A"):
+    # Righe convertite in oggetti Python per volta durante la scrittura dati
+    ROW_BLOCK_SIZE = 10000
+    # Limite di righe di un foglio Excel: oltre, i dati proseguono in fogli
+    # di continuazione "<provino> (2)", "<provino> (3)", ...
+    MAX_SHEET_ROWS = 1048576
+    # Budget di punti per serie dei grafici incorporati (foglio "<provino> Chart")
+    CHART_MAX_POINTS = 4000
+
+    def __init__(self, chart_max_points=None):
+        self.chart_max_points = int(chart_max_points or self.CHART_MAX_POINTS)
+
+    def save_batch(self, specimens_dict, filepath, calibration_info="N/A", progress_callback=None,
+                   export_format=None):
         """
-        Salva un batch di provini in un singolo file Excel, un provino per foglio.
+        Salva un batch di provini nel formato `export_format` (nome di un
+        backend di `export_backends.py`: "xlsx", "csv", "npz", "parquet"),
+        o in quello dedotto dall'estensione di `filepath`. I formati con un
+        provino per file, se i provini sono più di uno, scrivono un file per
+        provino nella cartella `<filepath senza estensione>/`.
+        `progress_callback(righe_scritte, righe_totali)`, se passato, viene
+        chiamato dopo ogni blocco di righe dati (dal thread chiamante).
         """
         try:
-            workbook = openpyxl.Workbook()
-            # Rimuovi il foglio di default creato automaticamente
-            workbook.remove(workbook.active) 
-
-            for specimen_name, specimen_data in specimens_dict.items():
-                if specimen_data.get("test_data"): # Salva solo se ci sono dati di test
-                    self._create_sheet_for_specimen(workbook, specimen_name, specimen_data, calibration_info)
-            
-            workbook.save(filepath)
+            backend = get_backend(export_format) if export_format else backend_for_path(filepath)
+            to_save = {name: data for name, data in specimens_dict.items()
+                       if data.get("test_data")} # Salva solo se ci sono dati di test
+            if not to_save:
+                return False, "Nessun provino con dati di test da salvare."
+            progress = _Progress(sum(len(data["test_data"]) for data in to_save.values()), progress_callback)
+
+            if backend.one_specimen_per_file and len(to_save) > 1:
+                directory = os.path.splitext(filepath)[0]
+                os.makedirs(directory, exist_ok=True)
+                files = self._specimen_filenames(to_save, backend.extension)
+                # Export incrementale: i file dei provini non cambiati restano quelli del salvataggio precedente
+                fingerprints, reused = self._plan_incremental_export(directory, to_save, files, calibration_info,
+                                                                     backend.name)
+                for specimen_name, specimen_data in to_save.items():
+                    if specimen_name in reused:
+                        progress.advance(len(specimen_data["test_data"]))
+                        continue
+                    backend.write(self, {specimen_name: specimen_data}, os.path.join(directory, files[specimen_name]),
+                                  calibration_info, progress)
+                self._write_export_manifest(directory, files, fingerprints, backend.name)
+                return True, (f"{len(to_save)} provini salvati in {directory}"
+                              f"{f' ({len(reused)} invariati)' if reused else ''}")
+
+            backend.write(self, to_save, filepath, calibration_info, progress)
             return True, f"Dati salvati con successo in {filepath}"
         except Exception as e:
             return False, f"Errore durante il salvataggio del file: {e}"
 
+    def save_batch_to_xlsx(self, specimens_dict, filepath, calibration_info="N/A", progress_callback=None):
+        """ Salva un batch di provini in un singolo file Excel, un provino per foglio. """
+        return self.save_batch(specimens_dict, filepath, calibration_info, progress_callback, export_format="xlsx")
+
+    def _write_xlsx(self, specimens_dict, filepath, calibration_info, progress):
+        """ Workbook di `save_batch_to_xlsx()` (backend "xlsx"). """
+        # Write-only: nessun foglio di default, ogni foglio si scrive una riga alla volta
+        workbook = openpyxl.Workbook(write_only=True)
+        index_rows = []
+        spilled = False
+        for specimen_name, specimen_data in specimens_dict.items():
+            segments = self._create_sheet_for_specimen(workbook, specimen_name, specimen_data,
+                                                       calibration_info, progress)
+            index_rows.extend([specimen_name, *segment] for segment in segments)
+            spilled = spilled or len(segments) > 1
+
+        # Foglio indice (primo del file) solo se qualche provino è diviso su più fogli
+        if spilled:
+            self._write_index_sheet(workbook, index_rows)
+
+        workbook.save(filepath)
+
+    def save_batch_per_specimen(self, specimens_dict, summary_path, calibration_info="N/A",
+                                progress_callback=None, max_workers=None):
+        """
+        Export batch parallelo: un file xlsx per provino, scritti
+        contemporaneamente da un pool di processi (`max_workers`, default un
+        processo per core), nella cartella `<summary_path senza estensione>/`,
+        più il riepilogo `summary_path` con un provino per riga.
+        `progress_callback(righe_scritte, righe_totali)` avanza a ogni
+        provino completato. Incrementale: un provino invariato dal
+        salvataggio precedente nella stessa cartella (stessa impronta, file
+        intatto) non viene riscritto.
+        """
+        try:
+            to_save = {name: data for name, data in specimens_dict.items()
+                       if data.get("test_data")} # Salva solo se ci sono dati di test
+            if not to_save:
+                return False, "Nessun provino con dati di test da salvare."
+            directory = os.path.splitext(summary_path)[0]
+            os.makedirs(directory, exist_ok=True)
+            files = self._specimen_filenames(to_save, ".xlsx")
+
+            progress = _Progress(sum(len(data["test_data"]) for data in to_save.values()), progress_callback)
+            fingerprints, reused = self._plan_incremental_export(directory, to_save, files, calibration_info, "xlsx")
+            results = {}
+            for name in reused:
+                results[name] = (True, "invariato")
+                progress.advance(len(to_save[name]["test_data"]))
+            to_write = {name: data for name, data in to_save.items() if name not in reused}
+            if to_write: # nessun pool da avviare se nessun provino è cambiato
+                # spawn: un fork del processo Qt con i thread di GUI, seriale e parser attivi può bloccarsi
+                with ProcessPoolExecutor(max_workers=max_workers,
+                                         mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = {
+                        pool.submit(_save_specimen_file, (name, data, os.path.join(directory, files[name]),
+                                                          calibration_info, self.chart_max_points)): name
+                        for name, data in to_write.items()
+                    }
+                    for future in as_completed(futures):
+                        name = futures[future]
+                        try:
+                            _, success, message = future.result()
+                        except Exception as e: # processo terminato, dati non serializzabili, ...
+                            success, message = False, str(e)
+                        results[name] = (success, message)
+                        progress.advance(len(to_save[name]["test_data"]))
+
+            # Nel manifest solo i provini scritti correttamente: gli altri si riscrivono al prossimo salvataggio
+            self._write_export_manifest(directory, files,
+                                        {name: fingerprint for name, fingerprint in fingerprints.items()
+                                         if results[name][0]}, "xlsx")
+            self._write_batch_summary(summary_path, to_save, files, results, calibration_info)
+            failed = [name for name, (success, _) in results.items() if not success]
+            if failed:
+                return False, (f"Errore durante il salvataggio di {len(failed)} provini su {len(to_save)} "
+                               f"({', '.join(failed)}): vedi {summary_path}")
+            return True, (f"{len(to_save)} provini salvati in {directory}"
+                          f"{f' ({len(reused)} invariati)' if reused else ''}, riepilogo in {summary_path}")
+        except Exception as e:
+            return False, f"Errore durante il salvataggio del file: {e}"
+
+    def specimen_fingerprint(self, specimen_name, specimen_data, calibration_info="N/A", export_format="xlsx"):
+        """
+        Impronta del contenuto esportato di un provino: campioni del
+        `TestRecorder`, setup (tranne la sola visibilità nel grafico),
+        calibrazione, formato e budget dei grafici. Se non cambia, il file
+        già scritto per il provino è ancora valido.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        setup = {key: value for key, value in specimen_data.items() if key not in ("test_data", "visible")}
+        digest.update(json.dumps([specimen_name, setup, calibration_info, export_format, self.chart_max_points],
+                                 sort_keys=True, default=str).encode("utf-8"))
+        digest.update(self._specimen_recorder(specimen_data).chunk(0).tobytes())
+        return digest.hexdigest()
+
+    def _plan_incremental_export(self, directory, specimens_dict, files, calibration_info, export_format):
+        """
+        Impronte dei provini e insieme dei provini il cui file in `directory`
+        è ancora quello del salvataggio precedente (stessa impronta e stesso
+        nome nel manifest, file non modificato da allora). Legge solo il
+        manifest di `export_format`: i file di altri export nella stessa
+        cartella, e quelli di provini usciti dal batch, non vengono toccati.
+        """
+        previous = self._read_export_manifest(directory, export_format)
+        fingerprints = {name: self.specimen_fingerprint(name, data, calibration_info, export_format)
+                        for name, data in specimens_dict.items()}
+        reused = set()
+        for name, fingerprint in fingerprints.items():
+            entry = previous.get(name)
+            if entry is None or entry.get("fingerprint") != fingerprint or entry.get("file") != files[name]:
+                continue
+            path = os.path.join(directory, files[name])
+            if os.path.exists(path) and [os.path.getsize(path), os.stat(path).st_mtime_ns] == entry.get("stat"):
+                reused.add(name)
+        return fingerprints, reused
+
+    def _read_export_manifest(self, directory, export_format):
+        """ Provini del manifest `export_format` di `directory` (nome -> file, impronta, stat del file); vuoto se assente o illeggibile. """
+        try:
+            with open(os.path.join(directory, EXPORT_MANIFEST.format(export_format=export_format)),
+                      encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != EXPORT_MANIFEST_VERSION or manifest.get("export_format") != export_format:
+            return {}
+        return manifest.get("specimens", {})
+
+    def _write_export_manifest(self, directory, files, fingerprints, export_format):
+        """ Manifest `export_format` di `directory` con i provini di `fingerprints`, dopo la scrittura dei loro file. """
+        specimens = {}
+        for name, fingerprint in fingerprints.items():
+            path = os.path.join(directory, files[name])
+            specimens[name] = {"file": files[name], "fingerprint": fingerprint,
+                               "stat": [os.path.getsize(path), os.stat(path).st_mtime_ns]}
+        with open(os.path.join(directory, EXPORT_MANIFEST.format(export_format=export_format)), "w",
+                  encoding="utf-8") as file:
+            json.dump({"version": EXPORT_MANIFEST_VERSION, "export_format": export_format,
+                       "specimens": specimens}, file, indent=1)
+
+    def _specimen_filenames(self, specimens_dict, extension):
+        """ Nome file (senza cartella) per ogni provino, da `_safe_name()`, con " (2)", ... per i doppioni. """
+        files = {}
+        for specimen_name in specimens_dict:
+            base = self._safe_name(specimen_name) or "Specimen"
+            filename, copy_index = f"{base}{extension}", 2
+            while filename in files.values(): # nomi diversi possono ridursi allo stesso nome file
+                filename, copy_index = f"{base} ({copy_index}){extension}", copy_index + 1
+            files[specimen_name] = filename
+        return files
+
+    def _write_batch_summary(self, summary_path, specimens_dict, files, results, calibration_info):
+        """ Workbook di riepilogo di `save_batch_per_specimen()`: un provino per riga, con file ed esito. """
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet(title="Summary")
+        sheet.append([self._bold_cell(sheet, "Batch Summary")])
+        sheet.append(["Export Date", datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+        sheet.append(["Calibration Info", calibration_info])
+        sheet.append([])
+        sheet.append([
+            "Specimen", "File", "Samples", "Duration (s)", "Max Relative Load (N)",
+            "Max Relative Displacement (mm)", "Cycles", "Gauge Length (mm)", "Area (mm²)", "Status",
+        ])
+        for specimen_name, specimen_data in specimens_dict.items():
+            test_data = specimen_data["test_data"]
+            is_cyclic = "test_sequence_setup" in specimen_data
+            if not isinstance(test_data, TestRecorder):
+                test_data = TestRecorder.from_rows(test_data, cyclic=is_cyclic)
+            success, message = results.get(specimen_name, (False, "non eseguito"))
+            sheet.append([
+                specimen_name, files[specimen_name], len(test_data),
+                float(test_data.time_s[-1] - test_data.time_s[0]),
+                float(np.nanmax(test_data.rel_load_N)), float(np.nanmax(test_data.rel_disp_mm)),
+                int(test_data.cycle.max()) if is_cyclic else None,
+                specimen_data.get("gauge_length"), specimen_data.get("area"),
+                "OK" if success else message,
+            ])
+        workbook.save(summary_path)
+
+    def specimen_metadata(self, specimen_name, specimen_data, calibration_info="N/A"):
+        """
+        Blocco metadati di un provino, uguale per tutti i formati di export:
+        `(parametri, sequenza)`. `parametri` è un dizionario ordinato
+        etichetta -> valore (le righe "Test Parameters" dell'xlsx), `sequenza`
+        la lista delle descrizioni dei blocchi (`_format_block_description()`)
+        per i test ciclici, `None` per i monotonici.
+        """
+        params = {
+            "Specimen Name": specimen_name,
+            "Test Date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "Calibration Info": calibration_info, 
+            "Gauge Length (mm)": specimen_data.get("gauge_length"),
+            "Area (mm²)": specimen_data.get("area"),
+        }
+
+        # Integrità dello stream D: durante il test (vedi IngestStats), se registrata
+        ingest_stats = specimen_data.get("ingest_stats")
+        if ingest_stats:
+            params.update({
+                "Samples Received": ingest_stats.get("received"),
+                "Lost Samples (sequence gaps)": ingest_stats.get("lost"),
+                "Duplicate/Out-of-order Samples": ingest_stats.get("duplicates"),
+                "Parse Errors": ingest_stats.get("parse_errors"),
+                "Unsequenced Samples": ingest_stats.get("unsequenced"),
+                "Lossless (verified)": "Yes" if ingest_stats.get("lossless") else "No",
+            })
+
+        if "test_sequence_setup" in specimen_data:
+            test_sequence = specimen_data.get("test_sequence_setup", [])
+            return params, [self._format_block_description(block, i) for i, block in enumerate(test_sequence)]
+
+        params.update({
+            "Test Speed": f"{specimen_data.get('speed')} {specimen_data.get('speed_unit')}",
+            "Stop Criterion": f"{specimen_data.get('stop_criterion_value')} {specimen_data.get('stop_criterion_unit')}"
+        })
+        return params, None
+
+    def specimen_columns(self, specimen_data, test_data=None):
+        """
+        Colonne dati di un provino secondo `EXPORT_COLUMNS`, uguali per tutti
+        i formati di export: lista di `(chiave, intestazione, array)`, con
+        strain e stress calcolati da gauge e area (NaN se non validi) e
+        Cycle/Block solo per i test ciclici.
+        """
+        is_cyclic = "test_sequence_setup" in specimen_data
+        if test_data is None:
+            test_data = self._specimen_recorder(specimen_data)
+        area = specimen_data.get("area")
+        gauge = specimen_data.get("gauge_length")
+
+        # Validità di gauge/area e strain/stress calcolati una volta sola per
+        # provino, in forma vettoriale sulle colonne del registratore
+        is_gauge_valid = isinstance(gauge, (int, float)) and not np.isnan(gauge) and gauge > 0
+        is_area_valid = isinstance(area, (int, float)) and not np.isnan(area) and area > 0
+        n = len(test_data)
+        derived = {
+            "strain_pct": (test_data.rel_disp_mm / gauge) * 100 if is_gauge_valid else np.full(n, np.nan),
+            "stress_MPa": test_data.rel_load_N / area if is_area_valid else np.full(n, np.nan),
+        }
+        return [(key, header, derived[key] if key in derived else getattr(test_data, key))
+                for key, header in EXPORT_COLUMNS
+                if is_cyclic or key not in CYCLIC_COLUMNS]
+
+    def _specimen_recorder(self, specimen_data):
+        test_data = specimen_data.get("test_data")
+        if not isinstance(test_data, TestRecorder):
+            # Compatibilità con le vecchie liste di tuple (7 o 9 elementi)
+            test_data = TestRecorder.from_rows(test_data or [], cyclic="test_sequence_setup" in specimen_data)
+        return test_data
+
         # In data_saver.py, sostituisci il vecchio _create_sheet_for_specimen con questo:
 
-    def _create_sheet_for_specimen(self, workbook, specimen_name, specimen_data, calibration_info):
+    def _create_sheet_for_specimen(self, workbook, specimen_name, specimen_data, calibration_info, progress=None):
         """
         Metodo privato per creare e popolare un singolo foglio di lavoro.
         Ora gestisce sia test Monotonici che Ciclici CON STILE CORRETTO.
+        I campioni oltre il limite di righe di Excel proseguono in fogli di
+        continuazione. Ritorna i segmenti scritti, uno per foglio:
+        `[foglio, prima riga, ultima riga, primo campione, ultimo campione,
+        tempo iniziale, tempo finale, ciclo iniziale, ciclo finale]`
+        (cicli `None` per i test monotonici), per il foglio indice.
         """
         # Controlla se è un test ciclico cercando la chiave speciale che abbiamo aggiunto
         is_cyclic = "test_sequence_setup" in specimen_data
 
         # --- Creazione Foglio (invariata) ---
-        safe_sheet_name = "".join(c for c in specimen_name if c.isalnum() or c in " _-").strip()[:31]
+        safe_sheet_name = self._safe_name(specimen_name)[:31]
         sheet = workbook.create_sheet(title=safe_sheet_name)
 
-        # --- Scrittura Parametri di Setup (invariata) ---
-        sheet["A1"] = "Test Parameters"
-        sheet["A1"].font = openpyxl.styles.Font(bold=True)
-
-        params = {
-            "Specimen Name": specimen_name,
-            "Test Date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "Calibration Info": calibration_info, 
-            "Gauge Length (mm)": specimen_data.get("gauge_length"),
-            "Area (mm²)": specimen_data.get("area"),
-        }
+        # --- Scrittura Parametri di Setup ---
+        # In write-only le righe si aggiungono solo in sequenza: `row` tiene il
+        # numero della prossima riga, per i riferimenti dei grafici
+        sheet.append([self._bold_cell(sheet, "Test Parameters")])
 
+        # Blocco metadati comune a tutti i formati di export
+        params, test_sequence = self.specimen_metadata(specimen_name, specimen_data, calibration_info)
         row = 2
         for key, value in params.items():
-            sheet[f"A{row}"] = key
-            sheet[f"B{row}"] = value
+            sheet.append([key, value])
             row += 1
 
         if is_cyclic:
-            sheet[f"A{row}"] = "Test Sequence"
-            sheet[f"A{row}"].font = openpyxl.styles.Font(bold=True)
+            sheet.append([self._bold_cell(sheet, "Test Sequence")])
             row += 1
-            test_sequence = specimen_data.get("test_sequence_setup", [])
-            for i, block in enumerate(test_sequence):
-                description = self._format_block_description(block, i)
-                sheet[f"B{row}"] = description
+            for description in test_sequence:
+                sheet.append([None, description])
                 row += 1
-        else:
-            params_monotonic = {
-                "Test Speed": f"{specimen_data.get('speed')} {specimen_data.get('speed_unit')}",
-                "Stop Criterion": f"{specimen_data.get('stop_criterion_value')} {specimen_data.get('stop_criterion_unit')}"
-            }
-            for key, value in params_monotonic.items():
-                sheet[f"A{row}"] = key
-                sheet[f"B{row}"] = value
-                row += 1
-
-        # --- Preparazione e Scrittura Colonne Dati (invariata) ---
-        header_row = row + 1
-        data_start_row = header_row + 1
 
-        headers = [
-            "Time (s)", "Relative Displacement (mm)", "Relative Load (N)",
-            "Strain (%)", "Stress (MPa)",
-            "Absolute Displacement (mm)", "Absolute Load (N)"
-        ]
+        # --- Preparazione e Scrittura Colonne Dati ---
+        # Layout invariato: intestazioni alla riga `row`, una riga vuota, poi i dati
+        data_start_row = row + 2
 
-        headers.append("Resistance (Ohm)")
-        # Canale di misura aggiuntivo (encoder incrementale esterno, sola
-        # lettura): affiancato, non sostituisce, lo spostamento stimato a
-        # passi nelle colonne precedenti.
-        headers.append("Encoder Displacement (mm)")
-
-        if is_cyclic:
-            headers.extend(["Cycle", "Block"])
+        test_data = self._specimen_recorder(specimen_data)
+        export_columns = self.specimen_columns(specimen_data, test_data)
+        headers = [header for _, header, _ in export_columns]
+        columns = [values for _, _, values in export_columns]
         sheet.append(headers)
-
-        test_data = specimen_data.get("test_data", [])
-        area = specimen_data.get("area")
-        gauge = specimen_data.get("gauge_length")
-
-        for i, data_row in enumerate(test_data):
-            resistance = np.nan
-            cycle = np.nan
-            block = np.nan
-            encoder_disp = np.nan
-            time_s, rel_disp, rel_load, abs_disp, abs_load = data_row[:5]
-
-            if is_cyclic:
-                # Tupla ciclica: (... cycle, block, resistance, encoder_disp) - 9 elementi
-                if len(data_row) == 9: # <-- CONTROLLA LUNGHEZZA
-                    cycle = data_row[5]
-                    block = data_row[6]
-                    resistance = data_row[7] # <-- ESTRAE RESISTENZA DALL'INDICE 7
-                    if data_row[8] is not None:
-                        encoder_disp = data_row[8] # <-- ESTRAE ENCODER DALL'INDICE 8
-            else: # Monotonico / registrazione manuale
-                # Tupla monotonica: (... resistance, encoder_disp) - 7 elementi
-                if len(data_row) == 7: # <-- CONTROLLA LUNGHEZZA
-                    resistance = data_row[5] # <-- ESTRAE RESISTENZA DALL'INDICE 5
-                    if data_row[6] is not None:
-                        encoder_disp = data_row[6] # <-- ESTRAE ENCODER DALL'INDICE 6
-
-            is_gauge_valid = isinstance(gauge, (int, float)) and not np.isnan(gauge) and gauge > 0
-            is_area_valid = isinstance(area, (int, float)) and not np.isnan(area) and area > 0
-
-            strain = (rel_disp / gauge) * 100 if is_gauge_valid else np.nan
-            stress = rel_load / area if is_area_valid else np.nan
-
-            current_excel_row = data_start_row + i
-            sheet.cell(row=current_excel_row, column=1, value=time_s)
-            sheet.cell(row=current_excel_row, column=2, value=rel_disp)
-            sheet.cell(row=current_excel_row, column=3, value=rel_load)
-            sheet.cell(row=current_excel_row, column=4, value=strain)
-            sheet.cell(row=current_excel_row, column=5, value=stress)
-            sheet.cell(row=current_excel_row, column=6, value=abs_disp)
-            sheet.cell(row=current_excel_row, column=7, value=abs_load)
-            sheet.cell(row=current_excel_row, column=8, value=resistance)
-            sheet.cell(row=current_excel_row, column=9, value=encoder_disp)
-            if is_cyclic:
-                sheet.cell(row=current_excel_row, column=10, value=cycle)
-                sheet.cell(row=current_excel_row, column=11, value=block)
+        sheet.append([])
+        n = len(test_data)
+
+        # Primo foglio fino al limite di righe, poi fogli di continuazione
+        # (intestazioni in riga 1, dati dalla riga 2)
+        stop = min(n, self.MAX_SHEET_ROWS - data_start_row + 1)
+        self._append_rows(sheet, columns, 0, stop, progress)
+        placements = [(sheet, data_start_row, 0, stop)]
+        while stop < n:
+            start, stop = stop, min(n, stop + self.MAX_SHEET_ROWS - 1)
+            suffix = f" ({len(placements) + 1})"
+            continuation = workbook.create_sheet(title=safe_sheet_name[:31 - len(suffix)] + suffix)
+            continuation.append(headers)
+            self._append_rows(continuation, columns, start, stop, progress)
+            placements.append((continuation, 2, start, stop))
+
+        segments = []
+        for part, first_row, start, stop in placements:
+            if stop == start:
+                continue
+            cycle_range = ([int(test_data.cycle[start]), int(test_data.cycle[stop - 1])]
+                           if is_cyclic else [None, None])
+            segments.append([part.title, first_row, first_row + stop - start - 1, start + 1, stop,
+                             float(test_data.time_s[start]), float(test_data.time_s[stop - 1]), *cycle_range])
 
         num_data_points = len(test_data)
         if num_data_points == 0:
-            return 
+            return segments
 
         # --- Creazione Grafici (CON STILE CORRETTO) ---
 
+        # Oltre il budget di punti (o con i dati divisi su più fogli) i grafici
+        # puntano a un foglio nascosto decimato, con le stesse prime 5 colonne
+        # dei dati: Excel resta reattivo e i dati completi non cambiano
+        if len(placements) > 1 or num_data_points > self.chart_max_points:
+            chart_sheet, num_data_points = self._write_chart_data(workbook, safe_sheet_name,
+                                                                  headers[:5], columns[:5])
+            data_start_row = 2
+        else:
+            chart_sheet = sheet
+
         data_end_row = data_start_row + num_data_points - 1 # Riga dati finale
 
         if is_cyclic:
@@ -165,8 +503,8 @@ class DataSaver:
             chart1.title = "Time vs. Displacement"
             self._style_excel_chart(chart1, "Time (s)", "Relative Displacement (mm)", legend=None) # APPLICA STILE
 
-            x_data_ref1 = Reference(sheet, min_col=1, min_row=data_start_row, max_row=data_end_row)
-            y_data_ref1 = Reference(sheet, min_col=2, min_row=data_start_row, max_row=data_end_row)
+            x_data_ref1 = Reference(chart_sheet, min_col=1, min_row=data_start_row, max_row=data_end_row)
+            y_data_ref1 = Reference(chart_sheet, min_col=2, min_row=data_start_row, max_row=data_end_row)
             series1 = Series(y_data_ref1, xvalues=x_data_ref1, title="Disp")
             line_props_data = LineProperties(solidFill="4F81BD", w=38100) # Blu
             series1.graphicalProperties = GraphicalProperties(ln=line_props_data)
@@ -178,8 +516,8 @@ class DataSaver:
             chart2.title = "Time vs. Load"
             self._style_excel_chart(chart2, "Time (s)", "Relative Load (N)", legend=None) # APPLICA STILE
 
-            x_data_ref2 = Reference(sheet, min_col=1, min_row=data_start_row, max_row=data_end_row)
-            y_data_ref2 = Reference(sheet, min_col=3, min_row=data_start_row, max_row=data_end_row)
+            x_data_ref2 = Reference(chart_sheet, min_col=1, min_row=data_start_row, max_row=data_end_row)
+            y_data_ref2 = Reference(chart_sheet, min_col=3, min_row=data_start_row, max_row=data_end_row)
             series2 = Series(y_data_ref2, xvalues=x_data_ref2, title="Load")
             line_props_data2 = LineProperties(solidFill="C0504D", w=38100) # Rosso
             series2.graphicalProperties = GraphicalProperties(ln=line_props_data2)
@@ -194,8 +532,8 @@ class DataSaver:
             chart1.title = "Load vs. Displacement"
             self._style_excel_chart(chart1, "Relative Displacement (mm)", "Relative Load (N)", legend=None) # APPLICA STILE
 
-            x_data_ref = Reference(sheet, min_col=2, min_row=data_start_row, max_row=data_end_row)
-            y_data_ref = Reference(sheet, min_col=3, min_row=data_start_row, max_row=data_end_row)
+            x_data_ref = Reference(chart_sheet, min_col=2, min_row=data_start_row, max_row=data_end_row)
+            y_data_ref = Reference(chart_sheet, min_col=3, min_row=data_start_row, max_row=data_end_row)
             series1 = Series(y_data_ref, xvalues=x_data_ref, title="Test Data")
             line_props1 = LineProperties(solidFill="4F81BD", w=38100) # Blu
             series1.graphicalProperties = GraphicalProperties(ln=line_props1)
@@ -207,13 +545,64 @@ class DataSaver:
             chart2.title = "Stress vs. Strain"
             self._style_excel_chart(chart2, "Strain (%)", "Stress (MPa)", legend=None) # APPLICA STILE
 
-            x_data_ref2 = Reference(sheet, min_col=4, min_row=data_start_row, max_row=data_end_row)
-            y_data_ref2 = Reference(sheet, min_col=5, min_row=data_start_row, max_row=data_end_row)
+            x_data_ref2 = Reference(chart_sheet, min_col=4, min_row=data_start_row, max_row=data_end_row)
+            y_data_ref2 = Reference(chart_sheet, min_col=5, min_row=data_start_row, max_row=data_end_row)
             series2 = Series(y_data_ref2, xvalues=x_data_ref2, title="Test Data")
             series2.graphicalProperties = GraphicalProperties(ln=line_props1) # Stesso colore blu
             chart2.series.append(series2)
             sheet.add_chart(chart2, "H18")
 
+        return segments
+
+    def _append_rows(self, sheet, columns, start, stop, progress=None):
+        """
+        Righe intere con append(), a blocchi di ROW_BLOCK_SIZE: tolist()
+        converte un blocco di ogni colonna in float Python in un solo
+        passaggio, e solo un blocco alla volta vive in memoria.
+        """
+        for block_start in range(start, stop, self.ROW_BLOCK_SIZE):
+            block_stop = min(block_start + self.ROW_BLOCK_SIZE, stop)
+            for values in zip(*(c[block_start:block_stop].tolist() for c in columns)):
+                sheet.append(values)
+            if progress is not None:
+                progress.advance(block_stop - block_start)
+
+    def _write_chart_data(self, workbook, safe_sheet_name, headers, columns):
+        """
+        Foglio nascosto `"<provino> Chart"` con i campioni scelti da
+        `minmax_decimation_indices()` su spostamento e carico (colonne 2 e 3,
+        le uniche grandezze dei grafici oltre al tempo: strain e stress ne
+        sono multipli). Stesse colonne di `columns`, dati dalla riga 2.
+        Ritorna `(foglio, righe dati)`.
+        """
+        indices = minmax_decimation_indices([columns[1], columns[2]], self.chart_max_points)
+        chart_data = workbook.create_sheet(title=safe_sheet_name[:31 - len(" Chart")] + " Chart")
+        chart_data.sheet_state = "hidden"
+        chart_data.append(headers)
+        self._append_rows(chart_data, [c[indices] for c in columns], 0, len(indices))
+        return chart_data, len(indices)
+
+    def _write_index_sheet(self, workbook, index_rows):
+        """ Foglio "Index" (primo del file): per ogni foglio dati, righe, campioni, tempi e cicli contenuti. """
+        index_sheet = workbook.create_sheet(title="Index", index=0)
+        index_sheet.append([self._bold_cell(index_sheet, "Data Sheets Index")])
+        index_sheet.append([
+            "Specimen", "Sheet", "First Row", "Last Row", "First Sample", "Last Sample",
+            "Time Start (s)", "Time End (s)", "Cycle Start", "Cycle End",
+        ])
+        for values in index_rows:
+            index_sheet.append(values)
+
+    def _safe_name(self, name):
+        """ Nome del provino ridotto a caratteri validi per fogli e file (alfanumerici, spazio, `_`, `-`). """
+        return "".join(c for c in name if c.isalnum() or c in " _-").strip()
+
+    def _bold_cell(self, sheet, value):
+        """ Cella in grassetto per un foglio write-only (niente accesso diretto alle celle). """
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.font = openpyxl.styles.Font(bold=True)
+        return cell
+
     # Inserisci questo metodo dentro la classe DataSaver
     def _format_block_description(self, block, index):
 
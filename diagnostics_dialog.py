@@ -0,0 +1,183 @@
+# diagnostics_dialog.py
+
+import time
+
+import pyqtgraph as pg
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import (QAbstractItemView, QCheckBox, QDialog, QFileDialog, QHBoxLayout, QHeaderView,
+                             QLabel, QMessageBox, QPushButton, QTableWidget, QTableWidgetItem, QVBoxLayout)
+
+from latency_tracer import STAGES
+
+STAGE_LABELS = {
+    "framing": "Framing righe",
+    "parser_queue": "Coda verso il parser",
+    "parse": "Parsing",
+    "batching": "Attesa flush parser",
+    "gui_queue": "Coda verso la GUI",
+    "widget": "Aggiornamento widget",
+    "frame_wait": "Attesa frame + setData",
+    "paint_queue": "Attesa ridisegno",
+    "paint": "Ridisegno grafico",
+    "total": "Totale (lettura → pixel)",
+}
+
+# (contatore, etichetta) mostrati con totale e frequenza
+COUNTER_LABELS = (("reads", "Letture"), ("bytes", "Byte"), ("samples", "Campioni"), ("batches", "Lotti"),
+                  ("frames", "Frame"), ("paints", "Ridisegni"))
+
+
+class LatencyDiagnosticsDialog(QDialog):
+    """
+    Pannello di diagnostica delle latenze (`latency_tracer.LatencyTracer`):
+    attivazione del tracciamento, tabella dei tratti della pipeline
+    (campioni, media, percentili e massimo in ms), istogramma del tratto
+    selezionato, contatori di throughput con frequenza corrente, azzeramento
+    e salvataggio in JSON. Con `clock_sync` (`clock_sync.ClockSync`) mostra
+    anche il modello dell'orologio dell'ESP32: offset, deriva, latenza di
+    sola andata e jitter di arrivo. Non modale: si aggiorna ogni
+    `REFRESH_MS` mentre è visibile.
+    """
+
+    REFRESH_MS = 500
+    COLUMNS = ("Tratto", "N", "Media", "p50", "p90", "p99", "Max")
+
+    def __init__(self, tracer, clock_sync=None, parent=None):
+        super().__init__(parent)
+        self.tracer = tracer
+        self.clock_sync = clock_sync
+        self.setWindowTitle("Diagnostica Latenze")
+        self.resize(760, 640)
+        self._previous = None # (istante, contatori) dell'aggiornamento precedente, per le frequenze
+
+        layout = QVBoxLayout(self)
+        controls = QHBoxLayout()
+        self.enabled_checkbox = QCheckBox("Tracciamento attivo")
+        self.enabled_checkbox.setChecked(tracer.enabled)
+        self.reset_button = QPushButton("Azzera")
+        self.save_button = QPushButton("Salva su file...")
+        controls.addWidget(self.enabled_checkbox); controls.addStretch(1)
+        controls.addWidget(self.reset_button); controls.addWidget(self.save_button)
+        layout.addLayout(controls)
+
+        self.counters_label = QLabel()
+        layout.addWidget(self.counters_label)
+        self.clock_label = QLabel()
+        self.clock_label.setWordWrap(True)
+        self.clock_label.setVisible(clock_sync is not None)
+        layout.addWidget(self.clock_label)
+
+        self.table = QTableWidget(len(STAGES), len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels([self.COLUMNS[0], self.COLUMNS[1]] + [f"{c} (ms)" for c in self.COLUMNS[2:]])
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        for row, name in enumerate(STAGES):
+            self.table.setItem(row, 0, QTableWidgetItem(STAGE_LABELS.get(name, name)))
+            for column in range(1, len(self.COLUMNS)):
+                self.table.setItem(row, column, QTableWidgetItem("-"))
+        layout.addWidget(self.table, 3)
+
+        self.histogram_plot = pg.PlotWidget(); self.histogram_plot.setBackground('w')
+        self.histogram_plot.setLogMode(x=True, y=False)
+        self.histogram_plot.setLabel('bottom', "Latenza", units="s")
+        self.histogram_plot.setLabel('left', "Letture")
+        self.histogram_curve = self.histogram_plot.plot(stepMode="center", fillLevel=0, brush=(60, 120, 200, 120),
+                                                        pen=pg.mkPen(color=(30, 80, 160)))
+        layout.addWidget(self.histogram_plot, 2)
+
+        self.enabled_checkbox.toggled.connect(self.tracer.set_enabled)
+        self.reset_button.clicked.connect(self.reset_statistics)
+        self.save_button.clicked.connect(self.save_to_file)
+        self.table.itemSelectionChanged.connect(self.refresh)
+        self.table.selectRow(len(STAGES) - 1) # totale
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(self.REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.enabled_checkbox.setChecked(self.tracer.enabled)
+        self.refresh()
+        self.refresh_timer.start()
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def reset_statistics(self):
+        self.tracer.reset()
+        self._previous = None
+        self.refresh()
+
+    def save_to_file(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Salva latenze", f"LATENZE_{time.strftime('%Y%m%d_%H%M%S')}.json",
+                                              "JSON (*.json)")
+        if not path:
+            return
+        try:
+            extra = {"clock_sync": self.clock_sync.state} if self.clock_sync is not None else {}
+            self.tracer.dump(path, **extra)
+        except OSError as e:
+            QMessageBox.critical(self, "Errore", f"Impossibile salvare il file:\n{e}")
+
+    def refresh(self):
+        snapshot = self.tracer.snapshot()
+        counters = snapshot["counters"]
+        now = time.perf_counter()
+        rates = {}
+        if self._previous is not None and now > self._previous[0]:
+            before_time, before = self._previous
+            rates = {key: (counters[key] - before[key]) / (now - before_time) for key in counters}
+        self._previous = (now, counters)
+        parts = [f"{label}: {counters[key]}" + (f" ({rates[key]:.0f}/s)" if key in rates else "")
+                 for key, label in COUNTER_LABELS]
+        if counters["unpainted"]:
+            parts.append(f"Senza ridisegno: {counters['unpainted']}")
+        state = "" if snapshot["enabled"] else "  [tracciamento spento]"
+        self.counters_label.setText("   ".join(parts) + f"   in {snapshot['elapsed_s']:.0f} s" + state)
+        if self.clock_sync is not None:
+            self.clock_label.setText(self.format_clock_state(self.clock_sync.state))
+
+        for row, name in enumerate(STAGES):
+            stats = snapshot["stages"][name]
+            values = [stats["count"]] + [stats[key] for key in ("mean_us", "p50_us", "p90_us", "p99_us", "max_us")]
+            for column, value in enumerate(values, start=1):
+                if column == 1:
+                    text = str(value)
+                else:
+                    text = "-" if value is None else f"{value / 1000.0:.3f}"
+                self.table.item(row, column).setText(text)
+
+        rows = self.table.selectionModel().selectedRows()
+        name = list(STAGES)[rows[0].row() if rows else len(STAGES) - 1]
+        histogram = self.tracer.histograms[name]
+        # classi sotto/sopra scala accorpate a quelle estreme (l'asse è logaritmico)
+        counts = list(histogram.counts[1:-1])
+        counts[0] += histogram.counts[0]
+        counts[-1] += histogram.counts[-1]
+        edges_s = [edge / 1e6 for edge in histogram.edges()[1:-1]]
+        used = [i for i, count in enumerate(counts) if count]
+        if used: # solo l'intervallo con dati, più una classe per lato
+            first, last = max(used[0] - 1, 0), min(used[-1] + 1, len(counts) - 1)
+            edges_s, counts = edges_s[first:last + 2], counts[first:last + 1]
+        self.histogram_curve.setData(edges_s, counts)
+        self.histogram_plot.setTitle(STAGE_LABELS.get(name, name))
+
+    @staticmethod
+    def format_clock_state(state):
+        """ Riga di testo con lo stato di `ClockSync.state`. """
+        if not state.get("synced"):
+            return "Orologio ESP32: nessun campione ricevuto"
+
+        def ms(key):
+            value = state.get(key)
+            return "-" if value is None else f"{value * 1000.0:.2f} ms"
+
+        return (f"Orologio ESP32: offset {state['offset_s']:.4f} s   deriva {state['drift_ppm']:+.1f} ppm   "
+                f"latenza andata {ms('one_way_latency_s')} (RTT min {ms('min_rtt_s')}, {state['round_trips']} misure)   "
+                f"jitter arrivo medio {ms('jitter_mean_s')} / max {ms('jitter_max_s')}   "
+                f"wrap {state['wraps']}   epoche {state['epochs']}   risincronizzazioni {state['resyncs']}")
@@ -0,0 +1,12 @@
+# esp32_simulator/__init__.py
+"""
+ESP32 della macchina simulato su uno pseudo-terminale, per provare la GUI
+(e misurarne le prestazioni) senza hardware: vedi docs/esp32_simulator.md.
+Avvio da terminale: `python -m esp32_simulator --rate 320`.
+"""
+
+from .firmware import STREAM_RATE_HZ, VirtualFirmware
+from .model import SpecimenModel
+from .pty_device import VirtualESP32
+
+__all__ = ["STREAM_RATE_HZ", "SpecimenModel", "VirtualESP32", "VirtualFirmware"]
@@ -0,0 +1,48 @@
+# esp32_simulator/__main__.py
+
+import argparse
+import time
+
+from .firmware import STREAM_RATE_HZ, VirtualFirmware
+from .model import SpecimenModel
+from .pty_device import SERIAL_BAUD, VirtualESP32
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m esp32_simulator",
+        description="ESP32 della macchina di trazione simulato su uno pseudo-terminale.")
+    parser.add_argument("--rate", type=float, default=STREAM_RATE_HZ,
+                        help=f"frequenza dei pacchetti D: in streaming, Hz (default {STREAM_RATE_HZ:g})")
+    parser.add_argument("--baud", type=int, default=SERIAL_BAUD,
+                        help="banda della seriale simulata; 0 = illimitata (default %(default)s)")
+    parser.add_argument("--link", help="collegamento simbolico stabile alla porta (es. /tmp/ttyUTM0)")
+    parser.add_argument("--no-seq", action="store_true", help="pacchetti D: a 6 campi, senza numero di sequenza")
+    parser.add_argument("--no-encoder", action="store_true", help="pacchetti D: storici a 5 campi, senza encoder")
+    parser.add_argument("--uncalibrated", action="store_true",
+                        help="cella non tarata né calibrata, come dopo il boot del firmware reale")
+    parser.add_argument("--stiffness", type=float, default=20.0, help="rigidezza del provino, N/mm")
+    parser.add_argument("--yield-force", type=float, default=6.0, help="forza di snervamento, N")
+    parser.add_argument("--break-elongation", type=float, default=40.0, help="allungamento a rottura, mm")
+    parser.add_argument("--noise", type=float, default=0.002, help="rumore della cella, N (deviazione standard)")
+    parser.add_argument("--seed", type=int, help="seme del rumore (esecuzioni ripetibili)")
+    args = parser.parse_args(argv)
+
+    model = SpecimenModel(stiffness_n_per_mm=args.stiffness, yield_force_n=args.yield_force,
+                          break_elongation_mm=args.break_elongation, noise_n=args.noise, seed=args.seed)
+    firmware = VirtualFirmware(model, stream_rate_hz=args.rate, send_seq=not args.no_seq,
+                               encoder_present=not args.no_encoder, calibrated=not args.uncalibrated)
+    with VirtualESP32(firmware, baudrate=args.baud or None, link=args.link) as device:
+        print(f"ESP32 simulato su {device.port}" + (f" ({args.link})" if args.link else ""))
+        print(f"Streaming a {args.rate:g} Hz. Ctrl+C per terminare.")
+        try:
+            while True:
+                time.sleep(5.0)
+                print(f"stato={firmware.state} modo={firmware.comms_mode} pacchetti={firmware.packets_sent} "
+                      f"saltati={firmware.packets_skipped} byte={device.bytes_sent}")
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
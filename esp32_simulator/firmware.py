@@ -0,0 +1,571 @@
+# esp32_simulator/firmware.py
+
+import time
+
+from binary_protocol import encode_record
+
+from .model import (BOTTOM_ENDSTOP_MM, ENCODER_COUNTS_PER_REV, PULSES_TO_MM, SCREW_PITCH_MM,
+                    TOP_ENDSTOP_MM, SpecimenModel)
+
+STREAM_RATE_HZ = 50.0          # STREAM_INTERVAL_MS = 20 del firmware reale
+LCR_INTERVAL_S = 0.1           # periodo di aggiornamento della resistenza (LCR polling)
+AVERAGING_WINDOW_S = 1.0       # TARE/CALIBRATE mediano su una finestra di 1000 ms
+HOMING_SPEED_MMS = 20.0
+ADC_COUNTS_PER_GRAM = 420.0    # conteggi NAU7802 per grammo a gain 128 (valore simulato)
+ADC_ZERO_COUNTS = 15000.0      # conteggi della cella scarica (da tarare con TARE)
+VALID_RATES_SPS = (10, 20, 40, 80, 320)
+VALID_GAINS = (1, 2, 4, 8, 16, 32, 64, 128)
+LCR_NOT_AVAILABLE = -999.0
+LCR_TIMEOUT = -1.0
+
+# Stato del motore / della macchina a stati del firmware
+IDLE = "IDLE"
+JOG = "JOG"
+GOTO = "GOTO"
+RETURN = "RETURN_TO_START"
+HOMING = "HOMING"
+MONOTONIC = "MONOTONIC_TEST"
+CYCLIC = "CYCLIC_TEST"
+RAMP = "RAMP"
+PAUSE = "PAUSE"
+
+# Fasi del blocco ciclico e della rampa (come `cyclic_phase` del firmware)
+PREPOSITION = "CYCLIC_PREPOSITION"
+MOVING_UP = "CYCLIC_MOVING_UP"
+HOLDING_UPPER = "CYCLIC_HOLDING_UPPER"
+MOVING_DOWN = "CYCLIC_MOVING_DOWN"
+HOLDING_LOWER = "CYCLIC_HOLDING_LOWER"
+RAMPING = "RAMPING"
+RAMP_HOLDING = "RAMP_HOLDING"
+
+
+def _fields(arguments):
+    """ `"A=1;B=2"` -> `{"A": "1", "B": "2"}` (parametri dei comandi). """
+    return dict(part.split("=", 1) for part in arguments.split(";") if "=" in part)
+
+
+class VirtualFirmware:
+    """
+    Firmware dell'ESP32 simulato, senza trasporto: `receive()` riceve i
+    byte dal PC, `update(now)` fa avanzare macchina e provino fino
+    all'istante `now` (integrazione a eventi: campioni della cella a
+    `filter_rate_sps`, pacchetti di streaming, LCR, fine delle attese) e
+    `take_output()` restituisce i byte da inviare al PC: righe `STATUS:`,
+    `D:` e, in `SET_MODE:STREAMING_BIN`, record di `binary_protocol.py`.
+
+    Comandi e messaggi seguono `docs/firmware_main.md` e quanto la GUI
+    invia/interpreta (`main.py`, widget di test). Semplificazioni: l'homing
+    è un'unica discesa fino all'endstop inferiore (niente backoff e
+    risalita lenta), `TARE`/`CALIBRATE` rispondono dopo la finestra di
+    1000 ms senza bloccare lo streaming, e a ogni `START_TEST`/`RESET_TIMER`
+    viene montato un provino nuovo, scarico, nella posizione corrente.
+    """
+
+    def __init__(self, model=None, stream_rate_hz=STREAM_RATE_HZ, send_seq=True, encoder_present=True,
+                 calibrated=True, start_position_mm=50.0, clock=time.monotonic):
+        self.model = model or SpecimenModel()
+        self.stream_interval_s = 1.0 / stream_rate_hz
+        self.send_seq = send_seq
+        self.encoder_present = encoder_present
+        self._clock = clock
+        now = clock()
+        self._now = now                # istante fino a cui è integrata la simulazione
+        self._timer_origin = now       # zero del campo tempo dei pacchetti D:
+        self._rx = bytearray()
+        self._output = bytearray()
+
+        self.comms_mode = "POLLING"
+        self.seq = 0
+        self._next_stream = None
+        self.packets_sent = 0
+        # Impostato dal trasporto quando il buffer di uscita è pieno: come un
+        # Serial.write() bloccante, i pacchetti di quegli intervalli non partono
+        self.tx_blocked = False
+        self.packets_skipped = 0
+
+        # Motore: impulsi (frazionari durante l'integrazione) e offset
+        # dall'endstop inferiore, ignoto al firmware finché non fa homing
+        self._pulses = 0.0
+        self._home_offset_mm = start_position_mm - BOTTOM_ENDSTOP_MM
+        self._velocity = 0.0           # impulsi/s con segno
+        self._target = None            # impulsi di arrivo dei movimenti a conteggio
+        self.jog_speed_mms = 1.0       # SET_SPEED (jog, GOTO, RETURN_TO_START)
+        self._test_start_pulses = 0
+
+        self.state = IDLE
+        self._phase = None
+        self._phase_deadline = None
+        self._block = {}
+        self.cycle = 0
+
+        # Cella di carico (NAU7802 + filtro EMA)
+        self.filter_alpha = 0.5
+        self.filter_rate_sps = 320
+        self.filter_gain = 128
+        self._zero_offset_counts = ADC_ZERO_COUNTS if calibrated else 0.0
+        self._calibration_factor = ADC_COUNTS_PER_GRAM if calibrated else 1.0
+        self._filtered_g = None
+        self._next_sample = now
+        self._force_n = 0.0
+
+        # Limiti di sicurezza assoluti: "disabilitati" finché non arriva SET_LIMITS
+        self.max_force_g = 1e12
+        self.max_pulses = 2**31 - 1
+        self._limit_notified = False
+
+        self.lcr_enabled = False
+        self.resistance_ohm = LCR_NOT_AVAILABLE
+        self._next_lcr = now
+        self._deferred = []            # (istante, funzione): risposte ritardate (TARE, CALIBRATE)
+
+    # --- I/O ---
+    def receive(self, data):
+        """ Byte dal PC: `!` è eseguito subito (come nel firmware), il resto a righe. """
+        for byte in bytes(data):
+            if byte == ord("!"):
+                self.emergency_stop()
+            elif byte == ord("\n"):
+                line = self._rx.decode("utf-8", "ignore").strip()
+                self._rx.clear()
+                if line:
+                    self.process_command(line)
+            elif len(self._rx) < 128: # serial_buffer del firmware
+                self._rx.append(byte)
+
+    def take_output(self):
+        """ Byte in attesa di essere inviati al PC (svuota il buffer). """
+        data = bytes(self._output)
+        self._output.clear()
+        return data
+
+    def _send(self, line):
+        self._output += line.encode("utf-8") + b"\n"
+
+    def _status(self, message):
+        self._send(f"STATUS:{message}")
+
+    # --- POSIZIONE E CARICO ---
+    @property
+    def pulse_count(self):
+        return int(round(self._pulses))
+
+    @property
+    def position_mm(self):
+        """ Posizione nota al firmware (impulsi dall'ultimo homing). """
+        return self.pulse_count * PULSES_TO_MM
+
+    @property
+    def true_position_mm(self):
+        """ Posizione dall'endstop inferiore (usata da provino ed endstop). """
+        return self._pulses * PULSES_TO_MM + self._home_offset_mm
+
+    @property
+    def encoder_count(self):
+        return int(round(self._pulses * PULSES_TO_MM / SCREW_PITCH_MM * ENCODER_COUNTS_PER_REV))
+
+    @property
+    def load_g(self):
+        """ Carico filtrato in grammi, come nei pacchetti D: e nei controlli di sicurezza. """
+        return self._filtered_g if self._filtered_g is not None else self._read_grams()
+
+    def _counts(self, noise=True):
+        force_n = self._force_n + (self.model.noise() if noise else 0.0)
+        grams = force_n / 9.81 * 1000.0
+        return ADC_ZERO_COUNTS + grams * ADC_COUNTS_PER_GRAM * self.filter_gain / 128.0
+
+    def _read_grams(self, noise=True):
+        return (self._counts(noise) - self._zero_offset_counts) / self._calibration_factor
+
+    def _sample_load(self):
+        raw = self._read_grams()
+        if self._filtered_g is None:
+            self._filtered_g = raw # filtro ri-seminato
+        else:
+            self._filtered_g = self.filter_alpha * raw + (1.0 - self.filter_alpha) * self._filtered_g
+
+    # --- SIMULAZIONE ---
+    def update(self, now=None):
+        """ Fa avanzare la simulazione fino a `now` (default: orologio del costruttore). """
+        now = self._clock() if now is None else now
+        while True:
+            events = [self._next_sample, self._next_lcr]
+            if self._next_stream is not None:
+                events.append(self._next_stream)
+            if self._phase_deadline is not None:
+                events.append(self._phase_deadline)
+            events.extend(deadline for deadline, _ in self._deferred)
+            t = min(events)
+            if t > now:
+                self._advance(now - self._now)
+                self._now = now
+                self._check()
+                return
+            self._advance(t - self._now)
+            self._now = t
+            if t >= self._next_sample:
+                self._sample_load()
+                self._next_sample += 1.0 / self.filter_rate_sps
+            if t >= self._next_lcr:
+                self._update_lcr()
+                self._next_lcr += LCR_INTERVAL_S
+            self._check()
+            for item in [item for item in self._deferred if item[0] <= t]:
+                self._deferred.remove(item)
+                item[1]()
+            if self._next_stream is not None and t >= self._next_stream:
+                self._stream_packet()
+                self._next_stream += self.stream_interval_s
+
+    def next_event_time(self):
+        """ Prossimo istante in cui la simulazione ha qualcosa da fare (per il trasporto). """
+        events = [self._next_sample, self._next_lcr]
+        if self._next_stream is not None:
+            events.append(self._next_stream)
+        return min(events)
+
+    def _advance(self, dt):
+        if dt > 0 and self._velocity:
+            position = self._pulses + self._velocity * dt
+            if self._target is not None and (position - self._target) * self._velocity >= 0:
+                position = float(self._target)
+                self._velocity = 0.0
+            self._pulses = position
+        self._force_n = self.model.force(self.true_position_mm)
+
+    def _move(self, speed_mms, direction, target_pulses=None):
+        self._velocity = direction * abs(speed_mms) / PULSES_TO_MM
+        self._target = target_pulses
+        self._limit_notified = False
+
+    def _move_to(self, pulses, speed_mms):
+        if pulses == self.pulse_count:
+            self._velocity, self._target = 0.0, pulses
+        else:
+            self._move(speed_mms, 1 if pulses > self._pulses else -1, pulses)
+
+    def _halt(self):
+        self._velocity = 0.0
+        self._target = None
+        self.state = IDLE
+        self._phase = None
+        self._phase_deadline = None
+
+    @property
+    def _moving(self):
+        return self._velocity != 0.0
+
+    def _check(self):
+        """ Un giro di `updateMotorState()`: limiti, endstop, poi lo stato corrente. """
+        if self._moving and not self._limit_notified:
+            if self.pulse_count > self.max_pulses:
+                self._halt()
+                self._limit_notified = True
+                self._status("LIMIT_HIT_DISPLACEMENT")
+                return
+            if abs(self.load_g) > self.max_force_g:
+                self._halt()
+                self._limit_notified = True
+                self._status("LIMIT_HIT_FORCE")
+                return
+        position = self.true_position_mm
+        if self._velocity > 0 and position >= TOP_ENDSTOP_MM:
+            self._halt()
+            self._status("TOP_HIT")
+            return
+        if self._velocity < 0 and position <= BOTTOM_ENDSTOP_MM:
+            if self.state == HOMING:
+                # Fine homing: zero comune di impulsi ed encoder
+                self._halt()
+                self._home_offset_mm = position
+                self._pulses = 0.0
+                self._status("HOMING_COMPLETED")
+            else:
+                self._halt()
+                self._status("BOTTOM_HIT")
+            return
+
+        state = self.state
+        if state in (GOTO, RETURN) and not self._moving:
+            self._halt()
+            self._status("MOVE_COMPLETED")
+        elif state == MONOTONIC:
+            criterion, stop_value = self._block["criterion"], self._block["stop_value"]
+            reached = (self.position_mm >= stop_value if criterion == "DISP" else self.load_g >= stop_value)
+            if reached:
+                self._halt()
+                self._status("TEST_COMPLETED")
+        elif state == CYCLIC:
+            self._check_cyclic()
+        elif state == RAMP:
+            self._check_ramp()
+        elif state == PAUSE and self._now >= self._phase_deadline:
+            self._block_completed()
+
+    def _value(self):
+        """ Grandezza controllata dal blocco corrente: mm o grammi assoluti. """
+        return self.position_mm if self._block["mode"] == "DISP" else self.load_g
+
+    def _go_towards(self, target, speed_mms):
+        """ Avvia il movimento verso `target` (mm o g); `True` se è già raggiunto. """
+        if self._block["mode"] == "DISP":
+            pulses = int(round(target / PULSES_TO_MM))
+            if self.pulse_count == pulses:
+                self._velocity = 0.0
+                return True
+            if not self._moving:
+                self._move_to(pulses, speed_mms)
+            return False
+        # FORCE: si muove finché il carico non attraversa il target
+        direction = 1 if self.load_g < target else -1
+        if self._moving and (direction > 0) != (self._velocity > 0):
+            self._velocity = 0.0
+            return True
+        if not self._moving:
+            self._move(speed_mms, direction)
+        return False
+
+    def _check_cyclic(self):
+        block, phase = self._block, self._phase
+        if phase == PREPOSITION:
+            if self._go_towards(block["lower"], block["speed"]):
+                self._phase = MOVING_UP
+                self.cycle = max(self.cycle, 1)
+        elif phase == MOVING_UP:
+            if self._go_towards(block["upper"], block["speed"]):
+                self._phase, self._phase_deadline = HOLDING_UPPER, self._now + block["hold_upper_s"]
+        elif phase == HOLDING_UPPER and self._now >= self._phase_deadline:
+            self._phase, self._phase_deadline = MOVING_DOWN, None
+        elif phase == MOVING_DOWN:
+            if self._go_towards(block["lower"], block["speed"]):
+                self._phase, self._phase_deadline = HOLDING_LOWER, self._now + block["hold_lower_s"]
+        elif phase == HOLDING_LOWER and self._now >= self._phase_deadline:
+            self._phase_deadline = None
+            block["done"] += 1
+            if block["done"] >= block["cycles"]:
+                self._block_completed()
+            else:
+                self.cycle += 1
+                self._phase = MOVING_UP
+
+    def _check_ramp(self):
+        block = self._block
+        if self._phase == RAMPING:
+            if self._go_towards(block["target"], block["speed"]):
+                self._phase, self._phase_deadline = RAMP_HOLDING, self._now + block["hold_s"]
+        elif self._phase == RAMP_HOLDING and self._now >= self._phase_deadline:
+            self._block_completed()
+
+    def _block_completed(self):
+        self._halt()
+        self._status("BLOCK_COMPLETED")
+
+    def _update_lcr(self):
+        if not self.lcr_enabled:
+            self.resistance_ohm = LCR_NOT_AVAILABLE
+            return
+        resistance = self.model.resistance(self.true_position_mm)
+        self.resistance_ohm = LCR_TIMEOUT if resistance is None else resistance
+
+    # --- PACCHETTI DATI ---
+    def _time_ms(self):
+        return int((self._now - self._timer_origin) * 1000.0)
+
+    def _data_line(self, seq=None):
+        fields = [f"{self.load_g:.2f}", str(self.pulse_count), str(self._time_ms()), str(self.cycle),
+                  f"{self.resistance_ohm:.2f}"]
+        if self.encoder_present:
+            fields.append(str(self.encoder_count))
+        if seq is not None:
+            fields.append(str(seq))
+        return "D:" + ";".join(fields)
+
+    def _stream_packet(self):
+        if self.tx_blocked:
+            self.packets_skipped += 1
+            return
+        if self.comms_mode == "STREAMING_BIN":
+            self._output += encode_record(self.seq, self._time_ms(), self.load_g, self.pulse_count, self.cycle,
+                                          self.resistance_ohm, self.encoder_count if self.encoder_present else None)
+        else:
+            self._send(self._data_line(self.seq if self.send_seq and self.encoder_present else None))
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.packets_sent += 1
+
+    # --- COMANDI ---
+    def emergency_stop(self):
+        """ `!`: ferma subito il motore e annulla i movimenti a conteggio. """
+        state = self.state
+        self._halt()
+        if state == MONOTONIC:
+            self._status("TEST_STOPPED_BY_USER")
+        elif state in (CYCLIC, RAMP, PAUSE):
+            self._status("CYCLIC_TEST_STOPPED_BY_USER")
+        elif state in (HOMING, GOTO, RETURN):
+            self._status("STOPPED_BY_USER")
+
+    def process_command(self, command):
+        """ Un comando testuale completo (senza `\\n`), come `processCommand()` del firmware. """
+        self.update()
+        name, _, arguments = command.partition(":")
+        handler = getattr(self, f"_cmd_{name.lower()}", None)
+        if handler is None:
+            self._status(f"UNKNOWN_COMMAND;CMD={name}")
+            return
+        try:
+            handler(arguments)
+        except (KeyError, ValueError):
+            self._status(f"COMMAND_REJECTED;CMD={name}")
+
+    def _cmd_get_data(self, _):
+        if self.comms_mode == "POLLING": # in streaming i dati arrivano già dai pacchetti D:
+            self._send(self._data_line())
+
+    def _cmd_set_mode(self, mode):
+        if mode not in ("POLLING", "STREAMING", "STREAMING_BIN"):
+            raise ValueError(mode)
+        if mode != "POLLING" and self.comms_mode == "POLLING":
+            self._next_stream = self._now
+        elif mode == "POLLING":
+            self._next_stream = None
+        self.comms_mode = mode
+
+    def _cmd_stop(self, _):
+        self.emergency_stop()
+
+    def _cmd_reset_timer(self, _):
+        self._timer_origin = self._now
+        self.cycle = 0
+        self.model.mount(self.true_position_mm)
+
+    def _cmd_start_test(self, arguments):
+        fields = _fields(arguments)
+        criterion = fields["CRITERION"]
+        if criterion not in ("DISP", "FORCE"):
+            raise ValueError(criterion)
+        self._halt()
+        self._block = {"criterion": criterion, "stop_value": float(fields["STOP_VAL"])}
+        self._test_start_pulses = self.pulse_count
+        self._timer_origin = self._now
+        self.cycle = 0
+        self.model.mount(self.true_position_mm)
+        self.state = MONOTONIC
+        self._move(float(fields["SPEED_MMS"]), 1)
+        self._status("TEST_STARTED")
+
+    def _cmd_start_cyclic_test(self, arguments):
+        fields = _fields(arguments)
+        self._halt()
+        self._block = {
+            "mode": fields["MODE"], "upper": float(fields["UPPER"]), "lower": float(fields["LOWER"]),
+            "speed": float(fields["SPEED"]), "hold_upper_s": int(fields["HOLD_U"]) / 1000.0,
+            "hold_lower_s": int(fields["HOLD_L"]) / 1000.0, "cycles": int(fields["CYCLES"]), "done": 0,
+        }
+        if self._block["mode"] not in ("DISP", "FORCE"):
+            raise ValueError(self._block["mode"])
+        self.state, self._phase = CYCLIC, PREPOSITION
+        self._status("CYCLIC_TEST_STARTED")
+
+    def _cmd_execute_ramp(self, arguments):
+        fields = _fields(arguments)
+        self._halt()
+        self._block = {"mode": fields["MODE"], "target": float(fields["TARGET"]),
+                       "speed": float(fields["SPEED"]), "hold_s": int(fields["HOLD"]) / 1000.0}
+        if self._block["mode"] not in ("DISP", "FORCE"):
+            raise ValueError(self._block["mode"])
+        self.state, self._phase = RAMP, RAMPING
+
+    def _cmd_execute_pause(self, arguments):
+        duration_s = int(arguments) / 1000.0
+        self._halt()
+        self.state, self._phase_deadline = PAUSE, self._now + duration_s
+
+    def _cmd_return_to_start(self, _):
+        if self.state == IDLE:
+            self.state = RETURN
+            self._move_to(self._test_start_pulses, self.jog_speed_mms)
+
+    def _cmd_goto(self, arguments):
+        target_mm = float(arguments)
+        if target_mm < 0:
+            raise ValueError(arguments)
+        if self.state == IDLE:
+            self.state = GOTO
+            self._move_to(int(round(target_mm / PULSES_TO_MM)), self.jog_speed_mms)
+
+    def _cmd_jog_up(self, _):
+        if self.state == IDLE:
+            self.state = JOG
+            self._move(self.jog_speed_mms, 1)
+
+    def _cmd_jog_down(self, _):
+        if self.state == IDLE:
+            self.state = JOG
+            self._move(self.jog_speed_mms, -1)
+
+    def _cmd_set_speed(self, arguments):
+        speed = float(arguments)
+        if self.state == IDLE:
+            self.jog_speed_mms = speed
+
+    def _cmd_home(self, _):
+        if self.state == IDLE:
+            self.state = HOMING
+            self._move(HOMING_SPEED_MMS, -1)
+
+    def _cmd_set_limits(self, arguments):
+        fields = _fields(arguments)
+        self.max_force_g = float(fields["FORCE_G"])
+        self.max_pulses = int(float(fields["DISP_MM"]) / PULSES_TO_MM)
+        self._status(f"LIMITS_SET;FORCE_G={self.max_force_g:.2f};PULSES={self.max_pulses}")
+
+    def _cmd_tare(self, _):
+        def done():
+            self._zero_offset_counts = self._counts(noise=False)
+            self._filtered_g = None
+            self._status("TARE_DONE")
+        self._deferred.append((self._now + AVERAGING_WINDOW_S, done))
+
+    def _cmd_calibrate(self, arguments):
+        known_grams = float(arguments)
+        if known_grams <= 0:
+            raise ValueError(arguments)
+        def done():
+            # Il peso campione si considera appeso alla cella durante la finestra di misura
+            weight_counts = known_grams * ADC_COUNTS_PER_GRAM * self.filter_gain / 128.0
+            self._calibration_factor = (self._counts(noise=False) + weight_counts - self._zero_offset_counts) / known_grams
+            self._filtered_g = None
+            self._status(f"CALIBRATION_DONE;SCALE={self._calibration_factor:.4f}")
+        self._deferred.append((self._now + AVERAGING_WINDOW_S, done))
+
+    def _cmd_set_scale(self, arguments):
+        self._calibration_factor = float(arguments)
+        self._filtered_g = None
+        self._status(f"SCALE_SET;SCALE={self._calibration_factor:.4f}")
+
+    def _cmd_get_scale(self, _):
+        self._send(f"SCALE:{self._calibration_factor:.4f}")
+
+    def _cmd_set_filter_config(self, arguments):
+        fields = _fields(arguments)
+        alpha, rate = float(fields["ALPHA"]), int(fields["RATE"])
+        gain = int(fields.get("GAIN", self.filter_gain))
+        if not 0.01 <= alpha <= 1.0 or rate not in VALID_RATES_SPS or gain not in VALID_GAINS:
+            self._status("FILTER_CONFIG_REJECTED;REASON=OUT_OF_RANGE")
+            return
+        gain_changed = gain != self.filter_gain
+        self.filter_alpha, self.filter_rate_sps, self.filter_gain = alpha, rate, gain
+        self._filtered_g = None
+        self._status(f"FILTER_CONFIG_SET;ALPHA={alpha:.3f};RATE={rate};GAIN={gain}")
+        if gain_changed:
+            self._zero_offset_counts, self._calibration_factor = 0.0, 1.0
+            self._status("CALIBRATION_INVALIDATED;REASON=GAIN_CHANGED")
+
+    def _cmd_get_filter_config(self, _):
+        self._send(f"FILTER_CONFIG:ALPHA={self.filter_alpha:.3f};RATE={self.filter_rate_sps};GAIN={self.filter_gain}")
+
+    def _cmd_enable_lcr_polling(self, _):
+        self.lcr_enabled = True
+
+    def _cmd_disable_lcr_polling(self, _):
+        self.lcr_enabled = False
+        self.resistance_ohm = LCR_NOT_AVAILABLE
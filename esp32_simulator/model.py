@@ -0,0 +1,83 @@
+# esp32_simulator/model.py
+
+import random
+
+# Costanti meccaniche della macchina: duplicate identiche da firmware e
+# main.py (MainWindow.__init__), come già avviene tra quei due
+PULSES_PER_REV = 2000.0
+GEAR_RATIO = 10.0
+SCREW_PITCH_MM = 5.0873
+PULSES_TO_MM = SCREW_PITCH_MM / (PULSES_PER_REV * GEAR_RATIO)
+ENCODER_COUNTS_PER_REV = 4800
+
+# Corsa della traversa in coordinate "vere" (mm dall'endstop inferiore)
+BOTTOM_ENDSTOP_MM = 0.0
+TOP_ENDSTOP_MM = 200.0
+
+
+class SpecimenModel:
+    """
+    Provino elasto-plastico a sola trazione, con incrudimento lineare e
+    rottura: forza (N) in funzione dell'allungamento (mm) dal punto di
+    montaggio. Sotto l'allungamento permanente il provino è lasco (forza
+    nulla), oltre `break_elongation_mm` è rotto.
+
+    La storia plastica rende la forza dipendente dal percorso: `force()` va
+    chiamata con allungamenti successivi (lo fa il firmware simulato a ogni
+    passo di integrazione), così scarichi e ricarichi dei test ciclici
+    seguono la retta elastica.
+    """
+
+    def __init__(self, stiffness_n_per_mm=20.0, yield_force_n=6.0, hardening_n_per_mm=0.4,
+                 break_elongation_mm=40.0, noise_n=0.002, gauge_length_mm=50.0,
+                 base_resistance_ohm=120.0, gauge_factor=2.0, seed=None):
+        self.stiffness_n_per_mm = stiffness_n_per_mm
+        self.yield_force_n = yield_force_n
+        self.hardening_n_per_mm = hardening_n_per_mm
+        self.break_elongation_mm = break_elongation_mm
+        self.noise_n = noise_n
+        self.gauge_length_mm = gauge_length_mm
+        self.base_resistance_ohm = base_resistance_ohm
+        self.gauge_factor = gauge_factor
+        self._random = random.Random(seed)
+        self.mount_position_mm = None
+        self.plastic_mm = 0.0
+        self.broken = False
+
+    def mount(self, position_mm):
+        """ Monta un provino nuovo con la traversa in `position_mm` (scarico). """
+        self.mount_position_mm = position_mm
+        self.plastic_mm = 0.0
+        self.broken = False
+
+    def elongation(self, position_mm):
+        if self.mount_position_mm is None:
+            return 0.0
+        return position_mm - self.mount_position_mm
+
+    def force(self, position_mm):
+        """ Forza vera (N, senza rumore) con la traversa in `position_mm`; aggiorna la storia plastica. """
+        elongation = self.elongation(position_mm)
+        if self.mount_position_mm is None or self.broken:
+            return 0.0
+        if elongation > self.break_elongation_mm:
+            self.broken = True
+            return 0.0
+        k = self.stiffness_n_per_mm
+        trial = k * (elongation - self.plastic_mm)
+        yield_now = self.yield_force_n + self.hardening_n_per_mm * self.plastic_mm
+        if trial > yield_now: # snervamento: cresce l'allungamento permanente
+            self.plastic_mm = (k * elongation - self.yield_force_n) / (k + self.hardening_n_per_mm)
+            trial = k * (elongation - self.plastic_mm)
+        return max(trial, 0.0)
+
+    def noise(self):
+        """ Rumore gaussiano della cella di carico (N). """
+        return self._random.gauss(0.0, self.noise_n) if self.noise_n else 0.0
+
+    def resistance(self, position_mm):
+        """ Resistenza (ohm) di un estensimetro sul tratto utile, per l'LCR simulato; `None` se rotto. """
+        if self.broken:
+            return None
+        strain = self.elongation(position_mm) / self.gauge_length_mm if self.gauge_length_mm else 0.0
+        return self.base_resistance_ohm * (1.0 + self.gauge_factor * max(strain, 0.0))
@@ -0,0 +1,114 @@
+# esp32_simulator/pty_device.py
+
+import os
+import select
+import threading
+import time
+import tty
+
+from .firmware import VirtualFirmware
+
+SERIAL_BAUD = 460800          # Serial.begin(460800) del firmware, come communication.py
+MAX_WAIT_S = 0.005            # attesa massima del loop tra due aggiornamenti
+TX_BUFFER_BYTES = 64 * 1024   # oltre questo arretrato il firmware "si blocca" sulla scrittura
+
+
+class VirtualESP32:
+    """
+    ESP32 simulato su uno pseudo-terminale (solo POSIX): `port` è il
+    percorso del lato slave (es. `/dev/pts/5`), da aprire con
+    `SerialCommunicator.connect_to_port()` come una porta reale. Un thread
+    legge i comandi dal lato master, fa avanzare `firmware`
+    (`VirtualFirmware`) e scrive le risposte, limitate alla banda della
+    seriale a `baudrate` (10 bit per byte; `None` = nessun limite).
+
+    Con `link` crea anche un collegamento simbolico stabile alla porta
+    (da aggiungere a `"extra_serial_ports"` in settings.json per vederla
+    nella GUI).
+    """
+
+    def __init__(self, firmware=None, baudrate=SERIAL_BAUD, link=None, **firmware_options):
+        self.firmware = firmware or VirtualFirmware(**firmware_options)
+        self.baudrate = baudrate
+        self.link = link
+        self.port = None
+        self.bytes_sent = 0
+        self._master = self._slave = None
+        self._pending = bytearray()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        # Lato slave raw e senza eco finché non lo apre il client (pyserial lo riconfigura comunque);
+        # il descrittore resta aperto qui, così la chiusura del client non manda in errore il master
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        if self.link:
+            if os.path.islink(self.link):
+                os.remove(self.link)
+            os.symlink(self.port, self.link)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="VirtualESP32", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        firmware = self.firmware
+        bytes_per_s = self.baudrate / 10.0 if self.baudrate else None
+        budget = 0.0
+        last = time.monotonic()
+        while self._running:
+            now = time.monotonic()
+            wait = min(max(firmware.next_event_time() - now, 0.0), MAX_WAIT_S)
+            want_write = bool(self._pending) and (bytes_per_s is None or budget >= 1.0)
+            readable, writable, _ = select.select([self._master], [self._master] if want_write else [], [], wait)
+            if readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except (BlockingIOError, InterruptedError):
+                    data = b""
+                except OSError:
+                    data = b"" # nessun client (EIO): si continua ad attendere
+                if data:
+                    firmware.receive(data)
+
+            now = time.monotonic()
+            firmware.update(now)
+            self._pending += firmware.take_output()
+            firmware.tx_blocked = len(self._pending) > TX_BUFFER_BYTES
+
+            if bytes_per_s is not None:
+                budget = min(budget + (now - last) * bytes_per_s, bytes_per_s * MAX_WAIT_S * 4)
+            last = now
+            if self._pending and (bytes_per_s is None or budget >= 1.0):
+                size = len(self._pending) if bytes_per_s is None else min(len(self._pending), int(budget))
+                try:
+                    written = os.write(self._master, self._pending[:size])
+                except (BlockingIOError, InterruptedError):
+                    written = 0 # client lento: il kernel ha il buffer pieno
+                except OSError:
+                    written = 0
+                del self._pending[:written]
+                self.bytes_sent += written
+                if bytes_per_s is not None:
+                    budget -= written
@@ -0,0 +1,225 @@
+# export_backends.py
+
+import csv
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+# Parquet è opzionale: senza pyarrow il backend resta registrato ma non
+# disponibile (escluso dai filtri dei dialoghi di salvataggio)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Identificativo dei metadati JSON dei formati binari (NPZ, Parquet)
+METADATA_FORMAT = "utm-export"
+METADATA_VERSION = 1
+
+
+def _json_default(value):
+    """ Serializzazione tollerante dei metadati (tipi NumPy, oggetti non JSON). """
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def export_metadata_json(saver, specimen_name, specimen_data, calibration_info):
+    """
+    Blocco metadati di `DataSaver.specimen_metadata()` come JSON, per i
+    formati binari: parametri, descrizioni dei blocchi (`test_sequence`,
+    `null` per i monotonici) e intestazione leggibile di ogni colonna.
+    """
+    params, test_sequence = saver.specimen_metadata(specimen_name, specimen_data, calibration_info)
+    return json.dumps({
+        "format": METADATA_FORMAT,
+        "version": METADATA_VERSION,
+        "specimen": specimen_name,
+        "parameters": params,
+        "test_sequence": test_sequence,
+        "columns": {key: header for key, header, _ in saver.specimen_columns(specimen_data)},
+    }, default=_json_default)
+
+
+class ExportBackend:
+    """
+    Formato di export di `DataSaver.save_batch()`. `write()` scrive i
+    provini di `specimens_dict` in `filepath` e avanza `progress` (righe
+    dati scritte); un'eccezione segnala l'errore. Con
+    `one_specimen_per_file` il `DataSaver` chiama `write()` una volta per
+    provino. Le colonne e i metadati vengono da
+    `DataSaver.specimen_columns()`/`specimen_metadata()`, uguali per tutti
+    i formati.
+    """
+
+    name = None
+    extension = None
+    description = None
+    one_specimen_per_file = True
+
+    @property
+    def available(self):
+        return True
+
+    def write(self, saver, specimens_dict, filepath, calibration_info, progress):
+        raise NotImplementedError
+
+
+class XlsxBackend(ExportBackend):
+    """ Workbook Excel con grafici: un foglio per provino (`DataSaver._write_xlsx()`). """
+
+    name = "xlsx"
+    extension = ".xlsx"
+    description = "Excel Files"
+    one_specimen_per_file = False
+
+    def write(self, saver, specimens_dict, filepath, calibration_info, progress):
+        saver._write_xlsx(specimens_dict, filepath, calibration_info, progress)
+
+
+class CsvBackend(ExportBackend):
+    """
+    CSV con lo stesso layout dei fogli xlsx (parametri chiave/valore,
+    "Test Sequence", intestazioni, dati), quindi reimportabile con
+    `data_importer.py`. Valori con la rappresentazione più corta che
+    rilegge lo stesso float (`repr`), NaN come `nan`.
+    """
+
+    name = "csv"
+    extension = ".csv"
+    description = "CSV Files"
+
+    def write(self, saver, specimens_dict, filepath, calibration_info, progress):
+        (specimen_name, specimen_data), = specimens_dict.items()
+        params, test_sequence = saver.specimen_metadata(specimen_name, specimen_data, calibration_info)
+        export_columns = saver.specimen_columns(specimen_data)
+        columns = [values for _, _, values in export_columns]
+        n = len(columns[0])
+        with open(filepath, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Test Parameters"])
+            writer.writerows([key, "" if value is None else value] for key, value in params.items())
+            if test_sequence is not None:
+                writer.writerow(["Test Sequence"])
+                writer.writerows(["", description] for description in test_sequence)
+            writer.writerow([header for _, header, _ in export_columns])
+            # Dati a blocchi, formattati colonna per colonna: solo numeri, niente quoting
+            for start in range(0, n, saver.ROW_BLOCK_SIZE):
+                stop = min(start + saver.ROW_BLOCK_SIZE, n)
+                file.write("\n".join(map(",".join, zip(*(map(repr, c[start:stop].tolist()) for c in columns)))))
+                file.write("\n")
+                progress.advance(stop - start)
+
+
+class NpzBackend(ExportBackend):
+    """
+    Archivio NumPy `.npz` (leggibile con `numpy.load`): un array float64
+    per colonna, con le chiavi di `EXPORT_COLUMNS`, più `metadata` (stringa
+    JSON di `export_metadata_json()`). Compresso con deflate livello 1 e
+    scritto una colonna alla volta.
+    """
+
+    name = "npz"
+    extension = ".npz"
+    description = "NumPy Archives"
+
+    def write(self, saver, specimens_dict, filepath, calibration_info, progress):
+        (specimen_name, specimen_data), = specimens_dict.items()
+        export_columns = saver.specimen_columns(specimen_data)
+        metadata = export_metadata_json(saver, specimen_name, specimen_data, calibration_info)
+        with zipfile.ZipFile(filepath, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for key, _, values in export_columns:
+                with archive.open(f"{key}.npy", "w", force_zip64=True) as entry:
+                    np.lib.format.write_array(entry, np.ascontiguousarray(values, dtype=np.float64),
+                                              allow_pickle=False)
+            buffer = io.BytesIO()
+            np.lib.format.write_array(buffer, np.array(metadata), allow_pickle=False)
+            archive.writestr("metadata.npy", buffer.getvalue())
+        progress.advance(len(export_columns[0][2]))
+
+
+class ParquetBackend(ExportBackend):
+    """
+    File Parquet (Arrow) colonnare: una colonna float64 per voce di
+    `EXPORT_COLUMNS`, scritte a row group di `ROW_GROUP_SIZE` righe, con
+    il JSON di `export_metadata_json()` nei metadati dello schema (chiave
+    `utm.metadata`). Richiede pyarrow.
+    """
+
+    name = "parquet"
+    extension = ".parquet"
+    description = "Parquet Files"
+    ROW_GROUP_SIZE = 100000
+
+    @property
+    def available(self):
+        return pq is not None
+
+    def write(self, saver, specimens_dict, filepath, calibration_info, progress):
+        if not self.available:
+            raise RuntimeError("export Parquet non disponibile: installare pyarrow")
+        (specimen_name, specimen_data), = specimens_dict.items()
+        export_columns = saver.specimen_columns(specimen_data)
+        metadata = export_metadata_json(saver, specimen_name, specimen_data, calibration_info)
+        schema = pa.schema([(key, pa.float64()) for key, _, _ in export_columns],
+                           metadata={"utm.metadata": metadata})
+        n = len(export_columns[0][2])
+        with pq.ParquetWriter(filepath, schema) as writer:
+            for start in range(0, max(n, 1), self.ROW_GROUP_SIZE):
+                stop = min(start + self.ROW_GROUP_SIZE, n)
+                writer.write_table(pa.table([values[start:stop] for _, _, values in export_columns], schema=schema))
+                progress.advance(stop - start)
+
+
+EXPORT_BACKENDS = {}
+
+
+def register_backend(backend):
+    """ Registra un backend (istanza di `ExportBackend`) con il suo nome. """
+    EXPORT_BACKENDS[backend.name] = backend
+    return backend
+
+
+for _backend in (XlsxBackend(), CsvBackend(), NpzBackend(), ParquetBackend()):
+    register_backend(_backend)
+
+
+def get_backend(name):
+    """ Backend registrato con `name`; `ValueError` se sconosciuto. """
+    try:
+        return EXPORT_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Formato di export sconosciuto: {name}") from None
+
+
+def backend_for_path(filepath):
+    """ Backend dall'estensione di `filepath`; `ValueError` se nessun backend la gestisce. """
+    extension = os.path.splitext(filepath)[1].lower()
+    for backend in EXPORT_BACKENDS.values():
+        if backend.extension == extension:
+            return backend
+    raise ValueError(f"Formato di export non riconosciuto per {os.path.basename(filepath)}")
+
+
+def file_dialog_filter():
+    """ Filtri dei dialoghi di salvataggio, uno per backend disponibile (xlsx per primo). """
+    return ";;".join(f"{backend.description} (*{backend.extension})"
+                     for backend in EXPORT_BACKENDS.values() if backend.available)
+
+
+def path_for_filter(filepath, selected_filter):
+    """
+    Aggiunge a `filepath` l'estensione del filtro scelto nel dialogo se non
+    ne ha già una di un backend registrato.
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if any(backend.extension == extension for backend in EXPORT_BACKENDS.values()):
+        return filepath
+    for backend in EXPORT_BACKENDS.values():
+        if f"(*{backend.extension})" in (selected_filter or ""):
+            return filepath + backend.extension
+    return filepath
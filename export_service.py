@@ -0,0 +1,187 @@
+# export_service.py
+
+import copy
+import os
+import zipfile
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+
+from autosave_writer import export_recording_to_xlsx
+from channel_store import compress_recorder
+from data_importer import import_file
+from data_saver import DataSaver
+from recorder import TestRecorder
+
+
+def snapshot_specimens(specimens):
+    """
+    Copia indipendente di un dizionario di provini, da esportare mentre la
+    GUI continua a modificare gli originali (nuovo test sullo stesso
+    provino, cancellazione, modifica del setup). I `TestRecorder` sono
+    copiati con `copy()` (una copia di array), il resto con `deepcopy`.
+    """
+    snapshot = {}
+    for name, data in specimens.items():
+        snapshot[name] = {key: value.copy() if isinstance(value, TestRecorder) else copy.deepcopy(value)
+                          for key, value in data.items()}
+    return snapshot
+
+
+class _ExportWorker(QObject):
+    """ Esegue i job in coda, uno alla volta, nel thread dell'export. """
+
+    job_started = pyqtSignal(int, str)
+    job_progress = pyqtSignal(int, int, int)
+    job_finished = pyqtSignal(int, bool, str)
+
+    @pyqtSlot(object)
+    def run_job(self, job):
+        if job is None: # sentinella di shutdown(): tutti i job precedenti sono conclusi
+            QThread.currentThread().quit()
+            return
+        job_id, description, function = job
+        self.job_started.emit(job_id, description)
+        try:
+            success, message = function(lambda done, total: self.job_progress.emit(job_id, done, total))
+        except Exception as e:
+            success, message = False, f"Errore durante l'export ({description}): {e}"
+        self.job_finished.emit(job_id, success, message)
+
+
+class ExportService(QObject):
+    """
+    Servizio di export in background: autosave di fine test, export batch e
+    recupero delle registrazioni interrotte girano in un `QThread` dedicato,
+    in coda FIFO, invece che nel thread GUI (dove bloccavano interfaccia ed
+    elaborazione delle righe seriali per tutta la scrittura dell'xlsx).
+
+    Ogni job lavora su una copia dei dati presa al momento della richiesta
+    (`snapshot_specimens()`), quindi un nuovo test può partire mentre gli
+    export precedenti sono ancora in coda. Avvio, avanzamento (righe
+    scritte/totali) e fine di ogni job sono notificati con segnali, nel
+    thread GUI; `on_finished(success, message)`, se passato, viene chiamato
+    allo stesso modo alla fine del singolo job. `chart_max_points` è il
+    budget dei grafici incorporati (vedi `DataSaver`).
+    """
+
+    export_started = pyqtSignal(int, str)          # job_id, descrizione
+    export_progress = pyqtSignal(int, int, int)    # job_id, righe scritte, righe totali
+    export_finished = pyqtSignal(int, bool, str)   # job_id, esito, messaggio
+
+    _job_submitted = pyqtSignal(object)
+
+    def __init__(self, chart_max_points=None, parent=None):
+        super().__init__(parent)
+        self.saver = DataSaver(chart_max_points) # senza stato: condiviso dai job
+        self._next_job_id = 1
+        self._callbacks = {}   # job_id -> on_finished (o None), per i job non ancora conclusi
+        self._thread = QThread()
+        self._worker = _ExportWorker()
+        self._worker.moveToThread(self._thread)
+        self._job_submitted.connect(self._worker.run_job)
+        self._worker.job_started.connect(self.export_started)
+        self._worker.job_progress.connect(self.export_progress)
+        self._worker.job_finished.connect(self._on_job_finished)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """ Job in coda o in esecuzione. """
+        return len(self._callbacks)
+
+    def submit(self, description, function, on_finished=None):
+        """
+        Accoda `function(progress_callback) -> (success, message)`, da
+        eseguire nel thread dell'export. Ritorna l'id del job.
+        """
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        self._callbacks[job_id] = on_finished
+        self._job_submitted.emit((job_id, description, function))
+        return job_id
+
+    def export_specimens(self, specimens, filepath, calibration_info="N/A", on_finished=None):
+        """
+        Accoda `DataSaver.save_batch()` su una copia di `specimens`, nel
+        formato dato dall'estensione di `filepath` (vedi `export_backends.py`).
+        """
+        snapshot = snapshot_specimens(specimens)
+        return self.submit(
+            filepath,
+            lambda progress: self.saver.save_batch(snapshot, filepath, calibration_info, progress),
+            on_finished)
+
+    def export_batch_per_specimen(self, specimens, summary_path, calibration_info="N/A", on_finished=None):
+        """
+        Accoda `DataSaver.save_batch_per_specimen()` su una copia di
+        `specimens`: un file per provino, scritti in parallelo da un pool di
+        processi, più il riepilogo `summary_path`.
+        """
+        snapshot = snapshot_specimens(specimens)
+        return self.submit(
+            summary_path,
+            lambda progress: self.saver.save_batch_per_specimen(snapshot, summary_path, calibration_info, progress),
+            on_finished)
+
+    def export_recording(self, recording_path, xlsx_path, on_finished=None):
+        """ Accoda la conversione di una registrazione `.utmrec` in xlsx. """
+        return self.submit(
+            xlsx_path,
+            lambda progress: export_recording_to_xlsx(recording_path, xlsx_path, progress, self.saver),
+            on_finished)
+
+    def compress_recorder(self, recorder, on_compressed, **hints):
+        """
+        Accoda `channel_store.compress_recorder()` su `recorder`, che non deve
+        più ricevere campioni (test concluso). `on_compressed(compressed)` è
+        chiamato nel thread GUI a compressione conclusa. Fino ad allora il
+        registratore resta utilizzabile in sola lettura.
+        """
+        result = []
+
+        def job(progress):
+            result.append(compress_recorder(recorder, **hints))
+            return True, f"Storico compresso: {len(recorder)} campioni, {result[0].store.nbytes / 1e6:.1f} MB"
+
+        def finished(success, message):
+            if success:
+                on_compressed(result[0])
+
+        return self.submit("compressione del test concluso", job, finished)
+
+    def import_files(self, filepaths, on_imported):
+        """
+        Accoda `data_importer.import_file()` per ogni file di `filepaths`.
+        `on_imported(results, errors)` è chiamato nel thread GUI alla fine:
+        `results` è la lista dei dizionari di provini dei file importati,
+        `errors` i messaggi `"file: errore"` di quelli non importati.
+        """
+        results, errors = [], []
+
+        def job(progress):
+            for done, filepath in enumerate(filepaths, 1):
+                try:
+                    results.append(import_file(filepath))
+                except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                    errors.append(f"{os.path.basename(filepath)}: {e}")
+                progress(done, len(filepaths))
+            return not errors, f"Importati {len(results)} file su {len(filepaths)}"
+
+        def finished(success, message):
+            if not success and not errors: # eccezione inattesa, già nel messaggio del job
+                errors.append(message)
+            on_imported(results, errors)
+
+        return self.submit(f"importazione di {len(filepaths)} file", job, finished)
+
+    def shutdown(self):
+        """ Attende la fine di tutti i job in coda e chiude il thread (bloccante). """
+        if self._thread.isRunning():
+            self._job_submitted.emit(None)
+            self._thread.wait()
+
+    def _on_job_finished(self, job_id, success, message):
+        on_finished = self._callbacks.pop(job_id, None)
+        self.export_finished.emit(job_id, success, message)
+        if on_finished is not None:
+            on_finished(success, message)
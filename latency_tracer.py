@@ -0,0 +1,269 @@
+# latency_tracer.py
+
+import json
+import math
+import threading
+import time
+from datetime import datetime
+
+from PyQt6.QtCore import QEvent, QObject, QTimer
+
+# Istanti registrati per ogni lettura tracciata della porta, nell'ordine della pipeline
+STAMPS = ("read", "framed", "parse_start", "parsed", "emitted", "dispatched", "updated",
+          "rendered", "paint_start", "painted")
+(READ, FRAMED, PARSE_START, PARSED, EMITTED, DISPATCHED, UPDATED,
+ RENDERED, PAINT_START, PAINTED) = range(len(STAMPS))
+
+# Tratti misurati: nome -> (istante iniziale, istante finale)
+STAGES = {
+    "framing": (READ, FRAMED),               # LineFramer.feed(), thread seriale
+    "parser_queue": (FRAMED, PARSE_START),   # lines_received -> thread del parser
+    "parse": (PARSE_START, PARSED),          # PacketParser.handle_lines()
+    "batching": (PARSED, EMITTED),           # attesa del flush del parser (FLUSH_INTERVAL_MS)
+    "gui_queue": (EMITTED, DISPATCHED),      # samples_ready -> thread GUI
+    "widget": (DISPATCHED, UPDATED),         # handle_sample_batch(): handle_stream_data() del widget
+    "frame_wait": (UPDATED, RENDERED),       # attesa del frame e callback di RenderScheduler (setData)
+    "paint_queue": (RENDERED, PAINT_START),  # fine frame -> evento Paint del grafico
+    "paint": (PAINT_START, PAINTED),         # disegno del grafico e ritorno al loop eventi
+    "total": (READ, PAINTED),                # dal byte letto al pixel disegnato
+}
+
+# Contatori di throughput (totali dall'ultimo reset)
+COUNTERS = ("reads", "bytes", "samples", "batches", "frames", "paints", "completed", "unpainted")
+
+
+class LatencyHistogram:
+    """
+    Istogramma logaritmico di latenze in µs: `BINS_PER_DECADE` classi per
+    decade da `MIN_US` a `MIN_US * 10**DECADES`, più una classe sotto e una
+    sopra la scala. I percentili sono stimati dal limite superiore della
+    classe (errore relativo massimo ~26% con 10 classi per decade).
+    """
+
+    BINS_PER_DECADE = 10
+    MIN_US = 1.0
+    DECADES = 7 # fino a 10 s
+
+    def __init__(self):
+        self.counts = [0] * (self.BINS_PER_DECADE * self.DECADES + 2)
+        self.count = 0
+        self.total_us = 0.0
+        self.min_us = math.inf
+        self.max_us = 0.0
+
+    def add(self, value_us):
+        if value_us < self.MIN_US:
+            index = 0
+        else:
+            index = min(1 + int(math.log10(value_us / self.MIN_US) * self.BINS_PER_DECADE), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_us += value_us
+        self.min_us = min(self.min_us, value_us)
+        self.max_us = max(self.max_us, value_us)
+
+    def edges(self):
+        """ Limiti delle classi in µs (`len(counts) + 1` valori; 0 e inf agli estremi). """
+        inner = [self.MIN_US * 10 ** (i / self.BINS_PER_DECADE)
+                 for i in range(self.BINS_PER_DECADE * self.DECADES + 1)]
+        return [0.0] + inner + [math.inf]
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        target = p / 100.0 * self.count
+        cumulative = 0
+        for upper, count in zip(self.edges()[1:], self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(upper, self.max_us)
+        return self.max_us
+
+    def to_dict(self):
+        edges = self.edges()
+        return {
+            "count": self.count,
+            "mean_us": self.total_us / self.count if self.count else None,
+            "min_us": self.min_us if self.count else None,
+            "max_us": self.max_us if self.count else None,
+            "p50_us": self.percentile(50),
+            "p90_us": self.percentile(90),
+            "p99_us": self.percentile(99),
+            # solo le classi non vuote: [limite inferiore µs, limite superiore µs (None = oltre scala), conteggio]
+            "bins": [[edges[i], edges[i + 1] if i + 2 < len(edges) else None, c]
+                     for i, c in enumerate(self.counts) if c],
+        }
+
+
+class LatencyTracer(QObject):
+    """
+    Strumentazione della latenza per tratti della pipeline di ingresso, dal
+    byte letto sulla porta al grafico ridisegnato. L'unità tracciata è una
+    lettura della porta (il lotto di righe di un `readinto()`): ogni tratto
+    ne annota l'istante (`time.perf_counter_ns()`, monotonico e comune a
+    tutti i thread) in una lista `STAMPS`, che viaggia insieme ai dati.
+
+    - thread seriale: `begin()` dopo `LineFramer.feed()`;
+    - thread del parser: `take()` delle righe ricevute, `stamp()` prima e
+      dopo il parsing, `attach()` al lotto di campioni emesso dal flush;
+    - thread GUI: `take()` del lotto in `handle_sample_batch()`,
+      `updated()` dopo i widget, `frame_rendered()` da `RenderScheduler`,
+      evento Paint dei viewport registrati con `watch_paint()`.
+
+    Spento (`enabled` falso) ogni punto di misura costa il controllo di un
+    attributo e i viewport non hanno event filter. Istogrammi (µs) e
+    contatori si leggono con `snapshot()` e si salvano in JSON con `dump()`.
+    Va creato nel thread GUI.
+    """
+
+    MAX_IN_FLIGHT = 256 # oggetti consegnati e non ancora ritirati (es. tracciamento spento a metà)
+    STALE_NS = 1_000_000_000 # letture senza frame entro 1 s: schermata senza grafico live
+
+    now = staticmethod(time.perf_counter_ns)
+
+    def __init__(self, enabled=False, parent=None):
+        super().__init__(parent)
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._in_flight = {} # id(oggetto) -> (oggetto, tracce): il riferimento impedisce il riuso dell'id
+        self._awaiting_frame = []
+        self._awaiting_paint = []
+        self._painting = []
+        self._viewports = []
+        self.reset()
+        self.set_enabled(enabled)
+
+    def set_enabled(self, enabled):
+        """ Attiva/disattiva il tracciamento; le tracce in volo vengono scartate. """
+        enabled = bool(enabled)
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        with self._lock:
+            self._in_flight.clear()
+        self._awaiting_frame, self._awaiting_paint, self._painting = [], [], []
+        for viewport in self._viewports:
+            if enabled:
+                viewport.installEventFilter(self)
+            else:
+                viewport.removeEventFilter(self)
+
+    def watch_paint(self, viewport):
+        """ Il disegno di `viewport` (es. `PlotWidget.viewport()`) chiude le letture già renderizzate. """
+        self._viewports.append(viewport)
+        if self.enabled:
+            viewport.installEventFilter(self)
+
+    def reset(self):
+        """ Azzera istogrammi e contatori. """
+        with self._lock:
+            self.histograms = {name: LatencyHistogram() for name in STAGES}
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self._started_ns = time.perf_counter_ns()
+
+    # --- Passaggi tra i thread ---
+
+    def begin(self, lines, t_read, nbytes):
+        """ Lettura di `nbytes` byte fatta a `t_read` e appena smontata in `lines` (thread seriale). """
+        trace = [0] * len(STAMPS)
+        trace[READ] = t_read
+        trace[FRAMED] = time.perf_counter_ns()
+        with self._lock:
+            self.counters["reads"] += 1
+            self.counters["bytes"] += nbytes
+        self.attach(lines, [trace])
+
+    def attach(self, obj, traces):
+        """ Affida le tracce a `obj` (righe o lotto di campioni) per il thread che lo riceverà. """
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self._in_flight) >= self.MAX_IN_FLIGHT:
+                del self._in_flight[next(iter(self._in_flight))]
+            self._in_flight[id(obj)] = (obj, traces)
+
+    def take(self, obj):
+        """ Tracce affidate a `obj` con `attach()`/`begin()`, o None. """
+        with self._lock:
+            entry = self._in_flight.pop(id(obj), None)
+        return entry[1] if entry is not None else None
+
+    @staticmethod
+    def stamp(traces, index):
+        t = time.perf_counter_ns()
+        for trace in traces:
+            trace[index] = t
+
+    # --- Thread GUI ---
+
+    def updated(self, traces, samples):
+        """ Lotto di `samples` campioni consegnato al widget corrente: le sue letture attendono il frame. """
+        now = time.perf_counter_ns()
+        for trace in traces:
+            trace[UPDATED] = now
+        with self._lock:
+            self.counters["batches"] += 1
+            self.counters["samples"] += samples
+        awaiting = self._awaiting_frame
+        if awaiting and now - awaiting[0][UPDATED] > self.STALE_NS:
+            # nessun frame da oltre STALE_NS: si registrano i tratti fin qui
+            self._finish(awaiting)
+            awaiting.clear()
+        awaiting.extend(traces)
+
+    def frame_rendered(self):
+        """ Chiamata da `RenderScheduler` dopo i callback di un frame. """
+        with self._lock:
+            self.counters["frames"] += 1
+        if self._awaiting_paint:
+            # il frame precedente non ha ridisegnato un grafico osservato (non visibile)
+            self._finish(self._awaiting_paint)
+        self.stamp(self._awaiting_frame, RENDERED)
+        self._awaiting_paint, self._awaiting_frame = self._awaiting_frame, []
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and self._awaiting_paint and not self._painting:
+            self.stamp(self._awaiting_paint, PAINT_START)
+            self._painting, self._awaiting_paint = self._awaiting_paint, []
+            # eseguito al ritorno nel loop eventi, a disegno (e flush della finestra) concluso
+            QTimer.singleShot(0, self._paint_done)
+        return False
+
+    def _paint_done(self):
+        painting, self._painting = self._painting, []
+        self.stamp(painting, PAINTED)
+        with self._lock:
+            self.counters["paints"] += 1
+        self._finish(painting)
+
+    def _finish(self, traces):
+        """ Registra negli istogrammi i tratti con entrambi gli istanti presenti. """
+        histograms = self.histograms
+        for trace in traces:
+            for name, (start, end) in STAGES.items():
+                if trace[start] and trace[end]:
+                    histograms[name].add((trace[end] - trace[start]) / 1000.0)
+        with self._lock:
+            painted = sum(1 for trace in traces if trace[PAINTED])
+            self.counters["completed"] += painted
+            self.counters["unpainted"] += len(traces) - painted
+
+    # --- Lettura dei risultati ---
+
+    def snapshot(self):
+        """ Dizionario serializzabile con contatori e istogrammi dei tratti (tempi in µs). """
+        with self._lock:
+            counters = dict(self.counters)
+            elapsed_s = (time.perf_counter_ns() - self._started_ns) / 1e9
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "enabled": self.enabled,
+            "elapsed_s": elapsed_s,
+            "counters": counters,
+            "stages": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+        }
+
+    def dump(self, path, **extra):
+        """ Salva `snapshot()` in JSON, con le eventuali sezioni aggiuntive `extra`. """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(dict(self.snapshot(), **extra), file, indent=2)
@@ -0,0 +1,315 @@
+# live_plot.py
+
+import numpy as np
+
+
+class IncrementalSeries:
+    """
+    Coppia di buffer X/Y di visualizzazione per una curva live, calcolati
+    in modo incrementale a partire da un `TestRecorder`.
+
+    A ogni `update()` vengono trasformati solo i campioni arrivati dopo
+    l'ultima chiamata (costo per pacchetto costante, indipendente dalla
+    durata del test). Le trasformazioni (strain %, stress MPa, offset
+    encoder, maschera NaN della resistenza) sono funzioni vettoriali
+    `f(recorder, start, stop) -> array`; il ricalcolo completo avviene solo
+    quando cambia la `key` (modalità assi, gauge, area, offset, sorgente X)
+    o quando il registratore viene sostituito/svuotato.
+    """
+
+    def __init__(self, x_transform, y_transform, initial_capacity=4096):
+        self._x_transform = x_transform
+        self._y_transform = y_transform
+        capacity = max(int(initial_capacity), 16)
+        self._x = np.empty(capacity, dtype=np.float64)
+        self._y = np.empty(capacity, dtype=np.float64)
+        self._done = 0        # campioni già trasformati
+        self.revision = 0     # incrementata a ogni ricalcolo completo (vedi LodCurve)
+        self._source = None   # registratore di provenienza dei campioni già trasformati
+        self._key = None      # parametri di conversione usati per i campioni già trasformati
+
+    def set_transforms(self, x_transform, y_transform):
+        """ Sostituisce le funzioni di trasformazione (non invalida da sola: lo fa la key). """
+        self._x_transform = x_transform
+        self._y_transform = y_transform
+
+    def invalidate(self):
+        """ Forza il ricalcolo completo al prossimo update(). """
+        self._done = 0
+        self.revision += 1
+
+    def update(self, recorder, key=None):
+        """
+        Porta i buffer in pari con `recorder` e restituisce le viste
+        `(x, y)` sui campioni validi, da passare direttamente a `setData()`.
+        """
+        n = len(recorder)
+        if recorder is not self._source or key != self._key or n < self._done:
+            self._source = recorder
+            self._key = key
+            self._done = 0
+            self.revision += 1
+
+        if n > self._x.shape[0]:
+            self._grow(n)
+
+        start = self._done
+        if n > start:
+            self._x[start:n] = self._x_transform(recorder, start, n)
+            self._y[start:n] = self._y_transform(recorder, start, n)
+            self._done = n
+
+        return self._x[:n], self._y[:n]
+
+    def _grow(self, min_capacity):
+        capacity = self._x.shape[0]
+        while capacity < min_capacity:
+            capacity *= 2
+        for attr in ("_x", "_y"):
+            old = getattr(self, attr)
+            new = np.empty(capacity, dtype=np.float64)
+            new[:self._done] = old[:self._done]
+            setattr(self, attr, new)
+
+
+# --- TRASFORMAZIONI COMUNI (vettoriali, su una fetta [start:stop] del registratore) ---
+
+def column_slice(name, scale=None, offset=0.0):
+    """ Colonna `name` del registratore, con offset sottratto e fattore di scala opzionali. """
+    def transform(recorder, start, stop):
+        values = recorder.column(name)[start:stop]
+        if offset:
+            values = values - offset
+        if scale is not None:
+            values = values * scale
+        return values
+    return transform
+
+
+def resistance_slice(recorder, start, stop):
+    """ Resistenza per il grafico: i codici negativi (N/A, errori LCR) diventano NaN. """
+    values = recorder.resistance_ohm[start:stop]
+    return np.where(values >= 0, values, np.nan)
+
+
+# --- LIVELLI DI DETTAGLIO (piramide di inviluppi min/max) ---
+
+LOD_BASE_BUCKET = 8      # campioni grezzi per bucket al livello 1
+LOD_FANOUT = 4           # bucket del livello k-1 riuniti in un bucket del livello k
+LOD_MAX_POINTS = 6000    # tetto ai vertici passati a pyqtgraph per curva
+LOD_MIN_POINTS = 1000    # minimo, anche con widget molto stretti
+
+
+class _IndexRows:
+    """ Array (n, 4) di indici int64 che cresce per raddoppio. """
+
+    def __init__(self):
+        self._data = np.empty((64, 4), dtype=np.int64)
+        self.size = 0
+
+    def extend(self, rows):
+        needed = self.size + len(rows)
+        if needed > self._data.shape[0]:
+            capacity = self._data.shape[0]
+            while capacity < needed:
+                capacity *= 2
+            new = np.empty((capacity, 4), dtype=np.int64)
+            new[:self.size] = self._data[:self.size]
+            self._data = new
+        self._data[self.size:needed] = rows
+        self.size = needed
+
+    def view(self):
+        return self._data[:self.size]
+
+
+class MinMaxPyramid:
+    """
+    Piramide di inviluppi min/max costruita in modo incrementale.
+
+    Al livello k ogni bucket copre `LOD_BASE_BUCKET * LOD_FANOUT**(k-1)`
+    campioni consecutivi e ne conserva gli **indici** del minimo e massimo
+    di X e di Y (4 punti). Lavorare per indice, e non per intervalli di X,
+    permette di gestire anche X non monotona (cicli carico/spostamento) e
+    mantiene i picchi a qualunque livello. Il livello 0 sono i dati grezzi.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._levels = [None]  # _levels[k] = _IndexRows del livello k (k >= 1)
+        self.size = 0          # campioni grezzi già inclusi
+        self.x_min = np.inf
+        self.x_max = -np.inf
+
+    @staticmethod
+    def bucket_size(level):
+        return 1 if level == 0 else LOD_BASE_BUCKET * LOD_FANOUT ** (level - 1)
+
+    @property
+    def max_level(self):
+        return len(self._levels) - 1
+
+    def update(self, x, y):
+        """ Include i campioni di x/y successivi a quelli già visti (x/y crescono solo in coda). """
+        n = len(x)
+        if n < self.size:
+            self.reset()
+        if n > self.size:
+            new_x = x[self.size:n]
+            finite = new_x[np.isfinite(new_x)]
+            if finite.size:
+                self.x_min = min(self.x_min, float(finite.min()))
+                self.x_max = max(self.x_max, float(finite.max()))
+        self.size = n
+
+        level = 1
+        child_count = n  # "bucket" completi del livello precedente (al livello 0: i campioni)
+        while child_count >= (LOD_BASE_BUCKET if level == 1 else LOD_FANOUT):
+            if level > self.max_level:
+                self._levels.append(_IndexRows())
+            rows = self._levels[level]
+            group = LOD_BASE_BUCKET if level == 1 else LOD_FANOUT
+            complete = child_count // group
+            if complete > rows.size:
+                if level == 1:
+                    start = rows.size * group
+                    candidates = np.arange(start, complete * group, dtype=np.int64).reshape(-1, group)
+                else:
+                    child = self._levels[level - 1].view()
+                    candidates = child[rows.size * group:complete * group].reshape(-1, group * 4)
+                rows.extend(self._select(candidates, x, y))
+            child_count = rows.size
+            level += 1
+
+    @staticmethod
+    def _select(candidates, x, y):
+        """ Per ogni riga di indici candidati: indici di min/max di X e di Y (NaN ignorati). """
+        xs = x[candidates]
+        ys = y[candidates]
+        picked = np.empty((len(candidates), 4), dtype=np.int64)
+        rows = np.arange(len(candidates))
+        for col, (values, fill, pick) in enumerate((
+                (xs, np.inf, np.argmin), (xs, -np.inf, np.argmax),
+                (ys, np.inf, np.argmin), (ys, -np.inf, np.argmax))):
+            picked[:, col] = candidates[rows, pick(np.where(np.isnan(values), fill, values), axis=1)]
+        return picked
+
+    def level_for(self, visible_samples, budget):
+        """ Livello più fine che mostra `visible_samples` campioni entro `budget` punti. """
+        level = 0
+        points = visible_samples
+        while level < self.max_level and points > budget:
+            level += 1
+            points = visible_samples * 4 / self.bucket_size(level)
+        return level
+
+    def indices(self, level, start=0, stop=None):
+        """
+        Indici (ordinati, senza duplicati) dei punti da disegnare per
+        l'intervallo di campioni [start, stop) al livello richiesto. La coda
+        non ancora coperta da bucket completi viene presa dai livelli
+        inferiori e, per ultimi, dai campioni grezzi.
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        start = max(0, start)
+        parts = []
+        pos = start
+        for lvl in range(min(level, self.max_level), 0, -1):
+            size = self.bucket_size(lvl)
+            rows = self._levels[lvl].view()
+            b0 = pos // size
+            b1 = min(len(rows), -(-stop // size))
+            if b1 > b0:
+                parts.append(np.sort(rows[b0:b1], axis=1).ravel())
+                pos = b1 * size
+        if pos < stop:
+            parts.append(np.arange(pos, stop, dtype=np.int64))
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        idx = np.concatenate(parts)
+        if len(idx) > 1:
+            idx = idx[np.concatenate(([True], np.diff(idx) != 0))]
+        return idx
+
+
+class LodCurve:
+    """
+    Collega una curva pyqtgraph (`PlotDataItem`) a una `MinMaxPyramid`:
+    `set_data()` aggiorna la piramide in modo incrementale, `render()`
+    sceglie il livello in base all'intervallo X visibile e alla larghezza
+    in pixel della ViewBox, così a qualunque zoom vengono disegnati al più
+    qualche migliaio di vertici senza perdere i picchi.
+    """
+
+    def __init__(self, curve, viewbox, max_points=LOD_MAX_POINTS):
+        self.curve = curve
+        self.viewbox = viewbox
+        self.max_points = max_points
+        self._pyramid = MinMaxPyramid()
+        self._x = np.empty(0)
+        self._y = np.empty(0)
+        self._revision = None
+        self._x_monotonic = False
+
+    def set_data(self, x, y, revision=None, x_monotonic=False):
+        """
+        Nuovi dati per la curva. Con la stessa `revision` della chiamata
+        precedente si assume che x/y siano cresciuti solo in coda (serie
+        live) e la piramide viene solo estesa; altrimenti è ricostruita.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if revision is None or revision != self._revision:
+            self._pyramid.reset()
+        self._revision = revision
+        self._x, self._y = x, y
+        self._x_monotonic = x_monotonic
+        self._pyramid.update(x, y)
+        self.render()
+
+    def _budget(self):
+        width_px = self.viewbox.width() if self.viewbox is not None else 0
+        return int(min(self.max_points, max(LOD_MIN_POINTS, 4 * width_px)))
+
+    def render(self):
+        """ Ricalcola i punti visibili (chiamato dopo set_data e a ogni cambio di vista). """
+        x, y = self._x, self._y
+        n = len(x)
+        budget = self._budget()
+        if n <= budget or self.viewbox is None:
+            self.curve.setData(x, y)
+            return
+
+        x_lo, x_hi = self.viewbox.viewRange()[0]
+        if self._x_monotonic:
+            # X ordinata (es. tempo): l'intervallo visibile si trova per ricerca binaria
+            start = max(0, int(np.searchsorted(x, x_lo, side="left")) - 1)
+            stop = min(n, int(np.searchsorted(x, x_hi, side="right")) + 1)
+            visible = stop - start
+        else:
+            # X non monotona: stima dei campioni visibili dalla frazione di X inquadrata
+            start, stop = 0, n
+            data_width = self._pyramid.x_max - self._pyramid.x_min
+            fraction = (x_hi - x_lo) / data_width if data_width > 0 else 1.0
+            visible = n * min(1.0, max(fraction, 0.0))
+
+        level = self._pyramid.level_for(visible, budget)
+        idx = self._pyramid.indices(level, start, stop)
+        xs, ys = x[idx], y[idx]
+
+        # Scarta i punti fuori vista (più un vicino per lato, per non tagliare
+        # i segmenti al bordo) e quelli non finiti; i salti così creati
+        # interrompono la linea tramite l'array `connect`
+        keep = np.isfinite(xs) & np.isfinite(ys)
+        if not self._x_monotonic and len(xs):
+            inside = (xs >= x_lo) & (xs <= x_hi)
+            inside[1:] |= inside[:-1].copy()
+            inside[:-1] |= inside[1:].copy()
+            keep &= inside
+        positions = np.flatnonzero(keep)
+        connect = np.zeros(len(positions), dtype=bool)
+        if len(positions) > 1:
+            connect[:-1] = np.diff(positions) == 1
+        self.curve.setData(xs[positions], ys[positions], connect=connect)
@@ -1,8 +1,11 @@
 import sys
+import os
+import argparse
+from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QStackedWidget, QComboBox, 
                              QPushButton, QHBoxLayout, QWidget, QStatusBar, QLabel, 
                              QVBoxLayout, QListWidgetItem, QMessageBox)
-from PyQt6.QtCore import QThread, QTimer, pyqtSignal
+from PyQt6.QtCore import QThread, QTimer, pyqtSignal, QMetaObject, Qt
 
 from main_menu_widget import MainMenuWidget
 from manual_control_widget import ManualControlWidget
@@ -12,6 +15,13 @@ from cyclic_test_widget import CyclicTestWidget
 from communication import SerialCommunicator 
 from settings_manager import SettingsManager
 from custom_widgets import LimitsDialog, FilterConfigDialog
+from render_scheduler import RenderScheduler
+from packet_parser import IngestStats, PacketParser, parse_data_payload
+from autosave_writer import export_recording_to_xlsx, find_interrupted_recordings, seal_recording
+from export_service import ExportService
+from serial_capture import FILE_EXTENSION as CAPTURE_EXTENSION, CaptureReplaySource, CaptureWriter
+from latency_tracer import DISPATCHED, LatencyTracer
+from diagnostics_dialog import LatencyDiagnosticsDialog
 
 
 class MainWindow(QMainWindow):
@@ -47,10 +57,27 @@ class MainWindow(QMainWindow):
         self.current_filter_rate_sps = self.settings['filter_config']['rate_sps']
         self.current_filter_pga_gain = self.settings['filter_config']['gain']
 
-        self.comm_thread = QThread(); self.communicator = SerialCommunicator()
+        # Latenze per tratto dalla porta al grafico (spento di default, pannello "Latenze")
+        self.latency_tracer = LatencyTracer(self.settings['latency_tracing'], self)
+        self.latency_dialog = None
+
+        self.comm_thread = QThread(); self.communicator = SerialCommunicator(self.latency_tracer)
         self.communicator.moveToThread(self.comm_thread)
         self.comm_thread.started.connect(self.communicator.run); self.comm_thread.start()
 
+        # Parsing dei pacchetti D: in un thread dedicato, con consegna a lotti alla GUI
+        self.parser_thread = QThread()
+        self.packet_parser = PacketParser(self.PULSES_TO_MM, self.SCREW_PITCH_MM, self.ENCODER_COUNTS_PER_REV,
+                                          self.latency_tracer)
+        self.packet_parser.moveToThread(self.parser_thread)
+        self.parser_thread.started.connect(self.packet_parser.start); self.parser_thread.start()
+        # Integrità dello stream D: (sequenze perse/duplicate, errori di parsing), azzerata a ogni test
+        self.ingest_stats = IngestStats()
+        # Export xlsx (autosave, batch, recupero) in un thread dedicato, in coda
+        self.export_service = ExportService(self.settings['chart_max_points'], self)
+        # Riproduzione di una cattura seriale .utmcap (start_replay), al posto della porta
+        self.replay_thread = None; self.replay_source = None
+
         self.stacked_widget = QStackedWidget(); main_widget = QWidget()
         main_layout = QVBoxLayout(main_widget)
         
@@ -66,13 +93,22 @@ class MainWindow(QMainWindow):
         main_layout.addLayout(connection_bar); main_layout.addWidget(self.stacked_widget)
         self.setCentralWidget(main_widget)
         self.setStatusBar(QStatusBar(self)); self.statusBar().showMessage("Disconnesso.")
+        self.ingest_label = QLabel(); self.statusBar().addPermanentWidget(self.ingest_label)
+        self.latency_button = QPushButton("Latenze"); self.statusBar().addPermanentWidget(self.latency_button)
 
         self.main_menu = MainMenuWidget()
-        self.manual_control = ManualControlWidget(self.communicator)
+        # Timer di ridisegno condiviso dai widget di test (frame rate da settings.json)
+        self.render_scheduler = RenderScheduler(self.settings['plot_refresh_fps'], self, self.latency_tracer)
+        self.manual_control = ManualControlWidget(self.communicator, render_scheduler=self.render_scheduler,
+                                                  export_service=self.export_service)
         self.calibration_widget = CalibrationWidget(self.communicator, self.settings['cal_loads'])
         self.monotonic_test_widget = MonotonicTestWidget(self.communicator, self)
         self.cyclic_test = CyclicTestWidget(self.communicator, self)
         
+        for plot_widget in (self.manual_control.plot_widget, self.monotonic_test_widget.plot_widget,
+                            self.cyclic_test.plot_widget):
+            self.latency_tracer.watch_paint(plot_widget.viewport())
+        
         self.stacked_widget.addWidget(self.main_menu); self.stacked_widget.addWidget(self.manual_control)
         self.stacked_widget.addWidget(self.calibration_widget); self.stacked_widget.addWidget(self.monotonic_test_widget); self.stacked_widget.addWidget(self.cyclic_test)
         
@@ -98,11 +134,19 @@ class MainWindow(QMainWindow):
         self.refresh_ports_button.clicked.connect(self.populate_ports)
         self.connect_button.clicked.connect(self.connect_device)
         self.disconnect_button.clicked.connect(self.disconnect_device)
+        self.latency_button.clicked.connect(self.show_latency_diagnostics)
         
-        self.communicator.data_received.connect(self.handle_data_from_esp32)
+        self.communicator.lines_received.connect(self.packet_parser.handle_lines)
+        self.communicator.command_sent.connect(self.packet_parser.note_command)
+        self.packet_parser.samples_ready.connect(self.handle_sample_batch)
+        self.packet_parser.line_received.connect(self.handle_data_from_esp32)
+        self.packet_parser.parse_error.connect(self.handle_parse_error)
         self.communicator.connected.connect(self.on_connected)
         self.communicator.disconnected.connect(self.on_disconnected)
         self.communicator.port_error.connect(lambda msg: self.statusBar().showMessage(msg))
+        self.export_service.export_started.connect(self.on_export_started)
+        self.export_service.export_progress.connect(self.on_export_progress)
+        self.export_service.export_finished.connect(self.on_export_finished)
 
         # --- NUOVA CONNESSIONE PER IL POPUP SICURO ---
         self.limit_hit_signal.connect(self.show_limit_hit_popup)
@@ -113,6 +157,47 @@ class MainWindow(QMainWindow):
         self.data_request_timer.timeout.connect(lambda: self.communicator.send_command("GET_DATA"))
         
         self.populate_ports()
+        # Registrazioni di test rimaste aperte (crash/chiusura durante un test): proposte dopo l'avvio
+        QTimer.singleShot(0, self.check_interrupted_recordings)
+
+    def check_interrupted_recordings(self):
+        """ Propone la conversione in xlsx delle registrazioni .utmrec interrotte (vedi autosave_writer.py). """
+        paths = find_interrupted_recordings()
+        if not paths:
+            return
+        reply = QMessageBox.question(
+            self, "Registrazioni interrotte",
+            f"Trovate {len(paths)} registrazioni di test interrotte (crash o chiusura durante un test):\n"
+            + "\n".join(os.path.basename(p) for p in paths)
+            + "\n\nRecuperare i dati salvati in file Excel (_RECOVERED.xlsx)?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.Yes)
+        if reply != QMessageBox.StandardButton.Yes:
+            return # Resteranno da recuperare al prossimo avvio
+        for path in paths:
+            xlsx_path = os.path.splitext(path)[0] + "_RECOVERED.xlsx"
+            self.export_service.submit(xlsx_path, lambda progress, path=path, xlsx_path=xlsx_path:
+                                       self._recover_recording(path, xlsx_path, progress))
+
+    def _recover_recording(self, path, xlsx_path, progress_callback=None):
+        """ Job di recupero (thread dell'export): conversione in xlsx, poi chiusura della registrazione. """
+        success, message = export_recording_to_xlsx(path, xlsx_path, progress_callback, self.export_service.saver)
+        if success:
+            seal_recording(path) # Chiusa: non verrà riproposta
+        print(f"Recupero {path}: {message}")
+        return success, message
+
+    def on_export_started(self, job_id, description):
+        self.statusBar().showMessage(f"Export in corso: {os.path.basename(description)}")
+
+    def on_export_progress(self, job_id, done, total):
+        if total:
+            self.statusBar().showMessage(f"Export in corso: {100 * done // total}% "
+                                         f"({self.export_service.pending} in coda)")
+
+    def on_export_finished(self, job_id, success, message):
+        print(message if success else f"ERRORE EXPORT: {message}")
+        self.statusBar().showMessage(message, 5000)
 
     def save_cal_load_settings(self, new_cal_loads):
         self.settings['cal_loads'] = new_cal_loads
@@ -121,13 +206,25 @@ class MainWindow(QMainWindow):
     def populate_ports(self):
         self.port_selector.clear()
         ports = self.communicator.list_available_ports()
+        # Porte non elencate da pyserial (es. pseudo-terminale di esp32_simulator), se esistono
+        ports += [port for port in self.settings.get("extra_serial_ports", [])
+                  if port not in ports and os.path.exists(port)]
         if ports: self.port_selector.addItems(ports)
         else: self.port_selector.addItem("Nessuna porta trovata")
 
     def connect_device(self):
         port = self.port_selector.currentText()
         if port and "Nessuna porta" not in port:
+            if self.settings.get("serial_capture"):
+                # Traffico grezzo registrato per la riproduzione (serial_capture.py), accanto agli autosave
+                filename = f"CAPTURE_{datetime.now().strftime('%Y%m%d_%H%M%S')}{CAPTURE_EXTENSION}"
+                try:
+                    self.communicator.start_capture(CaptureWriter(filename, port=port, baudrate=460800))
+                except OSError as e:
+                    print(f"ERRORE CATTURA: impossibile creare {filename}: {e}")
             self.communicator.connect_to_port(port)
+            if not (self.communicator.serial_port and self.communicator.serial_port.is_open):
+                self.communicator.stop_capture()
 
     def disconnect_device(self):
         self.communicator.disconnect_port()
@@ -142,6 +239,10 @@ class MainWindow(QMainWindow):
         QTimer.singleShot(2000, self._send_post_connect_commands)
         self.data_request_timer.start()
 
+    def streaming_mode_command(self):
+        """ Comando di avvio streaming: binario (`binary_protocol.py`) se abilitato nelle impostazioni. """
+        return "SET_MODE:STREAMING_BIN" if self.settings.get("binary_streaming") else "SET_MODE:STREAMING"
+
     def _send_post_connect_commands(self):
         self.communicator.send_command("SET_MODE:POLLING")
         self.send_limits_to_firmware()
@@ -149,6 +250,10 @@ class MainWindow(QMainWindow):
 
     def on_disconnected(self):
         self.data_request_timer.stop()
+        capture = self.communicator.stop_capture()
+        if capture is not None:
+            print(f"Cattura seriale salvata: {capture.path} ({capture.records} record, "
+                  f"{capture.bytes_in} byte ricevuti)")
         self.connect_button.setEnabled(True); self.disconnect_button.setEnabled(False)
         self.refresh_ports_button.setEnabled(True); self.port_selector.setEnabled(True)
         self.statusBar().showMessage("Disconnesso.")
@@ -339,98 +444,161 @@ class MainWindow(QMainWindow):
             return # Fine gestione messaggi STATUS:
 
         # --- GESTIONE MESSAGGI DI DATI ('D:') ---
-        # Se non era un messaggio di stato, prova a interpretarlo come dati
-        try:
-            if data.startswith("D:"):
-                payload = data[2:]
-                parts = payload.split(';')
-
-                # Inizializza i default QUI, dentro il blocco dove servono
-                load_N = None
-                displacement_mm = None
-                time_s = 0.0
-                cycle_count = 0
-                resistance_ohm = -999.0 # Valore default/fallback
-                encoder_count = None # Assente sui pacchetti storici (< 6 campi)
-
-                # Parsing flessibile in base alla lunghezza
-                if len(parts) == 6: # Formato con encoder esterno (Livello 1)
-                    load_str, disp_str, time_ms_str, cycle_str, res_str, enc_str = parts
-                    cycle_count = int(cycle_str)
-                    try: resistance_ohm = float(res_str)
-                    except ValueError: resistance_ohm = -2.0 # Errore parsing resistenza
-                    try: encoder_count = int(enc_str)
-                    except ValueError: encoder_count = None # Errore parsing encoder, tratta come assente
-                elif len(parts) == 5: # Formato con LCR, senza encoder (storico)
-                    load_str, disp_str, time_ms_str, cycle_str, res_str = parts
-                    cycle_count = int(cycle_str)
-                    try: resistance_ohm = float(res_str)
-                    except ValueError: resistance_ohm = -2.0 # Errore parsing resistenza
-                elif len(parts) == 4: # Vecchio formato streaming
-                    load_str, disp_str, time_ms_str, cycle_str = parts
-                    cycle_count = int(cycle_str)
-                    # resistance_ohm rimane -999.0
-                elif len(parts) == 3: # Formato Polling
-                    load_str, disp_str, time_ms_str = parts
-                    cycle_count = 0
-                    # resistance_ohm rimane -999.0
-                else:
-                    raise ValueError(f"Pacchetto D: attesi 3, 4, 5 o 6 valori, ricevuti {len(parts)}")
-
-                # Parsing comune
-                load_grams = float(load_str)
-                pulse_count = int(disp_str)
-                time_s = float(time_ms_str) / 1000.0
-                load_N = (load_grams / 1000.0) * 9.81
-                displacement_mm = pulse_count * self.PULSES_TO_MM
-                encoder_displacement_mm = (
-                    (encoder_count / self.ENCODER_COUNTS_PER_REV) * self.SCREW_PITCH_MM
-                    if encoder_count is not None else None
-                )
-
-                # --- AZIONI SPOSTATE QUI DENTRO ---
-                # Se siamo arrivati qui, il parsing è OK e tutte le variabili sono definite.
-
-                current_widget = self.stacked_widget.currentWidget()
-
-                # Aggiornamento centralizzato variabili assolute (per tutti i widget)
-                widgets_to_update = [self.manual_control, self.monotonic_test_widget, self.cyclic_test]
-                for widget in widgets_to_update:
-                    if hasattr(widget, 'absolute_load_N'):
-                         widget.absolute_load_N = load_N
-                    if hasattr(widget, 'absolute_displacement_mm'):
-                         widget.absolute_displacement_mm = displacement_mm
-                    if hasattr(widget, 'current_resistance_ohm'):
-                        widget.current_resistance_ohm = resistance_ohm
-                    if hasattr(widget, 'absolute_encoder_displacement_mm'):
-                        widget.absolute_encoder_displacement_mm = encoder_displacement_mm
-
-                # Calibrazione (caso speciale)
-                if hasattr(self.calibration_widget, 'abs_load_display'):
-                     self.calibration_widget.abs_load_display.set_value(f"{load_N:.3f}")
-
-                # Chiama handle_stream_data del widget corrente (se esiste)
-                if hasattr(current_widget, 'handle_stream_data'):
-                    current_widget.handle_stream_data(load_N, displacement_mm, time_s, cycle_count, resistance_ohm, encoder_displacement_mm)
-
-                # Aggiorna i display del widget corrente (se esiste)
-                if hasattr(current_widget, 'update_displays'):
-                    current_widget.update_displays()
-                # --- FINE AZIONI SPOSTATE ---
-
-            # Se non inizia con 'D:' (e non era 'STATUS:'), ignora silenziosamente
-
-        except (ValueError, IndexError) as e:
-            # Se c'è stato un errore durante il parsing di 'D:'
-            print(f"ERRORE PARSING DATI: {e} | Dati: {data}")
-            return # Ignora questa riga di dati
-      
+        # Il flusso normale arriva già interpretato e a lotti da PacketParser
+        # (handle_sample_batch); qui resta il percorso riga per riga.
+        if data.startswith("D:"):
+            try:
+                *sample, seq = parse_data_payload(data[2:], self.PULSES_TO_MM, self.SCREW_PITCH_MM, self.ENCODER_COUNTS_PER_REV)
+            except (ValueError, IndexError) as e:
+                # Se c'è stato un errore durante il parsing di 'D:'
+                self.handle_parse_error(f"{e} | Dati: {data}")
+                return # Ignora questa riga di dati
+            self.ingest_stats.update([-1 if seq is None else seq])
+            self._dispatch_samples([(*sample, None)]) # nessun istante di lettura: tempo dell'host al widget
+            self.render_scheduler.request(self._update_ingest_label)
+
+        # Se non inizia con 'D:' (e non era 'STATUS:'), ignora silenziosamente
+
+    def handle_sample_batch(self, batch):
+        """ Lotto di campioni D: (array SAMPLE_DTYPE) consegnato da PacketParser. """
+        tracer = self.latency_tracer
+        traces = tracer.take(batch) if tracer.enabled else None
+        if traces:
+            tracer.stamp(traces, DISPATCHED)
+        encoder = batch["encoder_disp_mm"]
+        samples = zip(batch["load_N"].tolist(), batch["disp_mm"].tolist(), batch["time_s"].tolist(),
+                      batch["cycle"].tolist(), batch["resistance_ohm"].tolist(),
+                      [None if e != e else e for e in encoder.tolist()], # NaN -> None (encoder assente)
+                      [None if h != h else h for h in batch["host_s"].tolist()])
+        self.ingest_stats.update(batch["seq"])
+        self._dispatch_samples(samples)
+        if traces:
+            tracer.updated(traces, len(batch))
+        self.render_scheduler.request(self._update_ingest_label)
+
+    def handle_parse_error(self, line):
+        """ Riga D: o record binario scartato: stampato e contato nelle statistiche del test. """
+        print(f"ERRORE PARSING DATI: {line}")
+        self.ingest_stats.record_parse_error()
+        self.render_scheduler.request(self._update_ingest_label)
+
+    def _update_ingest_label(self):
+        """ Contatore live nella status bar (aggiornato una volta per frame). """
+        stats = self.ingest_stats
+        self.ingest_label.setText(
+            f"Campioni: {stats.received}  Persi: {stats.lost}  Duplicati: {stats.duplicates}  "
+            f"Errori: {stats.parse_errors}" + (f"  Senza seq: {stats.unsequenced}" if stats.unsequenced else ""))
+        self.ingest_label.setStyleSheet(
+            "color: red;" if stats.lost or stats.duplicates or stats.parse_errors else "")
+
+    def _dispatch_samples(self, samples):
+        """
+        Consegna i campioni (load_N, disp_mm, time_s, cycle, resistance_ohm,
+        encoder_disp_mm, host_time_s) al widget corrente; valori assoluti e
+        display sono aggiornati una sola volta, con l'ultimo campione.
+        """
+        current_widget = self.stacked_widget.currentWidget()
+        handle_stream_data = getattr(current_widget, 'handle_stream_data', None)
+        last = None
+        for last in samples:
+            # Chiama handle_stream_data del widget corrente (se esiste)
+            if handle_stream_data is not None:
+                handle_stream_data(*last)
+        if last is None:
+            return
+        load_N, displacement_mm, _, _, resistance_ohm, encoder_displacement_mm, _ = last
+
+        # Aggiornamento centralizzato variabili assolute (per tutti i widget)
+        widgets_to_update = [self.manual_control, self.monotonic_test_widget, self.cyclic_test]
+        for widget in widgets_to_update:
+            if hasattr(widget, 'absolute_load_N'):
+                 widget.absolute_load_N = load_N
+            if hasattr(widget, 'absolute_displacement_mm'):
+                 widget.absolute_displacement_mm = displacement_mm
+            if hasattr(widget, 'current_resistance_ohm'):
+                widget.current_resistance_ohm = resistance_ohm
+            if hasattr(widget, 'absolute_encoder_displacement_mm'):
+                widget.absolute_encoder_displacement_mm = encoder_displacement_mm
+
+        # Calibrazione (caso speciale)
+        if hasattr(self.calibration_widget, 'abs_load_display'):
+             self.calibration_widget.abs_load_display.set_value(f"{load_N:.3f}")
+
+        # Aggiorna i display del widget corrente (se esiste), una volta
+        # per frame tramite il RenderScheduler invece che a ogni pacchetto
+        if hasattr(current_widget, 'update_displays'):
+            self.render_scheduler.request(current_widget.update_displays)
+
+    def show_latency_diagnostics(self):
+        """ Pannello non modale con le latenze per tratto e i contatori di throughput. """
+        if self.latency_dialog is None:
+            self.latency_dialog = LatencyDiagnosticsDialog(self.latency_tracer, self.packet_parser.clock_sync, self)
+        self.latency_dialog.show()
+        self.latency_dialog.raise_()
+
+    def start_replay(self, path, speed=1.0):
+        """
+        Riproduce una cattura `.utmcap` nella pipeline di ingresso (parser,
+        `handle_sample_batch()`/`handle_data_from_esp32()`, widget) come se
+        arrivasse dalla porta: `speed` 1 = tempo reale, N = N volte più
+        veloce, `None`/0 = velocità massima (benchmark di throughput).
+        """
+        if self.replay_thread is not None:
+            return
+        self.replay_source = CaptureReplaySource(path, speed, barrier_objects=[self.packet_parser],
+                                                 latency_tracer=self.latency_tracer)
+        self.replay_thread = QThread()
+        self.replay_source.moveToThread(self.replay_thread)
+        self.replay_source.lines_received.connect(self.packet_parser.handle_lines)
+        self.replay_source.command_sent.connect(self.packet_parser.note_command)
+        self.replay_source.finished.connect(self.on_replay_finished)
+        self.replay_thread.started.connect(self.replay_source.run)
+        self.replay_thread.start()
+        speed_text = f"{speed:g}x" if speed else "velocità massima"
+        self.statusBar().showMessage(f"Riproduzione di {os.path.basename(path)} ({speed_text})...")
+
+    def stop_replay(self):
+        """ Interrompe la riproduzione in corso e attende il suo thread. """
+        if self.replay_thread is None:
+            return
+        thread = self.replay_thread
+        self.replay_source.stop()
+        # run() può essere in attesa del thread GUI (barriera): gli eventi vanno smaltiti
+        while not thread.wait(10):
+            QApplication.processEvents()
+        thread.quit(); thread.wait()
+        self.replay_thread = None
+
+    def on_replay_finished(self, stats):
+        elapsed = stats["elapsed_s"]
+        rate = stats["bytes"] / elapsed / 1e6 if elapsed > 0 else 0.0
+        ratio = stats["capture_duration_s"] / elapsed if elapsed > 0 else 0.0
+        message = (f"Riproduzione {'completata' if stats['completed'] else 'interrotta'}: "
+                   f"{stats['capture_duration_s']:.1f} s di cattura in {elapsed:.1f} s "
+                   f"({ratio:.1f}x, {rate:.2f} MB/s, {self.ingest_stats.received} campioni)")
+        print(message)
+        self.statusBar().showMessage(message)
+        if self.replay_thread is not None:
+            self.replay_thread.quit()
+            self.replay_thread.wait()
+            self.replay_thread = None
 
     def closeEvent(self, event):
         self.data_request_timer.stop()
+        self.stop_replay()
         self.communicator.stop()
         self.comm_thread.quit()
         self.comm_thread.wait()
+        self.communicator.stop_capture()
+        # Il timer del parser va fermato dal suo thread, prima di chiuderlo
+        QMetaObject.invokeMethod(self.packet_parser, "stop", Qt.ConnectionType.BlockingQueuedConnection)
+        self.parser_thread.quit()
+        self.parser_thread.wait()
+        # Gli export in coda vanno completati: sono gli unici xlsx di quei test
+        if self.export_service.pending:
+            self.statusBar().showMessage(f"Completamento di {self.export_service.pending} export in corso...")
+            QApplication.processEvents()
+        self.export_service.shutdown()
         event.accept()
 
     def update_calibration_status(self, status_text, cell_name):
@@ -571,7 +739,14 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Software Controllo Macchina di Trazione")
+    parser.add_argument("--replay", metavar="FILE", help=f"riproduce una cattura seriale ({CAPTURE_EXTENSION})")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="velocità della riproduzione: 1 = tempo reale, 0 = massima (default 1)")
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
     window = MainWindow()
     window.show()
+    if args.replay:
+        QTimer.singleShot(0, lambda: window.start_replay(args.replay, args.speed))
     sys.exit(app.exec())
\ No newline at end of file
@@ -9,20 +9,26 @@ from datetime import datetime
 from custom_widgets import DisplayWidget, SpeedBarWidget
 import numpy as np
 from data_saver import DataSaver
+from recorder import TestRecorder
 
 
 class ManualControlWidget(QWidget):
     back_to_menu_requested = pyqtSignal()
     limits_button_requested = pyqtSignal()
     
-    def __init__(self, communicator, parent=None):
+    def __init__(self, communicator, parent=None, render_scheduler=None, export_service=None):
         super().__init__(parent)
         self.communicator = communicator
+        # Se presente, il ridisegno è guidato dal RenderScheduler condiviso
+        # (solo quando arrivano dati) invece che dal timer locale
+        self.render_scheduler = render_scheduler
+        # Se presente, il salvataggio della registrazione avviene in background
+        self.export_service = export_service
         self.is_homing_active = False # NUOVO: Stato per tracciare l'homing
 
         # --- NUOVE VARIABILI PER GRAFICO E REGISTRAZIONE ---
         self.is_recording = False
-        self.recorded_data = []
+        self.recorded_data = TestRecorder()
         
         # Prepara le strutture dati per il grafico a scorrimento
         self.time_window_seconds = 5.0
@@ -30,7 +36,7 @@ class ManualControlWidget(QWidget):
         num_points = int(self.time_window_seconds * 50) 
         self.plot_time_data = deque(maxlen=num_points)
         self.plot_force_data = deque(maxlen=num_points)
-        self.plot_start_time = 0
+        self.plot_start_time = None # istante dell'host del primo campione mostrato
         # --- FINE NUOVE VARIABILI ---
         self.plot_time_data = deque(maxlen=num_points)
         self.plot_force_data = deque(maxlen=num_points)
@@ -172,23 +178,28 @@ class ManualControlWidget(QWidget):
         # --- FINE ---
         self.update_displays(); self.update_speed_controls()
 
-    def handle_stream_data(self, load_N, disp_mm, time_s, cycle_count, resistance_ohm, encoder_disp_mm=None):
+    def handle_stream_data(self, load_N, disp_mm, time_s, cycle_count, resistance_ohm, encoder_disp_mm=None,
+                           host_time_s=None):
              # Se la schermata non è visibile, non fare nulla
         if not self.isVisible():
-            self.plot_start_time = 0 # Resetta il tempo se la schermata viene nascosta
+            self.plot_start_time = None # Resetta il tempo se la schermata viene nascosta
             return
         self.current_resistance_ohm = resistance_ohm
         self.absolute_encoder_displacement_mm = encoder_disp_mm
 
+        # Istante di acquisizione sull'orologio dell'host (clock_sync.py), senza il
+        # jitter di USB e GUI; l'ora di arrivo solo se il campione non lo porta
+        sample_time = host_time_s if host_time_s is not None else time.monotonic()
+
         # Inizializza il tempo di partenza al primo dato ricevuto
-        if self.plot_start_time == 0:
-            self.plot_start_time = time.time()
+        if self.plot_start_time is None:
+            self.plot_start_time = sample_time
             # Pulisci i dati vecchi all'inizio di una nuova visualizzazione
             self.plot_time_data.clear()
             self.plot_force_data.clear()
             self.plot_resistance_data.clear()
 
-        elapsed_time = time.time() - self.plot_start_time
+        elapsed_time = sample_time - self.plot_start_time
         self.current_resistance_ohm = resistance_ohm
     
         self.plot_time_data.append(elapsed_time)
@@ -199,7 +210,11 @@ class ManualControlWidget(QWidget):
         if self.is_recording:
             relative_disp = disp_mm - self.displacement_offset_mm
             relative_load = load_N - self.load_offset_N
-            self.recorded_data.append((elapsed_time, relative_disp, relative_load, disp_mm, load_N, resistance_ohm, encoder_disp_mm))
+            self.recorded_data.append(elapsed_time, relative_disp, relative_load, disp_mm, load_N,
+                                      resistance_ohm, encoder_disp_mm)
+
+        if self.render_scheduler is not None:
+            self.render_scheduler.request(self._update_plot)
 
     # Aggiungi questo nuovo metodo privato alla classe
     def _update_plot(self):
@@ -225,7 +240,7 @@ class ManualControlWidget(QWidget):
             self.is_recording = True
             self.rec_button.setText("■ STOP REC")
             
-            self.recorded_data = []
+            self.recorded_data = TestRecorder()
             
             # Disabilita i controlli che potrebbero interferire
             self.homing_button.setEnabled(False)
@@ -274,32 +289,38 @@ class ManualControlWidget(QWidget):
             # DataSaver si aspetta un dizionario di provini, quindi creiamolo
             specimens_to_save = {"Manual Recording": manual_specimen}
             
-            # 5. Usa la classe DataSaver per fare il lavoro sporco
-            saver = DataSaver()
-            success, message = saver.save_batch_to_xlsx(
-                specimens_to_save, 
-                filepath, 
-                self.calib_status_display.value_label.text() # Passiamo l'info di calibrazione
-            )
-
-            # 6. Comunica il risultato all'utente
-            if success:
-                QMessageBox.information(self, "Salvataggio Riuscito", message)
+            calibration_info = self.calib_status_display.value_label.text() # Passiamo l'info di calibrazione
+
+            # 5. Usa la classe DataSaver per fare il lavoro sporco (in background se c'è l'ExportService)
+            if self.export_service is not None:
+                self.export_service.export_specimens(specimens_to_save, filepath, calibration_info,
+                                                     on_finished=self._on_recording_saved)
             else:
-                QMessageBox.critical(self, "Errore di Salvataggio", message)
+                saver = DataSaver()
+                self._on_recording_saved(*saver.save_batch_to_xlsx(specimens_to_save, filepath, calibration_info))
+
+    def _on_recording_saved(self, success, message):
+        # 6. Comunica il risultato all'utente
+        if success:
+            QMessageBox.information(self, "Salvataggio Riuscito", message)
+        else:
+            QMessageBox.critical(self, "Errore di Salvataggio", message)
 
     def showEvent(self, event):
         """ Questo metodo viene chiamato automaticamente quando il widget diventa visibile. """
         super().showEvent(event)
         print("DEBUG: ManualControlWidget mostrato, avvio timer del grafico.")
-        self.plot_start_time = 0 # Azzera il tempo per far ripartire il grafico
-        self.plot_update_timer.start()
+        self.plot_start_time = None # Azzera il tempo per far ripartire il grafico
+        if self.render_scheduler is None:
+            self.plot_update_timer.start()
 
     def hideEvent(self, event):
         """ Questo metodo viene chiamato automaticamente quando il widget viene nascosto. """
         super().hideEvent(event)
         print("DEBUG: ManualControlWidget nascosto, fermo timer del grafico.")
-        self.plot_update_timer.stop()   
+        self.plot_update_timer.stop()
+        if self.render_scheduler is not None:
+            self.render_scheduler.cancel(self._update_plot)
 
     def on_time_window_changed(self, value):
         self.time_window_seconds = value
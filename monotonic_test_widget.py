@@ -5,13 +5,21 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt, pyqtSignal, QLocale
 from PyQt6.QtGui import QFont, QDoubleValidator
-from data_saver import DataSaver
 from datetime import datetime
+import os
+import zipfile
 
 import pyqtgraph as pg
 import numpy as np
 
 from custom_widgets import DisplayWidget
+from recorder import TestRecorder
+from channel_store import CompressedTestRecorder
+from autosave_writer import FILE_EXTENSION, LiveAutosave
+from export_service import snapshot_specimens
+from session_file import SESSION_EXTENSION, load_session, save_session_job
+from export_backends import file_dialog_filter, path_for_filter
+from live_plot import IncrementalSeries, LodCurve, column_slice, resistance_slice
 
 
 
@@ -32,11 +40,12 @@ class MonotonicTestWidget(QWidget):
         self.specimens = {}
         self.current_specimen_name = None
         self.is_test_running = False
+        self.live_autosave = None # registrazione su disco del test in corso (autosave_writer.py)
         self.absolute_load_N = 0.0
         self.load_offset_N = 0.0
         self.absolute_displacement_mm = 0.0
         self.displacement_offset_mm = 0.0
-        self.current_test_data = []
+        self.current_test_data = TestRecorder()
         self.current_resistance_ohm = -999.0 # Per memorizzare l'ultimo valore LCR
         self.absolute_encoder_displacement_mm = None # Canale encoder esterno (sola lettura, Livello 1)
         self.encoder_displacement_offset_mm = 0.0 # Zero relativo del canale encoder
@@ -204,6 +213,9 @@ class MonotonicTestWidget(QWidget):
 
 
         self.plot_curve = self.plot_widget.plot(pen='b'); self.plot_widget.showGrid(x=True, y=True)
+        # Zoom/pan/resize: ricalcola il livello di dettaglio delle curve (una volta per frame)
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(self._on_plot_view_changed)
+        self.plot_widget.getViewBox().sigResized.connect(self._on_plot_view_changed)
         graph_controls_layout = QHBoxLayout()
         self.x_axis_combo = QComboBox(); self.x_axis_combo.addItems(["Relative Displacement (mm)", "Strain (%)"])
         self.y_axis_combo = QComboBox(); self.y_axis_combo.addItems(["Relative Load (N)", "Stress (MPa)"])
@@ -262,6 +274,10 @@ class MonotonicTestWidget(QWidget):
         self.resistance_axis_viewbox = None # La ViewBox per la resistenza
         self.resistance_axis_item = None    # L'AxisItem a destra
         self.resistance_curve = None
+        # Buffer di visualizzazione incrementali del test in corso (nome serie -> IncrementalSeries)
+        self.live_series = {}
+        # Livelli di dettaglio min/max delle curve disegnate (curva pyqtgraph -> LodCurve)
+        self.lod_curves = {}
 
 
 
@@ -277,12 +293,18 @@ class MonotonicTestWidget(QWidget):
         self.limits_button = QPushButton("LIMITS"); self.limits_button.setFont(button_font)
         self.limits_button.setStyleSheet("background-color: #F39C12; color: white;") # Colore per evidenziarlo
         self.finish_save_button = QPushButton("FINISH & SAVE"); self.finish_save_button.setFont(button_font)
+        self.save_session_button = QPushButton("SAVE SESSION"); self.save_session_button.setFont(button_font)
+        self.open_session_button = QPushButton("OPEN SESSION"); self.open_session_button.setFont(button_font)
+        self.import_button = QPushButton("IMPORT"); self.import_button.setFont(button_font)
         self.back_button = QPushButton("Back to Menu"); self.back_button.setFont(button_font)
 
         bottom_buttons_layout.addWidget(self.zero_rel_load_button)
         bottom_buttons_layout.addWidget(self.zero_rel_disp_button)
         bottom_buttons_layout.addStretch(1)
         bottom_buttons_layout.addWidget(self.limits_button)
+        bottom_buttons_layout.addWidget(self.import_button)
+        bottom_buttons_layout.addWidget(self.open_session_button)
+        bottom_buttons_layout.addWidget(self.save_session_button)
         bottom_buttons_layout.addWidget(self.finish_save_button)
 
         # --- ASSEMBLAGGIO FINALE ---
@@ -312,6 +334,9 @@ class MonotonicTestWidget(QWidget):
         self.specimen_list.itemClicked.connect(self.on_specimen_selected)
         self.start_button.clicked.connect(self.on_start_test)
         self.finish_save_button.clicked.connect(self.on_finish_and_save)
+        self.save_session_button.clicked.connect(self.on_save_session)
+        self.open_session_button.clicked.connect(self.on_open_session)
+        self.import_button.clicked.connect(self.on_import_results)
         self.lcr_enable_checkbox.stateChanged.connect(self._on_lcr_checkbox_changed)
        
         #self.stop_button.clicked.connect(self.on_stop_test)
@@ -397,17 +422,19 @@ class MonotonicTestWidget(QWidget):
             QMessageBox.critical(self, "Error", f"Stop criterion '{specimen['stop_criterion_unit']}' not yet implemented.")
             return
 
-        self.current_test_data = []
+        self.current_test_data = TestRecorder()
+        self.main_window.ingest_stats.reset() # contatori di integrità dello stream, per questo test
+        self._start_live_autosave()
         # Svuota solo le curve del test corrente (una per sorgente X attiva), non tutte
         for source in self._active_x_sources():
-            self._get_or_create_curve(self.current_specimen_name, source, self._active_x_sources()).setData([], [])
+            self._set_curve_data(self._get_or_create_curve(self.current_specimen_name, source, self._active_x_sources()), [], [])
         if self.resistance_curve:
-            self.resistance_curve.setData([], [])
+            self._set_curve_data(self.resistance_curve, [], [], self.resistance_axis_viewbox)
 
         # ✅ invio sempre valori convertiti e corretti per il firmware
         command = f"START_TEST:SPEED_MMS={speed_mms:.3f};CRITERION={criterion_str};STOP_VAL={stop_val_for_fw:.3f}"
         self.send_command(command)
-        self.send_command("SET_MODE:STREAMING")
+        self.send_command(self.main_window.streaming_mode_command())
 
         self.is_test_running = True
         print("DEBUG: avvio test, is_test_running =", self.is_test_running)
@@ -443,20 +470,41 @@ class MonotonicTestWidget(QWidget):
         self.update_ui_for_test_state()
 
         if self.current_specimen_name:
-            self.specimens[self.current_specimen_name]['test_data'] = self.current_test_data
+            # Il test concluso passa allo storico compresso senza perdita
+            # (channel_store.py), nel thread dell'ExportService per non fermare
+            # la GUI: fino ad allora resta il registratore del test
+            mw = self.main_window
+            recorder = self.current_test_data
+            self.specimens[self.current_specimen_name]['test_data'] = recorder
+            mw.export_service.compress_recorder(
+                recorder, lambda compressed: self._on_test_compressed(recorder, compressed),
+                pulses_to_mm=mw.PULSES_TO_MM, screw_pitch_mm=mw.SCREW_PITCH_MM,
+                encoder_counts_per_rev=mw.ENCODER_COUNTS_PER_REV)
+            self.specimens[self.current_specimen_name]['ingest_stats'] = self.main_window.ingest_stats.snapshot()
+
+            # Chiude la registrazione su disco scritta durante il test
+            recording_path = None
+            if self.live_autosave is not None:
+                if self.live_autosave.finish({"ingest_stats": self.specimens[self.current_specimen_name]['ingest_stats']}):
+                    recording_path = self.live_autosave.path
+                self.live_autosave = None
 
                 # --- NUOVO: LOGICA DI AUTOSAVE ---
-            try:
-                specimen_to_save = {self.current_specimen_name: self.specimens[self.current_specimen_name]}
-                # Crea un nome di file automatico
-                filename = f"AUTOSAVE_{self.current_specimen_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-
-                saver = DataSaver()
-                # Salva il singolo provino usando la stessa logica del batch
-                saver.save_batch_to_xlsx(specimen_to_save, filename, self.active_calibration_info)
-                print(f"DEBUG: Autosave completato per {self.current_specimen_name} in {filename}")
-            except Exception as e:
-                print(f"ERRORE AUTOSAVE: {e}")
+            # Conversione opzionale in xlsx (settings["autosave_xlsx"]): dalla
+            # registrazione su disco se integra, altrimenti dai dati in memoria.
+            # Accodata all'ExportService: la scrittura avviene in background
+            if self.main_window.settings.get("autosave_xlsx", True):
+                export_service = self.main_window.export_service
+                if recording_path:
+                    filename = os.path.splitext(recording_path)[0] + ".xlsx"
+                    export_service.export_recording(recording_path, filename)
+                else:
+                    specimen_to_save = {self.current_specimen_name: self.specimens[self.current_specimen_name]}
+                    # Crea un nome di file automatico
+                    filename = f"AUTOSAVE_{self.current_specimen_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+                    # Salva il singolo provino usando la stessa logica del batch
+                    export_service.export_specimens(specimen_to_save, filename, self.active_calibration_info)
+                print(f"DEBUG: Autosave accodato per {self.current_specimen_name} in {filename}")
             # --- FINE AUTOSAVE ---
 
             specimen = self.specimens[self.current_specimen_name]
@@ -465,7 +513,25 @@ class MonotonicTestWidget(QWidget):
         # Aggiorna il grafico in base al provino selezionato e all'overlay
         self.refresh_plot()    
 
-    def handle_stream_data(self, load_N, disp_mm, time_s, cycle_count, resistance_ohm, encoder_disp_mm=None):
+    def _start_live_autosave(self):
+        """ Apre la registrazione su disco del test (chunk periodici, recuperabile dopo un crash). """
+        setup = {k: v for k, v in self.specimens[self.current_specimen_name].items()
+                 if k not in ("test_data", "ingest_stats")}
+        filename = f"AUTOSAVE_{self.current_specimen_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FILE_EXTENSION}"
+        try:
+            self.live_autosave = LiveAutosave(
+                self.current_test_data, filename,
+                {"specimen_name": self.current_specimen_name, "test_type": "monotonic",
+                 "specimen": setup, "calibration_info": self.active_calibration_info},
+                self.main_window.settings.get("autosave_interval_s", 5.0), self)
+        except OSError as e:
+            self.live_autosave = None
+            print(f"ERRORE AUTOSAVE: impossibile creare {filename}: {e}")
+
+    def handle_stream_data(self, load_N, disp_mm, time_s, cycle_count, resistance_ohm, encoder_disp_mm=None,
+                           host_time_s=None):
+        # Il tempo del test è `time_s` del firmware (azzerato a START_TEST): `host_time_s`
+        # (istante sull'orologio dell'host, clock_sync.py) non entra nella registrazione
         if not self.is_test_running:
             return
 
@@ -477,12 +543,18 @@ class MonotonicTestWidget(QWidget):
         relative_disp = disp_mm - self.displacement_offset_mm
         relative_load = load_N - self.load_offset_N
 
-        # Salva la tupla, con il tempo all'indice 0 e il canale encoder in coda
-        # (accanto, non al posto, dello spostamento stimato a passi)
-        self.current_test_data.append((time_s, relative_disp, relative_load, disp_mm, load_N, resistance_ohm, encoder_disp_mm))
+        # Accoda il campione al registratore colonnare; l'encoder resta un canale
+        # a sé (accanto, non al posto, dello spostamento stimato a passi)
+        self.current_test_data.append(time_s, relative_disp, relative_load, disp_mm, load_N,
+                                      resistance_ohm, encoder_disp_mm)
+
+        # Il grafico viene ridisegnato una volta per frame dal RenderScheduler
+        # condiviso, non a ogni pacchetto (i display li richiede MainWindow)
+        self.main_window.render_scheduler.request(self._render_live_frame)
 
-        # Aggiorna la curva del grafico in tempo reale
-        if self.current_specimen_name in self.specimens:
+    def _render_live_frame(self):
+        """ Porta le curve live allo stato corrente (una volta per frame). """
+        if self.is_test_running and self.current_specimen_name in self.specimens:
             specimen = self.specimens[self.current_specimen_name]
             area = specimen.get("area", 1.0)
             gauge = specimen.get("gauge_length", 1.0)
@@ -491,49 +563,62 @@ class MonotonicTestWidget(QWidget):
             y_mode = self.y_axis_combo.currentText()
             active_sources = self._active_x_sources()
 
-            # Carico Relativo è all'indice 2, invariato qualunque sia la sorgente X
-            y_raw_data = [p[2] for p in self.current_test_data]
-            if "Stress" in y_mode and area > 0:
-                y_data_final = [(f / area) for f in y_raw_data]
-            else:
-                y_data_final = y_raw_data
+            # Parametri di conversione: se cambiano, le serie live vengono
+            # ricalcolate per intero; altrimenti si trasformano solo i nuovi campioni
+            key = (x_mode, y_mode, gauge, area, self.encoder_displacement_offset_mm)
+            strain_scale = (100.0 / gauge) if ("Strain" in x_mode and gauge > 0) else None
 
-            def compute_x(source):
+            # Carico Relativo, invariato qualunque sia la sorgente X
+            y_transform = column_slice("rel_load_N", scale=(1.0 / area) if ("Stress" in y_mode and area > 0) else None)
+
+            def x_transform(source):
                 if source == "encoder":
-                    # Encoder assoluto all'indice 6, reso relativo con l'offset corrente
-                    raw = [
-                        (p[6] - self.encoder_displacement_offset_mm) if len(p) > 6 and p[6] is not None else np.nan
-                        for p in self.current_test_data
-                    ]
-                else:
-                    raw = [p[1] for p in self.current_test_data]  # spostamento relativo a passi motore
-                if "Strain" in x_mode and gauge > 0:
-                    return [(d / gauge) * 100 for d in raw]
-                return raw
+                    # Encoder assoluto (NaN se assente), reso relativo con l'offset corrente
+                    return column_slice("encoder_disp_mm", strain_scale, self.encoder_displacement_offset_mm)
+                return column_slice("rel_disp_mm", strain_scale)  # spostamento relativo a passi motore
 
-            x_data_final = None
             for source in active_sources:
-                x_data_final = compute_x(source)
-                self._get_or_create_curve(self.current_specimen_name, source, active_sources).setData(x_data_final, y_data_final)
+                series = self._live_series(source, x_transform(source), y_transform)
+                x_data_final, y_data_final = series.update(self.current_test_data, key + (source,))
+                self._set_curve_data(self._get_or_create_curve(self.current_specimen_name, source, active_sources),
+                                     x_data_final, y_data_final, revision=(id(series), series.revision))
 
             self.plot_widget.setLabel("bottom", x_mode)
             self.plot_widget.setLabel("left", y_mode)
             if self.resistance_curve and self.lcr_enable_checkbox.isChecked():
                 try:
-                    # Estrai i dati di resistenza (indice 5); usa la sorgente "motor" per l'asse X
-                    # condiviso con la resistenza se attiva, altrimenti l'unica sorgente selezionata
+                    # Usa la sorgente "motor" per l'asse X condiviso con la resistenza
+                    # se attiva, altrimenti l'unica sorgente selezionata
                     resistance_source = "motor" if "motor" in active_sources else active_sources[0]
-                    x_for_resistance = compute_x(resistance_source)
-                    r_raw_data = [p[5] for p in self.current_test_data]
-                    r_data_final = [r if r >= 0 else np.nan for r in r_raw_data]
-                    self.resistance_curve.setData(x_for_resistance, r_data_final)
+                    series = self._live_series("resistance", x_transform(resistance_source), resistance_slice)
+                    x_for_resistance, r_data_final = series.update(self.current_test_data, key + (resistance_source,))
+                    self._set_curve_data(self.resistance_curve, x_for_resistance, r_data_final,
+                                         self.resistance_axis_viewbox, revision=(id(series), series.revision))
                 except Exception as e:
                     print(f"Errore aggiornamento curva resistenza live (Mono): {e}")
 
-        # Aggiorna i display numerici (i contatori)
-        self.update_displays()
-        
+    def _live_series(self, name, x_transform, y_transform):
+        """ Serie live `name` con le trasformazioni correnti (creata al primo uso). """
+        series = self.live_series.get(name)
+        if series is None:
+            series = self.live_series[name] = IncrementalSeries(x_transform, y_transform)
+        else:
+            series.set_transforms(x_transform, y_transform)
+        return series
+
+    def _set_curve_data(self, curve, x, y, viewbox=None, revision=None):
+        """ Imposta i dati di una curva passando dalla sua piramide min/max (LodCurve). """
+        lod = self.lod_curves.get(curve)
+        if lod is None:
+            lod = self.lod_curves[curve] = LodCurve(curve, viewbox or self.plot_widget.getViewBox())
+        lod.set_data(x, y, revision=revision)
 
+    def _on_plot_view_changed(self, *args):
+        self.main_window.render_scheduler.request(self._render_lod_curves)
+
+    def _render_lod_curves(self):
+        for lod in list(self.lod_curves.values()):
+            lod.render()
 
     # --- UI STATE ---
     def update_ui_for_test_state(self):
@@ -550,7 +635,8 @@ class MonotonicTestWidget(QWidget):
             self.specimen_list, self.back_button, self.name_edit,
             self.gauge_length_edit, self.area_edit, self.speed_spinbox,
             self.speed_unit_combo, self.stop_criterion_spinbox,
-            self.stop_criterion_combo, self.return_to_start_checkbox, self.zero_rel_load_button,  self.zero_rel_disp_button, self.finish_save_button, self.limits_button
+            self.stop_criterion_combo, self.return_to_start_checkbox, self.zero_rel_load_button,  self.zero_rel_disp_button, self.finish_save_button, self.limits_button,
+            self.save_session_button, self.open_session_button, self.import_button
         ]
         for widget in widgets_to_toggle:
             widget.setEnabled(not is_running)
@@ -817,7 +903,8 @@ class MonotonicTestWidget(QWidget):
                 "gauge_length": new_gauge_length,
                 "area": new_area,
                 "return_to_start": self.return_to_start_checkbox.isChecked(),
-                "test_data": original.get("test_data")
+                "test_data": original.get("test_data"),
+                "ingest_stats": original.get("ingest_stats")
             }
 
             if not already_tested:
@@ -938,12 +1025,14 @@ class MonotonicTestWidget(QWidget):
 
         
         test_data = data.get("test_data")
-        if test_data:
-            x_data = [p[0] for p in test_data]
-            y_data = [p[1] for p in test_data]
-            self.plot_curve.setData(x_data, y_data)
-        else:
-            self.plot_curve.clear() 
+        try:
+            if test_data:
+                self.plot_curve.setData(test_data.time_s, test_data.rel_disp_mm)
+            else:
+                self.plot_curve.clear()
+        except ValueError as e: # file di sessione spostato o sovrascritto (LazyTestRecorder)
+            self.plot_curve.clear()
+            print(f"Errore lettura dati {self.current_specimen_name} (Mono): {e}")
         # Aggiorna il grafico in base al provino selezionato e all'overlay
         self.refresh_plot()      
 
@@ -1007,6 +1096,7 @@ class MonotonicTestWidget(QWidget):
         self.plot_widget.clear() 
         self.plot_widget.addLegend() # Ri-aggiungi la legenda pulita
         self.plot_curves = {}        # Azzera dizionario curve salvate
+        self.lod_curves = {}
 
         # --- 2. Imposta Assi Principali ---
         x_mode = self.x_axis_combo.currentText()
@@ -1019,24 +1109,17 @@ class MonotonicTestWidget(QWidget):
             area = specimen.get("area", 1.0)
             gauge = specimen.get("gauge_length", 1.0)
             if not raw_data: return [], [], []
-            try:
-                if source == "encoder":
-                    x_raw = [
-                        (p[6] - self.encoder_displacement_offset_mm) if len(p) > 6 and p[6] is not None else np.nan
-                        for p in raw_data
-                    ]
-                else:
-                    x_raw = [p[1] for p in raw_data] # rel_disp (motore)
-                y_raw = [p[2] for p in raw_data] # rel_load
-                r_raw = [p[5] for p in raw_data] # resistance
-            except (IndexError, TypeError) as e:
-                print(f"Errore estrazione dati in convert_data (monotonico): {e}")
-                return [], [], []
-            if "Strain" in x_mode and gauge > 0: x = [(d / gauge) * 100 for d in x_raw]
+            if source == "encoder":
+                x_raw = raw_data.encoder_disp_mm - self.encoder_displacement_offset_mm
+            else:
+                x_raw = raw_data.rel_disp_mm # rel_disp (motore)
+            y_raw = raw_data.rel_load_N
+            r_raw = raw_data.resistance_ohm
+            if "Strain" in x_mode and gauge > 0: x = (x_raw / gauge) * 100
             else: x = x_raw
-            if "Stress" in y_mode and area > 0: y = [(f / area) for f in y_raw]
+            if "Stress" in y_mode and area > 0: y = y_raw / area
             else: y = y_raw
-            r_data = [r if r >= 0 else np.nan for r in r_raw]
+            r_data = np.where(r_raw >= 0, r_raw, np.nan)
             return x, y, r_data
 
         # --- 4. Logica Overlay/Disegno Curve Principali (una curva per sorgente X attiva) ---
@@ -1048,7 +1131,8 @@ class MonotonicTestWidget(QWidget):
                     for source in active_sources:
                         try:
                             x, y, _ = convert_data(specimen, specimen["test_data"], source)
-                            curve = self.plot_widget.plot(x, y, pen=self._pen_for_source(name, source), name=self._curve_label(name, source, active_sources))
+                            curve = self.plot_widget.plot([], [], pen=self._pen_for_source(name, source), name=self._curve_label(name, source, active_sources))
+                            self._set_curve_data(curve, x, y)
                             self.plot_curves[(name, source)] = curve
                         except Exception as e: print(f"Errore disegno overlay {name}/{source} (Mono): {e}")
         else:
@@ -1058,7 +1142,8 @@ class MonotonicTestWidget(QWidget):
                     for source in active_sources:
                         try:
                             x, y, _ = convert_data(specimen, specimen["test_data"], source)
-                            curve = self.plot_widget.plot(x, y, pen=self._pen_for_source(self.current_specimen_name, source), name=self._curve_label(self.current_specimen_name, source, active_sources))
+                            curve = self.plot_widget.plot([], [], pen=self._pen_for_source(self.current_specimen_name, source), name=self._curve_label(self.current_specimen_name, source, active_sources))
+                            self._set_curve_data(curve, x, y)
                             self.plot_curves[(self.current_specimen_name, source)] = curve
                         except Exception as e: print(f"Errore disegno non-overlay {self.current_specimen_name}/{source} (Mono): {e}")
 
@@ -1106,7 +1191,7 @@ class MonotonicTestWidget(QWidget):
                                 # Crea una NUOVA curva (NON self.resistance_curve)
                                 overlay_res_curve = pg.PlotDataItem(pen=pg.mkPen('orange', width=1, style=Qt.PenStyle.DotLine))
                                 self.resistance_axis_viewbox.addItem(overlay_res_curve)
-                                overlay_res_curve.setData(x, r_data)
+                                self._set_curve_data(overlay_res_curve, x, r_data, self.resistance_axis_viewbox)
                             except Exception as e: print(f"Errore disegno overlay resistenza {name} (Mono): {e}")
                 else: # Non overlay
                     if self.current_specimen_name:
@@ -1115,7 +1200,7 @@ class MonotonicTestWidget(QWidget):
                             try:
                                 x, _, r_data = convert_data(specimen, specimen["test_data"])
                                 # Usa la curva self.resistance_curve per i dati salvati
-                                self.resistance_curve.setData(x, r_data)
+                                self._set_curve_data(self.resistance_curve, x, r_data, self.resistance_axis_viewbox)
                             except Exception as e: print(f"Errore disegno non-overlay resistenza {self.current_specimen_name} (Mono): {e}")
             
             except Exception as e:
@@ -1131,15 +1216,26 @@ class MonotonicTestWidget(QWidget):
                 for source in active_sources:
                     x_live, y_live, r_live = convert_data(specimen, self.current_test_data, source)
                     curve = self._get_or_create_curve(self.current_specimen_name, source, active_sources)
-                    curve.setData(x_live, y_live)
+                    self._set_curve_data(curve, x_live, y_live)
                     if self.resistance_curve and (source == "motor" or "motor" not in active_sources):
-                        self.resistance_curve.setData(x_live, r_live)
+                        self._set_curve_data(self.resistance_curve, x_live, r_live, self.resistance_axis_viewbox)
             except Exception as e:
                 print(f"Errore aggiornamento dati live (Mono - refresh_plot): {e}")
 
+    def _on_test_compressed(self, recorder, compressed):
+        """ Sostituisce il registratore del test concluso con la versione compressa (ExportService). """
+        for specimen in self.specimens.values():
+            if specimen.get("test_data") is recorder: # non rimpiazzato da un nuovo test o da un import
+                specimen["test_data"] = compressed
+        if self.current_test_data is recorder:
+            self.current_test_data = compressed
+
     def on_overlay_item_changed(self, item):
         name = item.text()
         self.specimens[name]["visible"] = (item.checkState() == Qt.CheckState.Checked)
+        test_data = self.specimens[name].get("test_data")
+        if not self.specimens[name]["visible"] and isinstance(test_data, CompressedTestRecorder):
+            test_data.release() # nascosto: restano solo i dati compressi
         self.refresh_plot()
 
     def get_pen_for_specimen(self, name):
@@ -1229,6 +1325,115 @@ class MonotonicTestWidget(QWidget):
 
 
 
+    # --- SESSIONE (salvataggio/riapertura del batch, vedi session_file.py) ---
+    def _session_state(self):
+        """ Stato del widget salvato nella sessione insieme ai provini. """
+        return {
+            "test_type": "monotonic",
+            "calibration_info": self.active_calibration_info,
+            "load_offset_N": self.load_offset_N,
+            "displacement_offset_mm": self.displacement_offset_mm,
+            "encoder_displacement_offset_mm": self.encoder_displacement_offset_mm,
+        }
+
+    def on_save_session(self):
+        if not self.specimens:
+            QMessageBox.information(self, "Info", "Nessun provino da salvare.")
+            return
+        default_filename = f"Session_{datetime.now().strftime('%Y-%m-%d_%H%M')}{SESSION_EXTENSION}"
+        filepath, _ = QFileDialog.getSaveFileName(self, "Salva Sessione Test", default_filename,
+                                                  f"UTM Session (*{SESSION_EXTENSION})")
+        if filepath:
+            # Scrittura in background su una copia dei provini, come gli export
+            try:
+                specimens, state = snapshot_specimens(self.specimens), self._session_state()
+            except ValueError as e: # file di sessione spostato o sovrascritto (LazyTestRecorder)
+                self._on_batch_saved(False, str(e))
+                return
+            self.main_window.export_service.submit(
+                filepath, lambda progress: save_session_job(filepath, specimens, state),
+                on_finished=self._on_batch_saved)
+
+    def on_open_session(self):
+        if self.specimens:
+            reply = QMessageBox.question(
+                self, "Apri Sessione",
+                "Il batch corrente verrà sostituito dalla sessione aperta. Continuare?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            if reply != QMessageBox.StandardButton.Yes:
+                return
+        filepath, _ = QFileDialog.getOpenFileName(self, "Apri Sessione Test", "",
+                                                  f"UTM Session (*{SESSION_EXTENSION})")
+        if not filepath:
+            return
+        try:
+            specimens, state = load_session(filepath)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            QMessageBox.critical(self, "Errore", f"Impossibile aprire la sessione: {e}")
+            return
+        if state.get("test_type") != "monotonic":
+            QMessageBox.warning(self, "Errore", "La sessione non contiene test di questo tipo.")
+            return
+
+        # I dati dei provini restano nel file finché non servono (grafico/export)
+        self.specimens = specimens
+        self.load_offset_N = state.get("load_offset_N", 0.0)
+        self.displacement_offset_mm = state.get("displacement_offset_mm", 0.0)
+        self.encoder_displacement_offset_mm = state.get("encoder_displacement_offset_mm", 0.0)
+        # Calibrazione con cui il batch è stato registrato: è quella che finisce negli export della sessione
+        self.set_calibration_status(state.get("calibration_info", self.active_calibration_info))
+        self.current_specimen_name = None
+        self.specimen_list.clear()
+        self.overlay_list.blockSignals(True) # itemChanged aggiornerebbe "visible" e il grafico a ogni riga
+        self.overlay_list.clear()
+        for name, data in specimens.items():
+            self.specimen_list.addItem(name)
+            item = QListWidgetItem(name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if data.get("visible", True) else Qt.CheckState.Unchecked)
+            self.overlay_list.addItem(item)
+        self.overlay_list.blockSignals(False)
+        self.refresh_plot()
+
+    # --- IMPORT (autosave/batch precedenti per il confronto, vedi data_importer.py) ---
+    def on_import_results(self):
+        filepaths, _ = QFileDialog.getOpenFileNames(self, "Importa Risultati", "",
+                                                    "Risultati Test (*.xlsx *.csv)")
+        if not filepaths:
+            return
+        # Lettura nel thread dell'export: la GUI resta libera durante l'import
+        self.main_window.export_service.import_files(filepaths, self._on_results_imported)
+
+    def _on_results_imported(self, results, errors):
+        """ Aggiunge al batch i provini importati da `on_import_results()` (thread GUI). """
+        imported = []
+        for specimens in results:
+            for name, data in specimens.items():
+                if "test_sequence_setup" not in data:
+                    imported.append((name, data))
+
+        self.overlay_list.blockSignals(True) # itemChanged aggiornerebbe "visible" e il grafico a ogni riga
+        for name, data in imported:
+            # Nome già presente nel batch: il provino importato non lo sovrascrive
+            unique_name, i = name, 1
+            while unique_name in self.specimens:
+                unique_name = f"{name} (imported)" if i == 1 else f"{name} (imported {i})"
+                i += 1
+            data["name"] = unique_name
+            self.specimens[unique_name] = data
+            self.specimen_list.addItem(unique_name)
+            item = QListWidgetItem(unique_name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked)
+            self.overlay_list.addItem(item)
+        self.overlay_list.blockSignals(False)
+        self.refresh_plot()
+
+        if errors:
+            QMessageBox.warning(self, "Importazione", "Impossibile importare:\n" + "\n".join(errors))
+        elif not imported:
+            QMessageBox.warning(self, "Importazione", "I file selezionati non contengono test di questo tipo.")
+
     def on_finish_and_save(self):
         if not self.specimens:
             QMessageBox.information(self, "Info", "Nessun provino da salvare.")
@@ -1238,15 +1443,32 @@ class MonotonicTestWidget(QWidget):
         default_filename = f"Batch_{datetime.now().strftime('%Y-%m-%d_%H%M')}.xlsx"
 
         # Apre la finestra di dialogo per il salvataggio
-        filepath, _ = QFileDialog.getSaveFileName(self, "Salva Batch di Test", default_filename, "Excel Files (*.xlsx)")
+        filepath, selected_filter = QFileDialog.getSaveFileName(self, "Salva Batch di Test", default_filename,
+                                                              file_dialog_filter())
 
         if filepath:
-            saver = DataSaver()
-            success, message = saver.save_batch_to_xlsx(self.specimens, filepath, self.active_calibration_info)
-            if success:
-                QMessageBox.information(self, "Successo", message)
-            else:
-                QMessageBox.critical(self, "Errore", message)
+            # Formato dall'estensione (xlsx, csv, npz, parquet; vedi export_backends.py)
+            filepath = path_for_filter(filepath, selected_filter)
+            # Export in background: l'esito arriva a _on_batch_saved
+            export_service = self.main_window.export_service
+            # Il riepilogo per provino è un workbook: solo per l'export xlsx
+            try: # la copia legge i provini di sessione non ancora caricati
+                if (self.main_window.settings.get("batch_export_mode") == "per_specimen"
+                        and filepath.lower().endswith(".xlsx")):
+                    # Un file per provino in parallelo + riepilogo in `filepath`
+                    export_service.export_batch_per_specimen(
+                        self.specimens, filepath, self.active_calibration_info, on_finished=self._on_batch_saved)
+                else:
+                    export_service.export_specimens(
+                        self.specimens, filepath, self.active_calibration_info, on_finished=self._on_batch_saved)
+            except ValueError as e: # file di sessione spostato o sovrascritto (LazyTestRecorder)
+                self._on_batch_saved(False, str(e))
+
+    def _on_batch_saved(self, success, message):
+        if success:
+            QMessageBox.information(self, "Successo", message)
+        else:
+            QMessageBox.critical(self, "Errore", message)
 
 
     def _on_lcr_checkbox_changed(self, state):
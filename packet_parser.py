@@ -0,0 +1,318 @@
+# packet_parser.py
+
+import time
+
+import numpy as np
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+from binary_protocol import ENCODER_ABSENT, decode_records
+from clock_sync import ClockSync
+from latency_tracer import EMITTED, PARSE_START, PARSED
+
+# Un campione `D:` già convertito in unità fisiche. L'encoder assente
+# (pacchetti storici a meno di 6 campi, o campo non parsabile) è NaN; il
+# numero di sequenza assente (pacchetti senza 7° campo) è -1. `host_s` è
+# l'istante di acquisizione sull'orologio monotonico dell'host
+# (`clock_sync.ClockSync`), NaN se non disponibile.
+SAMPLE_DTYPE = np.dtype([
+    ("load_N", np.float64),
+    ("disp_mm", np.float64),
+    ("time_s", np.float64),
+    ("cycle", np.int64),
+    ("resistance_ohm", np.float64),
+    ("encoder_disp_mm", np.float64),
+    ("seq", np.int64),
+    ("host_s", np.float64),
+])
+
+SEQ_MODULUS = 2**32  # i numeri di sequenza del firmware sono uint32
+
+
+def parse_data_payload(payload, pulses_to_mm, screw_pitch_mm, encoder_counts_per_rev):
+    """
+    Converte il payload di un pacchetto `D:` (senza il prefisso) in
+    `(load_N, disp_mm, time_s, cycle, resistance_ohm, encoder_disp_mm, seq)`.
+    Parsing flessibile a 3/4/5/6/7 campi come nel firmware storico;
+    `encoder_disp_mm` e `seq` sono `None` se assenti. Solleva `ValueError`
+    se il pacchetto non è interpretabile.
+    """
+    parts = payload.split(';')
+
+    cycle_count = 0
+    resistance_ohm = -999.0 # Valore default/fallback
+    encoder_count = None # Assente sui pacchetti storici (< 6 campi)
+    seq = None # Assente sui pacchetti storici (< 7 campi)
+
+    if len(parts) == 7: # 7° campo: numero di sequenza dello streaming
+        seq = int(parts.pop())
+    if len(parts) == 6: # Formato con encoder esterno (Livello 1)
+        load_str, disp_str, time_ms_str, cycle_str, res_str, enc_str = parts
+        cycle_count = int(cycle_str)
+        try: resistance_ohm = float(res_str)
+        except ValueError: resistance_ohm = -2.0 # Errore parsing resistenza
+        try: encoder_count = int(enc_str)
+        except ValueError: encoder_count = None # Errore parsing encoder, tratta come assente
+    elif len(parts) == 5: # Formato con LCR, senza encoder (storico)
+        load_str, disp_str, time_ms_str, cycle_str, res_str = parts
+        cycle_count = int(cycle_str)
+        try: resistance_ohm = float(res_str)
+        except ValueError: resistance_ohm = -2.0 # Errore parsing resistenza
+    elif len(parts) == 4: # Vecchio formato streaming
+        load_str, disp_str, time_ms_str, cycle_str = parts
+        cycle_count = int(cycle_str)
+    elif len(parts) == 3: # Formato Polling
+        load_str, disp_str, time_ms_str = parts
+    else:
+        raise ValueError(f"Pacchetto D: attesi da 3 a 7 valori, ricevuti {len(parts)}")
+
+    load_N = (float(load_str) / 1000.0) * 9.81
+    displacement_mm = int(disp_str) * pulses_to_mm
+    time_s = float(time_ms_str) / 1000.0
+    encoder_displacement_mm = (
+        (encoder_count / encoder_counts_per_rev) * screw_pitch_mm
+        if encoder_count is not None else None
+    )
+    return load_N, displacement_mm, time_s, cycle_count, resistance_ohm, encoder_displacement_mm, seq
+
+
+def samples_from_records(records, pulses_to_mm, screw_pitch_mm, encoder_counts_per_rev):
+    """
+    Converte un array di record binari (`binary_protocol.RECORD_DTYPE`) in
+    un array `SAMPLE_DTYPE`, con le stesse conversioni di
+    `parse_data_payload()` ma vettoriali sull'intero blocco.
+    """
+    samples = np.empty(len(records), dtype=SAMPLE_DTYPE)
+    samples["load_N"] = (records["load_g"].astype(np.float64) / 1000.0) * 9.81
+    samples["disp_mm"] = records["pulses"] * pulses_to_mm
+    samples["time_s"] = records["time_ms"] / 1000.0
+    samples["cycle"] = records["cycle"]
+    samples["resistance_ohm"] = records["resistance_ohm"]
+    encoder = records["encoder"]
+    samples["encoder_disp_mm"] = np.where(
+        encoder == ENCODER_ABSENT, np.nan, (encoder / encoder_counts_per_rev) * screw_pitch_mm)
+    samples["seq"] = records["seq"]
+    samples["host_s"] = np.nan
+    return samples
+
+
+class IngestStats:
+    """
+    Contatori di integrità dello stream `D:` per il test in corso: campioni
+    ricevuti, persi (buchi nei numeri di sequenza), duplicati o fuori
+    ordine, righe/record scartati dal parsing e campioni senza numero di
+    sequenza (pacchetti storici o polling). Vive nel thread GUI ed è
+    azzerato a ogni avvio test; `snapshot()` finisce nei metadati
+    dell'export.
+
+    I campioni senza sequenza arrivati dopo `reset()` ma prima del primo
+    campione con sequenza (risposte a `GET_DATA` ancora in volo mentre il
+    firmware passa in streaming) sono tolti dal conteggio appena lo stream
+    sequenziato parte; se non parte mai restano `unsequenced`.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.parse_errors = 0
+        self.unsequenced = 0
+        self._last_seq = None
+        self._leading = 0 # campioni senza sequenza prima del primo sequenziato
+
+    def update(self, seq):
+        """ Conta un lotto di numeri di sequenza (array, -1 = assente), in ordine di arrivo. """
+        seq = np.asarray(seq, dtype=np.int64)
+        self.received += len(seq)
+        valid = seq[seq >= 0]
+        self.unsequenced += len(seq) - len(valid)
+        if self._last_seq is None:
+            if not len(valid):
+                self._leading += len(seq)
+                return
+            # primo campione sequenziato: il polling rimasto in coda non fa parte dello stream
+            leading = self._leading + int(np.argmax(seq >= 0))
+            self.received -= leading
+            self.unsequenced -= leading
+            self._leading = 0
+            steps = np.diff(valid)
+        elif not len(valid):
+            return
+        else:
+            steps = np.diff(valid, prepend=self._last_seq)
+        steps %= SEQ_MODULUS  # passo in avanti, anche attraverso il wrap-around
+        backwards = (steps == 0) | (steps >= SEQ_MODULUS // 2)
+        self.duplicates += int(np.count_nonzero(backwards))
+        self.lost += int((steps[~backwards] - 1).sum())
+        self._last_seq = int(valid[-1])
+
+    def record_parse_error(self, count=1):
+        self.parse_errors += count
+
+    @property
+    def is_lossless(self):
+        """ Vero solo se ogni campione aveva un numero di sequenza e non ci sono anomalie. """
+        return (self.received > 0 and self.lost == 0 and self.duplicates == 0
+                and self.parse_errors == 0 and self.unsequenced == 0)
+
+    def snapshot(self):
+        """ Copia dei contatori (dizionario), da salvare con il provino. """
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "duplicates": self.duplicates,
+            "parse_errors": self.parse_errors,
+            "unsequenced": self.unsequenced,
+            "lossless": self.is_lossless,
+        }
+
+
+class PacketParser(QObject):
+    """
+    Interpreta le righe ricevute da `SerialCommunicator` in un thread
+    dedicato, fuori dal thread GUI.
+
+    I pacchetti `D:` (righe ASCII o blocchi di record binari, vedi
+    `binary_protocol.py`) vengono convertiti e accumulati; ogni
+    `FLUSH_INTERVAL_MS` il lotto viene consegnato alla GUI con **un solo**
+    segnale `samples_ready` (array NumPy strutturato `SAMPLE_DTYPE`). Le
+    altre righe (`STATUS:` e simili) sono inoltrate subito con
+    `line_received`, dopo aver consegnato i campioni arrivati prima di loro,
+    così l'ordine relativo dati/stato resta quello del firmware.
+
+    Ogni lettura arriva con l'istante dell'host in cui è avvenuta; al flush
+    `clock_sync` (`ClockSync`) ne ricava per ogni campione l'istante di
+    acquisizione sull'orologio dell'host (`host_s`). Le coppie `GET_DATA` →
+    risposta `D:` segnalate da `note_command()` ne misurano la latenza.
+
+    Con un `LatencyTracer` attivo le tracce delle letture che hanno prodotto
+    campioni passano, con gli istanti di parsing e di flush, al lotto emesso.
+    """
+
+    samples_ready = pyqtSignal(object)
+    line_received = pyqtSignal(str)
+    parse_error = pyqtSignal(str)
+
+    FLUSH_INTERVAL_MS = 15
+
+    def __init__(self, pulses_to_mm, screw_pitch_mm, encoder_counts_per_rev, latency_tracer=None):
+        super().__init__()
+        self.pulses_to_mm = pulses_to_mm
+        self.screw_pitch_mm = screw_pitch_mm
+        self.encoder_counts_per_rev = encoder_counts_per_rev
+        self._pending = []   # righe D: ASCII già convertite (tuple)
+        self._batches = []   # blocchi già convertiti, in ordine di arrivo
+        self._traces = []    # tracce di latenza delle letture nei blocchi in attesa
+        self.latency_tracer = latency_tracer
+        self.clock_sync = ClockSync()
+        self._request = None # [istante di invio, campioni ricevuti, istante della prima risposta] dell'ultimo GET_DATA
+        self._flush_timer = None
+
+    @pyqtSlot()
+    def start(self):
+        """ Da collegare a `QThread.started`: il timer deve nascere nel thread del parser. """
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setInterval(self.FLUSH_INTERVAL_MS)
+        self._flush_timer.timeout.connect(self.flush)
+        self._flush_timer.start()
+
+    @pyqtSlot()
+    def stop(self):
+        """ Ferma il timer (nel thread del parser) e consegna gli ultimi campioni. """
+        if self._flush_timer is not None:
+            self._flush_timer.stop()
+            self._flush_timer.deleteLater()
+            self._flush_timer = None
+        self.flush()
+
+    @pyqtSlot(str, float)
+    def note_command(self, command, sent_s):
+        """
+        Comando scritto sulla porta all'istante `sent_s` (`command_sent`). Un
+        `GET_DATA` a cui ha risposto un solo campione prima del successivo è
+        una misura del tempo di andata e ritorno per `clock_sync`; in
+        streaming (più campioni per intervallo) non si misura nulla.
+        """
+        if command != "GET_DATA":
+            return
+        request = self._request
+        if request is not None and request[1] == 1:
+            self.clock_sync.add_round_trip(request[0], request[2])
+        self._request = [sent_s, 0, None]
+
+    @pyqtSlot(object, float)
+    def handle_lines(self, lines, host_time=None):
+        """
+        Riceve un lotto (una lettura seriale) da `SerialCommunicator.lines_received`:
+        righe di testo (`str`), blocchi di record binari validati (`bytes`) e
+        byte scartati dal framer durante una risincronizzazione (`int`).
+        `host_time` è l'istante della lettura (`time.monotonic()`); se manca
+        vale l'istante di arrivo qui.
+        """
+        if host_time is None:
+            host_time = time.monotonic()
+        tracer = self.latency_tracer
+        traces = tracer.take(lines) if tracer is not None and tracer.enabled else None
+        if traces:
+            tracer.stamp(traces, PARSE_START)
+        produced = False # la lettura ha lasciato campioni nel lotto in attesa
+        samples = 0
+        for line in lines:
+            if isinstance(line, int):
+                self.parse_error.emit(f"<{line} byte scartati: record binario non valido>")
+            elif isinstance(line, bytes):
+                self._close_pending()
+                block = samples_from_records(
+                    decode_records(line), self.pulses_to_mm, self.screw_pitch_mm, self.encoder_counts_per_rev)
+                block["host_s"] = host_time # istante di arrivo, allineato al flush
+                self._batches.append(block)
+                produced = True
+                samples += len(block)
+            elif line.startswith("D:"):
+                try:
+                    load_N, disp_mm, time_s, cycle, resistance_ohm, encoder_disp_mm, seq = parse_data_payload(
+                        line[2:], self.pulses_to_mm, self.screw_pitch_mm, self.encoder_counts_per_rev)
+                except (ValueError, IndexError):
+                    self.parse_error.emit(line)
+                    continue
+                self._pending.append((load_N, disp_mm, time_s, cycle, resistance_ohm,
+                                      np.nan if encoder_disp_mm is None else encoder_disp_mm,
+                                      -1 if seq is None else seq, host_time))
+                produced = True
+                samples += 1
+            else:
+                self.flush()
+                produced = False
+                self.line_received.emit(line)
+        request = self._request
+        if request is not None and samples:
+            if not request[1]:
+                request[2] = host_time
+            request[1] += samples
+        if traces and produced:
+            # la traccia segue i campioni della lettura fino alla GUI
+            tracer.stamp(traces, PARSED)
+            self._traces.extend(traces)
+
+    @pyqtSlot()
+    def flush(self):
+        """ Consegna i campioni accumulati (se ce ne sono) come un unico lotto. """
+        self._close_pending()
+        if not self._batches:
+            return
+        batch = self._batches[0] if len(self._batches) == 1 else np.concatenate(self._batches)
+        self._batches = []
+        batch["host_s"] = self.clock_sync.align(batch["time_s"], batch["host_s"])
+        if self._traces:
+            traces, self._traces = self._traces, []
+            self.latency_tracer.stamp(traces, EMITTED)
+            self.latency_tracer.attach(batch, traces)
+        self.samples_ready.emit(batch)
+
+    def _close_pending(self):
+        """ Chiude le righe ASCII accumulate in un blocco, per mantenere l'ordine con quelli binari. """
+        if self._pending:
+            self._batches.append(np.array(self._pending, dtype=SAMPLE_DTYPE))
+            self._pending = []
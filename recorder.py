@@ -0,0 +1,175 @@
+# recorder.py
+
+import numpy as np
+
+
+class TestRecorder:
+    """
+    Registratore colonnare dei campioni di un test (monotonico, ciclico o
+    registrazione manuale). Sostituisce le vecchie liste di tuple a 7/9
+    elementi: ogni canale è una riga di un unico array NumPy preallocato,
+    che cresce per raddoppio quando si riempie, così l'accodamento di un
+    campione costa O(1) ammortizzato e la lettura di una colonna è una
+    vista senza copia.
+    """
+
+    # Ordine fisso delle colonne: è il "modello colonne" condiviso da
+    # widget, grafici ed export (vedi docs/recorder.md).
+    COLUMNS = (
+        "time_s",           # tempo dall'avvio del test (s)
+        "rel_disp_mm",      # spostamento relativo a passi motore
+        "rel_load_N",       # carico relativo
+        "abs_disp_mm",      # spostamento assoluto a passi motore
+        "abs_load_N",       # carico assoluto
+        "cycle",            # ciclo corrente (0 fuori dai test ciclici)
+        "block",            # blocco della sequenza, 1-based (0 fuori dai test ciclici)
+        "resistance_ohm",   # resistenza LCR (codici negativi = N/A/errore)
+        "encoder_disp_mm",  # encoder esterno ASSOLUTO (NaN se assente nel pacchetto)
+    )
+    COLUMN_INDEX = {name: i for i, name in enumerate(COLUMNS)}
+
+    __test__ = False  # non è una classe di test pytest, nonostante il nome
+
+    def __init__(self, initial_capacity=4096):
+        self._data = np.empty((len(self.COLUMNS), max(int(initial_capacity), 16)), dtype=np.float64)
+        self._size = 0
+
+    # --- ACCODAMENTO ---
+    def append(self, time_s, rel_disp, rel_load, abs_disp, abs_load,
+               resistance_ohm=-999.0, encoder_disp_mm=None, cycle=0, block=0):
+        """ Accoda un singolo campione (percorso live, un pacchetto D:). """
+        if self._size == self._data.shape[1]:
+            self._grow(self._size + 1)
+        col = self._data[:, self._size]
+        col[0] = time_s
+        col[1] = rel_disp
+        col[2] = rel_load
+        col[3] = abs_disp
+        col[4] = abs_load
+        col[5] = cycle
+        col[6] = block
+        col[7] = resistance_ohm
+        col[8] = np.nan if encoder_disp_mm is None else encoder_disp_mm
+        self._size += 1
+
+    def extend(self, **columns):
+        """
+        Accoda un blocco di campioni passati come array per colonna
+        (stessi nomi di COLUMNS). Le colonne mancanti prendono il valore di
+        default di append() (cycle/block 0, resistenza -999, encoder NaN).
+        """
+        lengths = {len(np.atleast_1d(v)) for v in columns.values()}
+        if not lengths:
+            return
+        if len(lengths) != 1:
+            raise ValueError(f"Colonne di lunghezza diversa: {sorted(lengths)}")
+        n = lengths.pop()
+        if n == 0:
+            return
+        unknown = set(columns) - set(self.COLUMNS)
+        if unknown:
+            raise ValueError(f"Colonne sconosciute: {sorted(unknown)}")
+        if self._size + n > self._data.shape[1]:
+            self._grow(self._size + n)
+        start, stop = self._size, self._size + n
+        for name, i in self.COLUMN_INDEX.items():
+            if name in columns:
+                self._data[i, start:stop] = columns[name]
+            else:
+                self._data[i, start:stop] = self._default_for(name)
+        self._size = stop
+
+    def clear(self):
+        """ Svuota il registratore mantenendo la capacità già allocata. """
+        self._size = 0
+
+    # --- LETTURA ---
+    def column(self, name):
+        """ Vista (senza copia) sui valori validi di una colonna. """
+        return self._data[self.COLUMN_INDEX[name], :self._size]
+
+    def columns(self):
+        """ Dizionario nome -> vista, nell'ordine di COLUMNS. """
+        return {name: self.column(name) for name in self.COLUMNS}
+
+    def row(self, index):
+        """ Un singolo campione come tupla (per debug/compatibilità). """
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return tuple(self._data[:, index].tolist())
+
+    def chunk(self, start, stop=None):
+        """ Copia (colonne x campioni, nell'ordine di COLUMNS) dei campioni [start:stop]. """
+        stop = self._size if stop is None else min(stop, self._size)
+        return self._data[:, start:stop].copy()
+
+    @property
+    def time_s(self): return self.column("time_s")
+    @property
+    def rel_disp_mm(self): return self.column("rel_disp_mm")
+    @property
+    def rel_load_N(self): return self.column("rel_load_N")
+    @property
+    def abs_disp_mm(self): return self.column("abs_disp_mm")
+    @property
+    def abs_load_N(self): return self.column("abs_load_N")
+    @property
+    def cycle(self): return self.column("cycle")
+    @property
+    def block(self): return self.column("block")
+    @property
+    def resistance_ohm(self): return self.column("resistance_ohm")
+    @property
+    def encoder_disp_mm(self): return self.column("encoder_disp_mm")
+
+    def copy(self):
+        """ Copia indipendente, con capacità pari ai soli dati presenti. """
+        other = TestRecorder(initial_capacity=max(self._size, 16))
+        other._data[:, :self._size] = self._data[:, :self._size]
+        other._size = self._size
+        return other
+
+    @classmethod
+    def from_rows(cls, rows, cyclic=False):
+        """
+        Converte le vecchie liste di tuple (7 elementi monotonico/manuale,
+        9 ciclico) in un registratore. Utile per dati prodotti prima
+        dell'introduzione di questa classe.
+        """
+        recorder = cls(initial_capacity=max(len(rows), 16))
+        for r in rows:
+            if cyclic and len(r) == 9:
+                recorder.append(r[0], r[1], r[2], r[3], r[4], r[7], r[8], cycle=r[5], block=r[6])
+            elif not cyclic and len(r) == 7:
+                recorder.append(r[0], r[1], r[2], r[3], r[4], r[5], r[6])
+            else:
+                recorder.append(*r[:5])
+        return recorder
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __repr__(self):
+        return f"TestRecorder(samples={self._size}, capacity={self._data.shape[1]})"
+
+    # --- INTERNI ---
+    def _grow(self, min_capacity):
+        new_capacity = self._data.shape[1]
+        while new_capacity < min_capacity:
+            new_capacity *= 2
+        new_data = np.empty((len(self.COLUMNS), new_capacity), dtype=np.float64)
+        new_data[:, :self._size] = self._data[:, :self._size]
+        self._data = new_data
+
+    @staticmethod
+    def _default_for(name):
+        if name == "resistance_ohm":
+            return -999.0
+        if name == "encoder_disp_mm":
+            return np.nan
+        return 0.0
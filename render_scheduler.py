@@ -0,0 +1,66 @@
+# render_scheduler.py
+
+from PyQt6.QtCore import QObject, QTimer
+
+
+class RenderScheduler(QObject):
+    """
+    Timer di ridisegno condiviso da tutti i widget di test.
+
+    Il percorso di ingest (`handle_stream_data`) si limita ad accodare i
+    campioni e a "marcare sporco" il widget con `request(callback)`; una
+    volta per frame il timer chiama ogni callback in attesa **una sola
+    volta**, qualunque sia il numero di pacchetti arrivati nel frattempo.
+    Così la frequenza di `setData()` verso pyqtgraph dipende dal frame rate
+    configurato, non dalla frequenza dello stream seriale.
+
+    Con un `LatencyTracer` attivo, la fine di ogni frame con callback viene
+    segnalata con `frame_rendered()`.
+    """
+
+    DEFAULT_FPS = 30
+
+    def __init__(self, fps=DEFAULT_FPS, parent=None, latency_tracer=None):
+        super().__init__(parent)
+        self.latency_tracer = latency_tracer
+        self._pending = {}  # callback -> None (dict per mantenere l'ordine di richiesta)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._on_frame)
+        self.set_fps(fps)
+
+    def set_fps(self, fps):
+        """ Imposta il frame rate massimo di ridisegno (clamp 1..120 fps). """
+        self.fps = max(1, min(120, int(fps)))
+        self._timer.setInterval(round(1000 / self.fps))
+
+    def request(self, callback):
+        """
+        Marca `callback` da eseguire al prossimo frame. Richieste ripetute
+        prima del frame vengono unite in una sola chiamata.
+        """
+        self._pending[callback] = None
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def cancel(self, callback):
+        """ Rimuove una richiesta in attesa (es. widget nascosto o test fermato). """
+        self._pending.pop(callback, None)
+
+    def flush(self):
+        """ Esegue subito tutte le richieste in attesa, senza attendere il frame. """
+        self._on_frame()
+
+    def _on_frame(self):
+        if not self._pending:
+            # Nessun widget sporco: il timer si ferma e ripartirà alla prossima request()
+            self._timer.stop()
+            return
+        pending, self._pending = self._pending, {}
+        for callback in pending:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Errore durante il ridisegno ({getattr(callback, '__qualname__', callback)}): {e}")
+        tracer = self.latency_tracer
+        if tracer is not None and tracer.enabled:
+            tracer.frame_rendered()
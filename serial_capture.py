@@ -0,0 +1,281 @@
+# serial_capture.py
+
+import json
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from PyQt6.QtCore import QMetaObject, QObject, Qt, pyqtSignal, pyqtSlot
+
+from communication import LineFramer
+
+# --- FORMATO FILE .utmcap (little-endian) ---
+#
+#   header : MAGIC | u32 lunghezza | JSON (porta, baud, ora di inizio)
+#   corpo  : stream zlib di record
+#            u8 direzione | u64 ns dall'inizio (orologio monotonico) | u32 byte | byte
+#
+# Ogni lettura della porta è un record IN con i byte esattamente come sono
+# arrivati (righe, record binari, frammenti), ogni comando inviato un record
+# OUT. Lo stream zlib è svuotato (Z_SYNC_FLUSH) almeno ogni
+# FLUSH_INTERVAL_S: dopo un crash si perde al più quell'ultimo tratto, e la
+# lettura si ferma all'ultimo record completo.
+MAGIC = b"UTMCAP01"
+FILE_EXTENSION = ".utmcap"
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+FLUSH_INTERVAL_S = 1.0
+ZLIB_LEVEL = 1 # compressione nel thread seriale: deve costare poco
+
+_RECORD_HEADER = struct.Struct("<BQI")
+
+# Record letto da un file .utmcap: `t` in secondi dall'inizio della cattura
+CaptureRecord = namedtuple("CaptureRecord", ["t", "direction", "data"])
+
+
+class CaptureWriter:
+    """
+    Cattura su file `.utmcap` del traffico seriale grezzo, in entrambe le
+    direzioni, con timestamp dell'orologio monotonico dell'host. Scritta da
+    `SerialCommunicator` nel suo thread (letture e comandi in coda) e dal
+    thread GUI (`send_emergency_stop()`): ogni scrittura è protetta da un
+    lock, e dopo `close()` le scritture sono ignorate.
+    """
+
+    def __init__(self, path, **metadata):
+        self.path = path
+        self.records = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+        self._origin_ns = time.monotonic_ns()
+        self._last_flush = time.monotonic()
+        self._compressor = zlib.compressobj(ZLIB_LEVEL)
+        header = dict(metadata, version=1, started=datetime.now().isoformat(timespec="seconds"))
+        payload = json.dumps(header).encode("utf-8")
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + struct.pack("<I", len(payload)) + payload)
+        self._file.flush()
+
+    def write_inbound(self, data):
+        """ Byte di una lettura della porta, così come sono arrivati. """
+        self._write(DIRECTION_IN, data)
+
+    def write_outbound(self, data):
+        """ Byte di un comando inviato all'ESP32 (terminatore compreso). """
+        self._write(DIRECTION_OUT, data)
+
+    def _write(self, direction, data):
+        t_ns = time.monotonic_ns() - self._origin_ns
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(self._compressor.compress(_RECORD_HEADER.pack(direction, t_ns, len(data))))
+            self._file.write(self._compressor.compress(data))
+            self.records += 1
+            if direction == DIRECTION_IN:
+                self.bytes_in += len(data)
+            else:
+                self.bytes_out += len(data)
+            now = time.monotonic()
+            if now - self._last_flush >= FLUSH_INTERVAL_S:
+                self._file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+                self._file.flush()
+                self._last_flush = now
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.write(self._compressor.flush())
+            finally:
+                self._file.close()
+                self._file = None
+
+
+class CaptureReader:
+    """
+    Lettura sequenziale di un file `.utmcap`: `header` è il dizionario
+    dell'intestazione, l'iterazione restituisce i `CaptureRecord` in ordine.
+    Un file troncato (crash, cattura ancora aperta) si legge fino all'ultimo
+    record completo.
+    """
+
+    READ_SIZE = 1 << 20
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: non è un file di cattura seriale")
+            (length,) = struct.unpack("<I", file.read(4))
+            self.header = json.loads(file.read(length).decode("utf-8"))
+            self._body_offset = file.tell()
+
+    def __iter__(self):
+        decompressor = zlib.decompressobj()
+        buffer = bytearray()
+        start = 0
+        with open(self.path, "rb") as file:
+            file.seek(self._body_offset)
+            while True:
+                chunk = file.read(self.READ_SIZE)
+                if not chunk:
+                    return
+                try:
+                    buffer += decompressor.decompress(chunk)
+                except zlib.error:
+                    return # coda corrotta: ci si ferma all'ultimo record completo
+                while len(buffer) - start >= _RECORD_HEADER.size:
+                    direction, t_ns, size = _RECORD_HEADER.unpack_from(buffer, start)
+                    end = start + _RECORD_HEADER.size + size
+                    if end > len(buffer):
+                        break
+                    yield CaptureRecord(t_ns / 1e9, direction, bytes(buffer[start + _RECORD_HEADER.size:end]))
+                    start = end
+                del buffer[:start]
+                start = 0
+
+
+class _ThreadBarrier(QObject):
+    """ Slot vuoto nel thread in cui è creato: invocarlo in modo bloccante attende gli eventi già in coda. """
+
+    @pyqtSlot()
+    def ping(self):
+        pass
+
+
+class CaptureReplaySource(QObject):
+    """
+    Sorgente di riproduzione di una cattura `.utmcap`, da eseguire in un
+    `QThread` al posto di `SerialCommunicator`: `lines_received` e
+    `command_sent` hanno la stessa firma e vanno collegati a
+    `PacketParser.handle_lines`/`note_command`, quindi righe
+    e record percorrono la stessa pipeline della porta reale (parser,
+    `MainWindow.handle_sample_batch()` / `handle_data_from_esp32()`, widget).
+
+    I byte ricevuti sono ri-smontati da un `LineFramer` nuovo e consegnati
+    all'istante di cattura diviso `speed` (1 = tempo reale); con
+    `speed=None` il più in fretta possibile. I comandi registrati (OUT) non
+    vengono riprodotti, ma segnalati con `command_sent`. Gli istanti emessi
+    sono quelli della cattura (secondi dall'inizio), non quelli del replay:
+    la sincronizzazione degli orologi vede i tempi originali a ogni velocità.
+
+    Va creata nel thread GUI: a velocità massima, o quando la riproduzione
+    resta indietro di oltre `MAX_LAG_S`, dopo ogni lotto attende che il
+    parser (`flush` di `barrier_objects`) e il thread GUI abbiano smaltito
+    quanto ricevuto, così la misura è il throughput dell'intera pipeline e
+    le code Qt non crescono senza limite.
+
+    Con `latency_tracer` attivo ogni lotto consegnato è tracciato come una
+    lettura della porta (istante di consegna e di framing).
+    """
+
+    lines_received = pyqtSignal(object, float)
+    command_sent = pyqtSignal(str, float)
+    finished = pyqtSignal(object) # dizionario con i contatori della riproduzione
+
+    MAX_BATCH_BYTES = 64 * 1024 # byte per lotto quando la riproduzione è in ritardo o a velocità massima
+    MAX_LAG_S = 0.5
+
+    def __init__(self, path, speed=1.0, barrier_objects=(), latency_tracer=None):
+        super().__init__()
+        self.reader = CaptureReader(path)
+        self.speed = speed if speed else None
+        self.is_running = True
+        self._barrier_objects = list(barrier_objects)
+        self.latency_tracer = latency_tracer
+        self._gui_barrier = _ThreadBarrier() # creato qui, vive nel thread GUI
+
+    def stop(self):
+        self.is_running = False
+
+    @pyqtSlot()
+    def run(self):
+        framer = LineFramer()
+        speed = self.speed
+        origin = time.perf_counter()
+        records = bytes_in = items = batches = 0
+        capture_end = received_at = 0.0
+        pending = bytearray()
+        for record in self.reader:
+            if not self.is_running:
+                break
+            capture_end = record.t
+            if record.direction != DIRECTION_IN:
+                # Le risposte ricevute prima del comando arrivano al parser prima di lui (coppie GET_DATA -> D:)
+                delivered = self._deliver(framer, pending, received_at)
+                if delivered:
+                    items += delivered
+                    batches += 1
+                self.command_sent.emit(record.data.decode("utf-8", "replace").rstrip("\n"), record.t)
+                continue
+            records += 1
+            bytes_in += len(record.data)
+            received_at = record.t
+            lag = 0.0
+            if speed is not None:
+                due = origin + record.t / speed
+                if not pending:
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                lag = time.perf_counter() - due
+            pending += record.data
+            if speed is not None and lag <= self.MAX_LAG_S:
+                behind = False
+            else:
+                behind = True
+                if len(pending) < self.MAX_BATCH_BYTES:
+                    continue # in ritardo: accumula come un arretrato della porta seriale
+            delivered = self._deliver(framer, pending, received_at)
+            if delivered:
+                items += delivered
+                batches += 1
+                if behind:
+                    self._drain()
+        if self.is_running:
+            delivered = self._deliver(framer, pending, received_at)
+            if delivered:
+                items += delivered
+                batches += 1
+        self._drain()
+        elapsed = time.perf_counter() - origin
+        self.finished.emit({
+            "path": self.reader.path,
+            "speed": speed,
+            "records": records,
+            "bytes": bytes_in,
+            "items": items,
+            "batches": batches,
+            "capture_duration_s": capture_end,
+            "elapsed_s": elapsed,
+            "completed": self.is_running,
+        })
+
+    def _deliver(self, framer, pending, received_at):
+        """ Smonta i byte accumulati in `pending` (svuotandolo) ed emette le righe complete; ritorna quante. """
+        if not pending:
+            return 0
+        tracer = self.latency_tracer
+        t_read = tracer.now() if tracer is not None and tracer.enabled else 0
+        lines = framer.feed(pending)
+        size = len(pending)
+        pending.clear()
+        if not lines:
+            return 0
+        if t_read:
+            tracer.begin(lines, t_read, size)
+        self.lines_received.emit(lines, received_at)
+        return len(lines)
+
+    def _drain(self):
+        """ Attende che parser e thread GUI abbiano elaborato i lotti già emessi. """
+        for obj in self._barrier_objects:
+            QMetaObject.invokeMethod(obj, "flush", Qt.ConnectionType.BlockingQueuedConnection)
+        if self.is_running:
+            QMetaObject.invokeMethod(self._gui_barrier, "ping", Qt.ConnectionType.BlockingQueuedConnection)
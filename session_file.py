@@ -0,0 +1,182 @@
+# session_file.py
+
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+from channel_store import FILE_EXTENSION as CHANNEL_EXTENSION, ChannelStore, CompressedTestRecorder
+from recorder import TestRecorder
+
+# --- FORMATO FILE .utmsession (archivio zip) ---
+#
+#   manifest.json      : formato/versione, stato del widget (sequenza, offset,
+#                        calibrazione) e indice dei provini: setup (JSON),
+#                        voce dei dati nell'archivio, numero di campioni
+#   data/<n>.utmch     : colonne del TestRecorder del provino n, archivio
+#                        compresso senza perdita di `channel_store.py`
+#                        (memorizzato senza deflate: è già compresso)
+#
+# Versione 1: `data/<n>.npy`, array float64 (colonne x campioni) compresso
+# con deflate; ancora leggibile.
+#
+# All'apertura si legge solo il manifest: i dati di ogni provino vengono
+# letti e decompressi al primo accesso (LazyTestRecorder).
+SESSION_EXTENSION = ".utmsession"
+FORMAT_NAME = "utm-session"
+FORMAT_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+
+
+def _json_default(value):
+    """ Serializzazione tollerante del setup (tipi NumPy, oggetti non JSON). """
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _file_stamp(file):
+    """ (dimensione, mtime in ns) di un file aperto. """
+    stat = os.fstat(file.fileno())
+    return stat.st_size, stat.st_mtime_ns
+
+
+class LazyTestRecorder(TestRecorder):
+    """
+    `TestRecorder` di un provino di una sessione, con i dati ancora nel
+    file: numero di campioni noto dall'indice, colonne lette dall'archivio
+    al primo accesso (grafico, export, copia). Dopo il caricamento si
+    comporta come un registratore normale.
+
+    `stamp` (dimensione, mtime in ns) è quello del file all'apertura della
+    sessione: se al caricamento il file manca o è stato sovrascritto (nuovo
+    salvataggio, cache di import rigenerata) l'indice non vale più e
+    `_load()` solleva `ValueError` invece di leggere dati di un altro
+    provino.
+    """
+
+    def __init__(self, path, entry, rows, stamp=None):
+        # Niente super().__init__(): `_data`/`_size` nascono in _load()
+        self._path = path
+        self._entry = entry
+        self._rows = rows
+        self._stamp = stamp
+
+    def __getattr__(self, name):
+        # Chiamato solo per attributi non ancora presenti: il primo accesso
+        # a `_data`/`_size` carica i dati dal file
+        if name in ("_data", "_size"):
+            self._load()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    @property
+    def is_loaded(self):
+        return "_data" in self.__dict__
+
+    def _load(self):
+        name = os.path.basename(self._path)
+        try:
+            with open(self._path, "rb") as file:
+                # Controllo sullo stesso file che viene letto (nessuna corsa con os.replace)
+                if self._stamp is not None and _file_stamp(file) != self._stamp:
+                    raise ValueError(f"{name}: file modificato dopo l'apertura, riaprire la sessione")
+                with zipfile.ZipFile(file) as archive:
+                    if self._entry.endswith(CHANNEL_EXTENSION):
+                        block = ChannelStore.from_bytes(archive.read(self._entry)).read()
+                    else: # sessioni versione 1
+                        with archive.open(self._entry) as entry:
+                            block = np.lib.format.read_array(entry)
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            raise ValueError(f"{name}: dati del provino non più leggibili ({e})") from e
+        data = np.empty((len(self.COLUMNS), max(block.shape[1], 16)), dtype=np.float64)
+        data[:, :block.shape[1]] = block
+        self._data = data
+        self._size = block.shape[1]
+
+    def __len__(self):
+        return self._size if self.is_loaded else self._rows
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        if self.is_loaded:
+            return super().__repr__()
+        return f"LazyTestRecorder(samples={self._rows}, entry={self._entry!r})"
+
+
+def save_session(path, specimens, state=None):
+    """
+    Salva un batch di provini (dizionario nome -> dati, come nei widget di
+    test) e lo `state` del widget (dizionario JSON: sequenza, offset, ...)
+    in `path`. Scrive su un file temporaneo e lo sostituisce a `path` solo
+    a salvataggio completato.
+    """
+    manifest = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "saved": datetime.now().isoformat(timespec="seconds"),
+        "columns": list(TestRecorder.COLUMNS),
+        "state": state or {},
+        "specimens": [],
+    }
+    temp_path = path + ".tmp"
+    # I dati sono già compressi (ChannelStore): deflate solo per il manifest
+    with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for i, (name, data) in enumerate(specimens.items()):
+            test_data = data.get("test_data")
+            if test_data is not None and not isinstance(test_data, TestRecorder):
+                # Compatibilità con le vecchie liste di tuple
+                test_data = TestRecorder.from_rows(test_data, cyclic="test_sequence_setup" in data)
+            entry = None
+            if test_data is not None:
+                entry = f"data/{i}{CHANNEL_EXTENSION}"
+                # Un test già compresso in memoria si scrive senza ricodificarlo
+                if isinstance(test_data, CompressedTestRecorder) and test_data.is_compressed:
+                    store = test_data.store
+                else:
+                    store = ChannelStore.from_recorder(test_data)
+                archive.writestr(entry, store.to_bytes())
+            manifest["specimens"].append({
+                "name": name,
+                "setup": {key: value for key, value in data.items() if key != "test_data"},
+                "data": entry,
+                "rows": len(test_data) if test_data is not None else 0,
+            })
+        archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=1, default=_json_default),
+                         compress_type=zipfile.ZIP_DEFLATED)
+    os.replace(temp_path, path)
+
+
+def load_session(path):
+    """
+    Apre una sessione salvata con `save_session()`. Restituisce
+    `(specimens, state)`; `test_data` di ogni provino è un
+    `LazyTestRecorder` (o `None` se il provino non era stato testato).
+    Solleva `ValueError` se il file non è una sessione di una versione
+    supportata.
+    """
+    with open(path, "rb") as file, zipfile.ZipFile(file) as archive:
+        stamp = _file_stamp(file)
+        manifest = json.loads(archive.read(MANIFEST_NAME))
+    if manifest.get("format") != FORMAT_NAME or manifest.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"{os.path.basename(path)} non è un file di sessione supportato")
+    if manifest.get("columns") != list(TestRecorder.COLUMNS):
+        raise ValueError(f"{os.path.basename(path)}: colonne dati non compatibili con questa versione")
+
+    specimens = {}
+    for item in manifest["specimens"]:
+        data = dict(item["setup"])
+        data["test_data"] = (LazyTestRecorder(path, item["data"], item["rows"], stamp)
+                             if item["data"] is not None else None)
+        specimens[item["name"]] = data
+    return specimens, manifest.get("state", {})
+
+
+def save_session_job(path, specimens, state=None):
+    """ `save_session()` come job di `ExportService` (ritorna `(ok, messaggio)`). """
+    save_session(path, specimens, state)
+    return True, f"Sessione salvata in {path}"
@@ -16,7 +16,16 @@ class SettingsManager:
                 "100N": [0.0, 1398.0],
                 "200N": [0.0, 1398.0]
             },
-            "filter_config": {"alpha": 0.5, "rate_sps": 320, "gain": 128}
+            "filter_config": {"alpha": 0.5, "rate_sps": 320, "gain": 128},
+            "plot_refresh_fps": 30,
+            "binary_streaming": False,
+            "autosave_interval_s": 5.0,
+            "autosave_xlsx": True,
+            "chart_max_points": 4000,
+            "batch_export_mode": "single",
+            "extra_serial_ports": [],
+            "serial_capture": False,
+            "latency_tracing": False
         }
 
     def load_settings(self):